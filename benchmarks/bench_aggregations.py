@@ -0,0 +1,78 @@
+"""
+Microbenchmark aggregate_by_geo_id over the 15 output geographies, with the
+rounded mean as a Python callable (the old path) and as ROUNDED_MEAN.
+tests/test_data.py checks that both give the same frames.
+
+    python benchmarks/bench_aggregations.py [n_parcels]
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from synthetic import make_analytic_dataset
+
+from lib.data import ROUNDED_MEAN, aggregate_by_geo_id, mean_and_round
+from lib.variables import process_data
+
+# base_dataset geo id column of each of the 15 layers in main.CONFIG.layer_mapping
+GEO_COLUMNS = [
+    "geo_id_b2020",
+    "geo_id_bg2020",
+    "geo_id_t2020",
+    "geo_id_b2010",
+    "geo_id_bg2010",
+    "geo_id_t2010",
+    "pu_2324_848",
+    "sch_id_base_es",
+    "sch_id_zone",
+    "sch_id_gt_es",
+    "sch_id_base_ms",
+    "sch_id_gt_ms",
+    "sch_id_base_hs",
+    "sch_id_gt_hs",
+    "region",
+]
+
+
+def aggregations(rounded_mean) -> dict:
+    return {
+        "du_est_final": ["sum", "mean"],
+        "TOTAL_PROP_VALUE": ["sum", "mean"],
+        "unit_val": ["sum", "mean"],
+        "unit_val_cat_single": rounded_mean,
+        "unit_val_cat_multi": rounded_mean,
+    }
+
+
+def aggregate_by_geo_id_legacy(df: pd.DataFrame, geo_layer: str, agg: dict):
+    """
+    Function reproducing aggregate_by_geo_id before the native rounded mean.
+    """
+    agg_df = df.groupby(geo_layer).agg(agg).reset_index()
+    agg_df.columns = [agg_df.columns[0][0]] + [
+        "_".join(col).strip() if type(col) is tuple else col
+        for col in agg_df.columns[1:]
+    ]
+    return agg_df
+
+
+def time_layers(func, df: pd.DataFrame, agg: dict) -> tuple:
+    start = time.perf_counter()
+    results = [func(df, geo_col, agg) for geo_col in GEO_COLUMNS]
+    return results, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 130_000
+    df = process_data(make_analytic_dataset(n))
+
+    _, legacy_s = time_layers(
+        aggregate_by_geo_id_legacy, df, aggregations(mean_and_round)
+    )
+    _, native_s = time_layers(aggregate_by_geo_id, df, aggregations(ROUNDED_MEAN))
+
+    print(f"{len(df)} parcels, {len(GEO_COLUMNS)} layers")
+    print(f"python callable: {legacy_s:6.2f}s")
+    print(f"native kernels:  {native_s:6.2f}s ({legacy_s / native_s:.1f}x)")
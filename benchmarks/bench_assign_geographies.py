@@ -0,0 +1,68 @@
+"""
+Benchmark assign_geographies: every parcel located in 15 boundary layers of
+Durham-like sizes, serially and over threads, and with a geopandas spatial
+join per layer. tests/test_data.py checks that both give the same assignment.
+
+    python benchmarks/bench_assign_geographies.py [n_parcels] [workers]
+"""
+
+import sys
+import time
+
+import geopandas as gpd
+
+from synthetic import make_parcels, make_boundary_layer
+
+from lib.data import assign_geographies
+
+# layer -> (geo id column, number of polygons), roughly as in DPS all layers
+LAYERS = {
+    "b2020": ("geo_id_b2020", 6_000),
+    "bg2020": ("geo_id_bg2020", 200),
+    "t2020": ("geo_id_t2020", 70),
+    "b2010": ("geo_id_b2010", 5_500),
+    "bg2010": ("geo_id_bg2010", 180),
+    "t2010": ("geo_id_t2010", 60),
+    "PU_2324_848": ("pu_2324_848", 848),
+    "ES_base_2223": ("sch_id_base_es", 30),
+    "ES_zone_2223": ("sch_id_zone", 8),
+    "ES_gt_2425": ("sch_id_gt_es", 30),
+    "MS_base_2223": ("sch_id_base_ms", 10),
+    "MS_gt_2526": ("sch_id_gt_ms", 10),
+    "HS_base_2223": ("sch_id_base_hs", 8),
+    "HS_gt_2526": ("sch_id_gt_hs", 8),
+    "regions_2025_26": ("region", 5),
+}
+
+
+def sjoin_reference(parcels: gpd.GeoDataFrame, layer: gpd.GeoDataFrame, geo_col):
+    """
+    Function to assign parcels to one layer with a geopandas spatial join.
+    """
+    points = gpd.GeoDataFrame(geometry=parcels.representative_point())
+    joined = gpd.sjoin(points, layer, how="left", predicate="intersects")
+    joined = joined.sort_values("index_right", kind="stable")
+    return joined[~joined.index.duplicated()].sort_index()[geo_col]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 130_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    parcels = make_parcels(n)
+    layer_mapping = {layer: geo_col for layer, (geo_col, _) in LAYERS.items()}
+    boundaries = {
+        layer: make_boundary_layer(parcels, n_polygons, geo_col, seed=i)
+        for i, (layer, (geo_col, n_polygons)) in enumerate(LAYERS.items())
+    }
+
+    print(f"{n} parcels, {len(LAYERS)} layers")
+    for w in [1, workers]:
+        start = time.perf_counter()
+        geographies = assign_geographies(parcels, boundaries, layer_mapping, workers=w)
+        print(f"assign_geographies, {w} worker(s): {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    for layer, geo_col in layer_mapping.items():
+        sjoin_reference(parcels, boundaries[layer], geo_col)
+    print(f"per-layer gpd.sjoin: {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,121 @@
+"""
+Compute percentiles, weighted means and medians and Gini coefficients of the
+unit values by every layer with lib.distribution, and with pandas
+groupby and a Python function per group as they would be written otherwise.
+tests/test_distribution.py checks that both give the same frames.
+
+    python benchmarks/bench_distribution.py [n_parcels]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic import make_parcels, make_du_est, make_acs_tables
+
+from main import CONFIG
+from lib.data import aggregate_by_geo_id, build_analytic_dataset, optimize_dtypes
+from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+
+AGG = {
+    "unit_val": ["p10", "p90", "median@du_est_final", "gini@du_est_final"],
+    "TOTAL_PROP_VALUE": ["mean@students2324", "gini"],
+}
+
+# relative difference allowed between float sums added up in another order
+RTOL = 1e-9
+
+
+def weighted_median(values: pd.Series, weights: pd.Series) -> float:
+    order = np.argsort(values.to_numpy())
+    values, weights = values.to_numpy()[order], weights.to_numpy()[order]
+    if weights.sum() == 0:
+        return np.nan
+    return values[np.searchsorted(np.cumsum(weights), weights.sum() / 2)]
+
+
+def gini(values: pd.Series, weights: pd.Series) -> float:
+    order = np.argsort(values.to_numpy())
+    values, weights = values.to_numpy()[order], weights.to_numpy()[order]
+    lorenz = np.cumsum(weights * values)
+    if weights.sum() == 0 or lorenz[-1] == 0:
+        return np.nan
+    below = np.concatenate([[0], lorenz[:-1]])
+    return 1 - (weights * (below + lorenz)).sum() / (weights.sum() * lorenz[-1])
+
+
+def naive(df: pd.DataFrame, geo_col: str) -> pd.DataFrame:
+    """
+    Function to compute AGG with groupby apply, a Python call per group.
+    """
+    unit_vals = df[df["unit_val"].notna()]
+    values = df[df["TOTAL_PROP_VALUE"].notna()]
+    du = unit_vals["du_est_final"].fillna(0)
+    students = values["students2324"].fillna(0)
+    grouped = unit_vals.groupby(geo_col)["unit_val"]
+    frame = pd.DataFrame(
+        {
+            "unit_val_p10": grouped.quantile(0.1),
+            "unit_val_p90": grouped.quantile(0.9),
+            "unit_val_median_by_du_est_final": grouped.apply(
+                lambda x: weighted_median(x, du[x.index])
+            ),
+            "unit_val_gini_by_du_est_final": grouped.apply(
+                lambda x: gini(x, du[x.index])
+            ),
+            "TOTAL_PROP_VALUE_mean_by_students2324": values.groupby(geo_col)[
+                "TOTAL_PROP_VALUE"
+            ].apply(
+                lambda x: (
+                    (x * students[x.index]).sum() / students[x.index].sum()
+                    if students[x.index].sum() > 0
+                    else np.nan
+                )
+            ),
+            "TOTAL_PROP_VALUE_gini": values.groupby(geo_col)["TOTAL_PROP_VALUE"].apply(
+                lambda x: gini(x, pd.Series(np.ones(len(x))))
+            ),
+        }
+    )
+    frame.index.name = geo_col
+    return frame.reset_index()
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    df = optimize_dtypes(
+        process_data(
+            optimize_dtypes(
+                build_analytic_dataset(parcels, du_est, *make_acs_tables(du_est))
+            )
+        ),
+        code_columns=QUARTILE_CODE_COLUMNS,
+    )
+
+    print(
+        f"{len(df)} parcels, {sum(len(funcs) for funcs in AGG.values())} aggregations"
+    )
+    print(f"{'layer':<18} {'groups':>7} {'sorted':>8} {'naive':>8}")
+    sorted_total = naive_total = 0
+    for layer in CONFIG.layer_mapping:
+        geo_col = CONFIG.layer_mapping[layer]
+        result, sorted_s = timed(aggregate_by_geo_id, df, geo_col, AGG)
+        _, naive_s = timed(naive, df, geo_col)
+        sorted_total += sorted_s
+        naive_total += naive_s
+        print(f"{layer:<18} {len(result):>7} {sorted_s:>7.3f}s {naive_s:>7.3f}s")
+    print(
+        f"{'all layers':<18} {'':>7} {sorted_total:>7.3f}s {naive_total:>7.3f}s "
+        f"({naive_total / sorted_total:.0f}x)"
+    )
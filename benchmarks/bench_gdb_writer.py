@@ -0,0 +1,76 @@
+"""
+Compare the legacy per-row fiona export with lib.writer.write_gdb_layer.
+tests/test_writer.py checks that both write the same layer.
+
+    python benchmarks/bench_gdb_writer.py [n_features]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+import fiona
+import geopandas as gpd
+
+from synthetic import make_layer
+
+from lib.data import convert_datetime_to_str
+from lib.writer import infer_gdb_schema, write_gdb_layer
+
+
+def write_gdb_layer_legacy(gdf: gpd.GeoDataFrame, path: str, layer: str) -> None:
+    """
+    Function reproducing the per-row export main.py used before lib.writer.
+    """
+    with fiona.open(
+        path,
+        "w",
+        driver="OpenFileGDB",
+        schema=infer_gdb_schema(gdf),
+        layer=layer,
+        crs=gdf.crs,
+    ) as dst:
+        for idx, row in gdf.iterrows():
+            dst.write(
+                {
+                    "geometry": row["geometry"].__geo_interface__,
+                    "properties": {
+                        col: row[col] for col in gdf.columns if col != "geometry"
+                    },
+                }
+            )
+
+
+def time_writer(writer, gdf: gpd.GeoDataFrame, path: str, **kwargs) -> float:
+    start = time.perf_counter()
+    writer(gdf, path, "layer", **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    gdf = convert_datetime_to_str(make_layer(n))
+    tmp = tempfile.mkdtemp()
+
+    try:
+        paths = {
+            name: os.path.join(tmp, f"{name}.gdb")
+            for name in ["legacy", "fiona_chunked", "columnar"]
+        }
+        timings = {
+            "legacy": time_writer(write_gdb_layer_legacy, gdf, paths["legacy"]),
+            "fiona_chunked": time_writer(
+                write_gdb_layer, gdf, paths["fiona_chunked"], use_pyogrio=False
+            ),
+            "columnar": time_writer(write_gdb_layer, gdf, paths["columnar"]),
+        }
+
+        for name, seconds in timings.items():
+            print(
+                f"{name:>14}: {seconds:8.2f}s "
+                f"({timings['legacy'] / seconds:5.1f}x vs legacy) for {n} features"
+            )
+    finally:
+        shutil.rmtree(tmp)
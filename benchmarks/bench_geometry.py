@@ -0,0 +1,63 @@
+"""
+Write a layer of boundaries dissolved from grid cells in every output format
+as read and after lib.geometry.optimize_geometry: vertices, size on disk and
+write time of each format. tests/test_geometry.py checks that the optimized
+boundaries still tile the area (a valid coverage) and cover the same area.
+
+    python benchmarks/bench_geometry.py [n_polygons] [simplify] [precision]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+from synthetic import make_coverage_layer
+
+from lib.geometry import count_vertices, optimize_geometry
+from lib.sinks import SINKS, path_size, write_layer
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    simplify = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    precision = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    layer = make_coverage_layer(n, "geo_id_b2020")
+    rng = np.random.default_rng(0)
+    for col in ["du_est_final", "TOTAL_PROP_VALUE", "unit_val"]:
+        layer[f"{col}_sum"] = rng.lognormal(10, 1, n)
+        layer[f"{col}_mean"] = rng.lognormal(8, 1, n)
+
+    seconds, optimized = timed(optimize_geometry, layer, simplify, precision)
+
+    print(
+        f"{n} polygons, simplify {simplify} ft, precision {precision} ft: "
+        f"{count_vertices(layer.geometry):,} -> "
+        f"{count_vertices(optimized.geometry):,} vertices in {seconds:.2f}s"
+    )
+    print(f"{'format':<12} {'size':>20} {'write':>18}")
+    tmp = tempfile.mkdtemp()
+    try:
+        for output_format, sink in SINKS.items():
+            sizes, writes = [], []
+            for name, gdf in [("as_read", layer), ("optimized", optimized)]:
+                path = os.path.join(tmp, name + (sink["extension"] or ".gdb"))
+                writes.append(write_layer(gdf, "layer", {output_format: path}))
+                sizes.append(path_size(path) / 2**20)
+            before, after = (seconds[output_format] for seconds in writes)
+            print(
+                f"{output_format:<12} {sizes[0]:6.2f} -> {sizes[1]:6.2f} MiB "
+                f"{before:6.3f} -> {after:6.3f}s"
+            )
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,112 @@
+"""
+Compare the peak resident memory and time of the merge chain that used to
+build the analytic dataset with the planned join of build_analytic_dataset,
+on synthetic inputs. Each variant runs in a fresh process; the peak is read
+from /proc, so this runs on Linux only. tests/test_data.py checks that both
+give the same dataset.
+
+    python benchmarks/bench_join.py [n_parcels]
+"""
+
+import sys
+import time
+import gc
+import multiprocessing
+
+import pandas as pd
+import geopandas as gpd
+
+from synthetic import make_parcels, make_du_est, make_acs_tables
+
+from lib.data import (
+    ANALYTIC_COLUMNS,
+    CENSUS_COLUMNS,
+    DU_EST_COLUMNS,
+    GEOID_COLUMNS,
+    build_analytic_dataset,
+    fix_geoid_dtypes,
+)
+
+
+def build_analytic_dataset_legacy(
+    durham_open: gpd.GeoDataFrame,
+    parcels_clean: pd.DataFrame,
+    acs_table_t: pd.DataFrame,
+    acs_table_bg: pd.DataFrame,
+) -> gpd.GeoDataFrame:
+    """
+    Function reproducing the right merge -> dropna -> geo id fixes -> census
+    merges -> subset -> filter chain, each step copying the whole frame.
+    """
+    durham_open["REID"] = durham_open["REID"].astype(str)
+    parcels_clean["REID"] = parcels_clean["REID"].astype(str)
+    df = durham_open.merge(parcels_clean[DU_EST_COLUMNS], on="REID", how="right")
+    df.dropna(subset="OBJECTID_1", inplace=True)
+
+    for col in GEOID_COLUMNS:
+        df[col] = fix_geoid_dtypes(df[col])
+
+    for table, geo_col, suffix in [
+        (acs_table_t, "geo_id_t2020", "t"),
+        (acs_table_bg, "geo_id_bg2020", "bg"),
+    ]:
+        census = table[CENSUS_COLUMNS].add_suffix(f"_{suffix}")
+        df = df.merge(census, left_on=geo_col, right_on=f"GEOID_{suffix}", how="left")
+        df.drop(columns=f"GEOID_{suffix}", inplace=True)
+
+    df = df[ANALYTIC_COLUMNS]
+    return df[df["du_est_final"] != 0]
+
+
+def _reset_peak_rss() -> None:
+    # Linux: resets the peak resident size (VmHWM) to the current one, so the
+    # peak of building the inputs is not counted
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def _rss_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 2**10
+
+
+def _measure(build, n, queue) -> None:
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    acs_table_t, acs_table_bg = make_acs_tables(du_est)
+
+    gc.collect()
+    _reset_peak_rss()
+    rss_before = _rss_mb("VmRSS")
+    start = time.perf_counter()
+    df = build(parcels, du_est, acs_table_t, acs_table_bg)
+    seconds = time.perf_counter() - start
+    queue.put((seconds, _rss_mb("VmHWM") - rss_before, df.shape))
+
+
+def measure(build, n: int) -> tuple:
+    """
+    Function to return (seconds, growth of the peak resident memory in MiB,
+    shape) of building the analytic dataset, in a fresh interpreter.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(build, n, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 130_000
+
+    print(f"{n} parcels")
+    for name, build in [
+        ("merge chain", build_analytic_dataset_legacy),
+        ("planned join", build_analytic_dataset),
+    ]:
+        seconds, peak_mb, shape = measure(build, n)
+        print(f"{name:<14} {seconds:6.2f}s  peak RSS +{peak_mb:7.1f} MiB  {shape}")
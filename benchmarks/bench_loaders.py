@@ -0,0 +1,115 @@
+"""
+Report load time and resident memory of get_parcels and get_du_est, reading
+everything versus only the pipeline's columns, from the shapefile/CSV and from
+Parquet copies. Each variant runs in a fresh process.
+
+    python benchmarks/bench_loaders.py [n_parcels]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+import psutil
+
+from synthetic import make_parcels, make_du_est
+
+from lib.data import DU_EST_COLUMNS, PARCEL_COLUMNS, get_du_est, get_parcels
+
+# the real files carry many columns the pipeline never uses
+N_UNUSED_COLUMNS = 40
+
+
+def write_inputs(n: int, tmp: str) -> dict:
+    """
+    Function to write synthetic parcel/du_est inputs, padded with unused columns.
+    """
+    rng = np.random.default_rng(0)
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    for i in range(N_UNUSED_COLUMNS):
+        parcels[f"EXTRA_{i}"] = rng.choice(["A", "BB", "CCC"], n)
+        du_est[f"extra_{i}"] = rng.random(n)
+
+    paths = {
+        "shapefile": os.path.join(tmp, "parcels", "parcels.shp"),
+        "parcels_parquet": os.path.join(tmp, "parcels.parquet"),
+        "csv": os.path.join(tmp, "du_est.csv"),
+        "du_est_parquet": os.path.join(tmp, "du_est.parquet"),
+    }
+    os.makedirs(os.path.dirname(paths["shapefile"]))
+    parcels.to_file(paths["shapefile"])
+    parcels.to_parquet(paths["parcels_parquet"])
+    du_est.to_csv(paths["csv"], index=False)
+    get_du_est(paths["csv"]).to_parquet(paths["du_est_parquet"])
+    return paths
+
+
+def _measure(loader, path, kwargs, queue) -> None:
+    rss_before = psutil.Process().memory_info().rss
+    start = time.perf_counter()
+    df = loader(path, **kwargs)
+    seconds = time.perf_counter() - start
+    rss_after = psutil.Process().memory_info().rss
+    queue.put((seconds, (rss_after - rss_before) / 2**20, df.shape))
+
+
+def measure(loader, path: str, **kwargs) -> tuple:
+    """
+    Function to return (seconds, resident memory growth in MiB, shape) of a
+    load, in a fresh interpreter.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(loader, path, kwargs, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 130_000
+    tmp = tempfile.mkdtemp()
+
+    try:
+        paths = write_inputs(n, tmp)
+        variants = [
+            ("parcels: shapefile, all columns", get_parcels, paths["shapefile"], {}),
+            (
+                "parcels: shapefile, projected",
+                get_parcels,
+                paths["shapefile"],
+                {"columns": PARCEL_COLUMNS},
+            ),
+            (
+                "parcels: GeoParquet, projected",
+                get_parcels,
+                paths["parcels_parquet"],
+                {"columns": PARCEL_COLUMNS},
+            ),
+            ("du_est: CSV, all columns", get_du_est, paths["csv"], {"dtype": None}),
+            (
+                "du_est: CSV, usecols + dtypes",
+                get_du_est,
+                paths["csv"],
+                {"columns": DU_EST_COLUMNS},
+            ),
+            (
+                "du_est: Parquet, projected",
+                get_du_est,
+                paths["du_est_parquet"],
+                {"columns": DU_EST_COLUMNS},
+            ),
+        ]
+
+        print(f"{n} parcels, {N_UNUSED_COLUMNS} unused columns per input")
+        for name, loader, path, kwargs in variants:
+            seconds, rss_mb, shape = measure(loader, path, **kwargs)
+            print(f"{name:<34} {seconds:6.2f}s  RSS +{rss_mb:7.1f} MiB  {shape}")
+    finally:
+        shutil.rmtree(tmp)
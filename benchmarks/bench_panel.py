@@ -0,0 +1,87 @@
+"""
+Aggregate the student counts of every school year by every layer as a panel
+with lib.panel, against aggregating a single year, aggregating every year in
+a pass of its own, and grouping the counts melted to a long frame by (geo id,
+year). tests/test_panel.py checks that the panel holds the aggregates of the
+passes per year.
+
+    python benchmarks/bench_panel.py [n_parcels] [n_years]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic import make_parcels, make_du_est, make_acs_tables
+
+from main import CONFIG
+from lib.data import (
+    aggregate_by_geo_id,
+    build_analytic_dataset,
+    optimize_dtypes,
+    student_columns,
+)
+from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+from lib.panel import panel_aggregates
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def per_year(df: pd.DataFrame, geo_col: str, columns: list) -> list:
+    return [
+        aggregate_by_geo_id(df, geo_col, {col: CONFIG.PANEL_AGGREGATIONS})
+        for col in columns
+    ]
+
+
+def melted(df: pd.DataFrame, geo_col: str, columns: list) -> pd.DataFrame:
+    long = df[[geo_col] + columns].melt(id_vars=geo_col, var_name="column")
+    return long.groupby([geo_col, "column"])["value"].agg(CONFIG.PANEL_AGGREGATIONS)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_years = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    # school years before those of the synthetic estimates, found by the panel
+    rng = np.random.default_rng(0)
+    for year in range(20 - (n_years - 4), 20):
+        du_est[f"students{year:02d}{year + 1:02d}"] = rng.poisson(
+            0.4 * du_est["du_est_final"]
+        )
+    df = optimize_dtypes(
+        process_data(
+            optimize_dtypes(
+                build_analytic_dataset(parcels, du_est, *make_acs_tables(du_est))
+            )
+        ),
+        code_columns=QUARTILE_CODE_COLUMNS,
+    )
+    columns = student_columns(df.columns)
+
+    totals = dict.fromkeys(["one year", "panel", "pass per year", "melted"], 0.0)
+    for geo_col in CONFIG.layer_mapping.values():
+        _, seconds = timed(per_year, df, geo_col, columns[-1:])
+        totals["one year"] += seconds
+        _, seconds = timed(panel_aggregates, df, geo_col, CONFIG.PANEL_AGGREGATIONS)
+        totals["panel"] += seconds
+        _, seconds = timed(per_year, df, geo_col, columns)
+        totals["pass per year"] += seconds
+        _, seconds = timed(melted, df, geo_col, columns)
+        totals["melted"] += seconds
+
+    print(
+        f"{len(df)} parcels, {len(columns)} school years, {len(CONFIG.layer_mapping)} layers"
+    )
+    for name, seconds in totals.items():
+        print(
+            f"{name:<14} {seconds:7.3f}s ({seconds / totals['one year']:.1f}x one year)"
+        )
@@ -0,0 +1,76 @@
+"""
+Compare the per-geography groupby/merge chain process_data used to run with
+lib.variables.add_geography_averages, on a synthetic county-sized frame.
+tests/test_variables.py checks that both give the same frame.
+
+    python benchmarks/bench_process_data.py [n_parcels]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from synthetic import make_analytic_dataset
+
+from lib.variables import GEOGRAPHY_AVERAGES, add_geography_averages, process_data
+
+
+def add_geography_averages_legacy(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function reproducing the eight groupby -> lambda -> rename -> merge blocks.
+    """
+    rounded_mean = lambda x: round(x.mean()) if not np.isnan(x.mean()) else np.nan
+    for geo_col, suffix in GEOGRAPHY_AVERAGES:
+        avg = (
+            df.groupby(geo_col)
+            .agg(
+                {
+                    "unit_val": "mean",
+                    "unit_val_cat_single": rounded_mean,
+                    "unit_val_cat_multi": rounded_mean,
+                }
+            )
+            .reset_index()
+        )
+        avg.columns = [
+            geo_col,
+            f"unit_val_avg_{suffix}",
+            f"unit_val_cat_single_avg_{suffix}",
+            f"unit_val_cat_multi_avg_{suffix}",
+        ]
+        df = pd.merge(df, avg, on=geo_col, how="left")
+    return df
+
+
+def measure(func, df: pd.DataFrame) -> tuple:
+    """
+    Function to return the result, wall time and peak traced memory of func(df).
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(df)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 130_000
+
+    # process_data up to the geography averages
+    df = process_data(make_analytic_dataset(n))
+    df = df.loc[:, :"unit_val_cat_multi"]
+    print(f"{len(df)} parcels x {df.shape[1]} columns")
+
+    _, legacy_s, legacy_mb = measure(add_geography_averages_legacy, df)
+    _, engine_s, engine_mb = measure(add_geography_averages, df)
+
+    print(f"legacy merges: {legacy_s:6.2f}s, peak {legacy_mb:8.1f} MiB")
+    print(f"single pass:   {engine_s:6.2f}s, peak {engine_mb:8.1f} MiB")
+    print(
+        f"speedup {legacy_s / engine_s:.1f}x, peak memory {engine_mb / legacy_mb:.2f}x"
+    )
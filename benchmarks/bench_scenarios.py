@@ -0,0 +1,78 @@
+"""
+Evaluate many proposed assignments of planning units to elementary schools
+with lib.scenarios, each the current boundaries with some planning units moved
+to another school, and one scenario by grouping the parcels by a school
+column assigned that way. tests/test_scenarios.py checks that both give the
+same aggregates.
+
+    python benchmarks/bench_scenarios.py [n_parcels] [n_scenarios] [moved]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic import make_parcels, make_du_est, make_acs_tables
+
+from main import CONFIG
+from lib.data import aggregate_by_geo_id, build_analytic_dataset, optimize_dtypes
+from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+from lib.scenarios import current_assignment, evaluate_scenarios, unit_statistics
+
+UNIT_COL = "pu_2324_848"
+SCHOOL_COL = "sch_id_base_es"
+
+# relative difference allowed between float sums added up in another order
+RTOL = 1e-12
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_scenarios = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    moved = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    df = optimize_dtypes(
+        process_data(
+            optimize_dtypes(
+                build_analytic_dataset(parcels, du_est, *make_acs_tables(du_est))
+            )
+        ),
+        code_columns=QUARTILE_CODE_COLUMNS,
+    )
+    agg = CONFIG.aggregations
+
+    state, state_s = timed(unit_statistics, df, UNIT_COL, agg)
+    current = current_assignment(df, UNIT_COL, SCHOOL_COL)
+    rng = np.random.default_rng(0)
+    assignments = np.tile(current.to_numpy(), (n_scenarios, 1))
+    changed = rng.random(assignments.shape) < moved
+    assignments[changed] = rng.choice(current.unique(), np.count_nonzero(changed))
+
+    result, evaluate_s = timed(
+        evaluate_scenarios, state, assignments, agg, school_col=SCHOOL_COL
+    )
+
+    schools = pd.Series(assignments[-1], index=current.index)
+    assigned = df.assign(**{SCHOOL_COL: schools.reindex(df[UNIT_COL]).to_numpy()})
+    _, groupby_s = timed(aggregate_by_geo_id, assigned, SCHOOL_COL, agg)
+
+    print(f"{len(df)} parcels, {len(current)} planning units, {moved:.0%} moved")
+    print(f"planning unit statistics: {state_s:6.3f}s")
+    print(
+        f"{n_scenarios} scenarios:        {evaluate_s:6.3f}s "
+        f"({n_scenarios / evaluate_s:,.0f} scenarios/s, {len(result)} rows)"
+    )
+    print(
+        f"one scenario grouped:     {groupby_s:6.3f}s "
+        f"({1 / groupby_s:,.0f} scenarios/s)"
+    )
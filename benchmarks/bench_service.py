@@ -0,0 +1,189 @@
+"""
+Load test the query service of lib.service: publish a snapshot of synthetic
+processed parcels, serve it from another process, and send lookups over
+keep-alive connections, reporting the p50/p99 latency of every kind of lookup.
+A second snapshot is then published to measure how long the service takes to
+swap it in, and the latency of the lookups answered meanwhile.
+
+    python benchmarks/bench_service.py [n_parcels] [requests] [connections]
+"""
+
+import sys
+import json
+import time
+import random
+import shutil
+import itertools
+import socket
+import asyncio
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+from synthetic import make_parcels, make_du_est, make_acs_tables
+
+from main import CONFIG, layer_aggregations
+from lib.data import build_analytic_dataset, optimize_dtypes
+from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+from lib.service import publish_snapshot, serve
+
+# layers whose parcels are looked up, from small geographies to large ones
+PARCEL_LAYERS = ["b2020", "PU_2324_848", "ES_base_2223"]
+
+
+def run_service(snapshot_dir: str, port: int) -> None:
+    asyncio.run(
+        serve(
+            snapshot_dir,
+            CONFIG.layer_mapping,
+            {layer: layer_aggregations(layer) for layer in CONFIG.layer_mapping},
+            port=port,
+            parcel_columns=CONFIG.SERVICE_PARCEL_COLUMNS,
+            poll_seconds=0.1,
+        )
+    )
+
+
+async def get(reader, writer, path: str) -> tuple:
+    """
+    Function to send a GET over a keep-alive connection and read the response,
+    as (status, body).
+    """
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+    return status, await reader.readexactly(length)
+
+
+async def load(port: int, paths: list, connections: int, stop=None) -> list:
+    """
+    Function to send the GETs of paths over connections in parallel, or to send
+    them over and over until the asyncio.Event stop is set. Returns the
+    latency of every lookup in ms.
+    """
+    latencies = []
+    if stop is None:
+        queue = iter(paths)
+    else:
+        queue = itertools.takewhile(lambda _: not stop.is_set(), itertools.cycle(paths))
+
+    async def client():
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for path in queue:
+            start = time.perf_counter()
+            status, _ = await get(reader, writer, path)
+            latencies.append((time.perf_counter() - start) * 1e3)
+            assert status == 200, path
+        writer.close()
+
+    await asyncio.gather(*[client() for _ in range(connections)])
+    return latencies
+
+
+async def wait_for(port: int, predicate) -> dict:
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            status, body = await get(reader, writer, "/status")
+            writer.close()
+            if status == 200 and predicate(json.loads(body)):
+                return json.loads(body)
+        except (OSError, IndexError):
+            pass
+        await asyncio.sleep(0.05)
+
+
+def report(name: str, latencies: list) -> None:
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(
+        f"{name:<28} {len(latencies):>8} {p50:>8.3f} {p99:>8.3f} {max(latencies):>8.3f}"
+    )
+
+
+async def main(n: int, requests: int, connections: int) -> None:
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    df = optimize_dtypes(
+        process_data(
+            optimize_dtypes(
+                build_analytic_dataset(parcels, du_est, *make_acs_tables(du_est))
+            )
+        ),
+        code_columns=QUARTILE_CODE_COLUMNS,
+    )
+    snapshot_dir = tempfile.mkdtemp()
+    first = publish_snapshot(df, snapshot_dir)
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    # not a daemon, as the service indexes snapshots in a child process
+    service = multiprocessing.Process(target=run_service, args=(snapshot_dir, port))
+    service.start()
+    try:
+        await measure(port, df, snapshot_dir, first, requests, connections)
+    finally:
+        service.terminate()
+        service.join()
+        shutil.rmtree(snapshot_dir)
+
+
+async def measure(
+    port: int, df, snapshot_dir: str, first: dict, requests: int, connections: int
+) -> None:
+    start = time.perf_counter()
+    await wait_for(port, lambda status: status["snapshot"]["id"] == first["id"])
+    print(f"{len(df)} parcels served {time.perf_counter() - start:.2f}s after start")
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    geo_ids = {}
+    for layer in CONFIG.layer_mapping:
+        _, body = await get(reader, writer, f"/layers/{layer}")
+        geo_ids[layer] = json.loads(body)
+    writer.close()
+
+    rng = random.Random(0)
+    lookups = {
+        "indicators (all layers)": [
+            f"/layers/{layer}/{rng.choice(geo_ids[layer])}"
+            for layer in rng.choices(list(geo_ids), k=requests)
+        ]
+    }
+    for layer in PARCEL_LAYERS:
+        lookups[f"parcels of {layer}"] = [
+            f"/layers/{layer}/{rng.choice(geo_ids[layer])}/parcels"
+            for _ in range(requests // 10)
+        ]
+
+    print(f"{connections} connections, latency in ms")
+    print(f"{'lookup':<28} {'requests':>8} {'p50':>8} {'p99':>8} {'max':>8}")
+    for name, paths in lookups.items():
+        report(name, await load(port, paths, connections))
+
+    # publish another run while looking up indicators, until it is served
+    df["TOTAL_PROP_VALUE"] *= 1.01
+    second = publish_snapshot(df, snapshot_dir)
+    published = time.perf_counter()
+
+    stop = asyncio.Event()
+
+    async def swapped():
+        await wait_for(port, lambda status: status["snapshot"]["id"] == second["id"])
+        stop.set()
+        return time.perf_counter() - published
+
+    latencies, seconds = await asyncio.gather(
+        load(port, lookups["indicators (all layers)"], connections, stop),
+        swapped(),
+    )
+    report("indicators during reload", latencies)
+    print(f"new snapshot served {seconds:.2f}s after it was published")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 130_000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    connections = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    asyncio.run(main(n, requests, connections))
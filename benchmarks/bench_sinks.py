@@ -0,0 +1,74 @@
+"""
+Compare the output formats of lib.sinks: write time, size on disk, and the
+time to read the whole layer back or only the features of a small extent (a
+tenth of the width and height), as a GIS client or web map would.
+
+    python benchmarks/bench_sinks.py [n_features]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from synthetic import make_layer
+
+from lib.data import convert_datetime_to_str
+from lib.writer import pyogrio
+from lib.sinks import SINKS, is_shared, path_size, write_layer
+
+
+def read_layer(output_format: str, path: str, bbox: tuple = None) -> pd.DataFrame:
+    """
+    Function to read a layer back, keeping the features intersecting bbox.
+    CSV has no spatial index, so it is read in full and filtered.
+    """
+    if output_format == "csv":
+        df = pd.read_csv(path)
+        if bbox is not None:
+            geometry = shapely.from_wkt(df["geometry"])
+            df = df[shapely.intersects(geometry, shapely.box(*bbox))]
+        return df
+    if output_format == "geoparquet":
+        return gpd.read_parquet(path, bbox=bbox)
+    return pyogrio.read_dataframe(path, layer="layer", bbox=bbox)
+
+
+def timed(func, *args, **kwargs) -> tuple:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    gdf = convert_datetime_to_str(make_layer(n))
+    xmin, ymin, xmax, ymax = gdf.total_bounds
+    cx, cy = (xmin + xmax) / 2, (ymin + ymax) / 2
+    dx, dy = (xmax - xmin) / 20, (ymax - ymin) / 20
+    bbox = (cx - dx, cy - dy, cx + dx, cy + dy)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        print(f"{n} features")
+        for output_format, sink in SINKS.items():
+            if is_shared(output_format):
+                path = os.path.join(tmp, "layers.gdb")
+            else:
+                path = os.path.join(tmp, "layer" + sink["extension"])
+            seconds = write_layer(gdf, "layer", {output_format: path})[output_format]
+            read_seconds, full = timed(read_layer, output_format, path)
+            bbox_seconds, subset = timed(read_layer, output_format, path, bbox)
+            assert len(full) == n
+            print(
+                f"{output_format:>10}: write {seconds:6.2f}s  "
+                f"{path_size(path) / 2**20:7.1f} MiB  read {read_seconds:6.2f}s  "
+                f"extent read {bbox_seconds:6.2f}s ({len(subset)} features)"
+            )
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,125 @@
+"""
+Compare the peak resident memory and time of aggregating every layer in
+memory with the streaming mode, for growing synthetic inputs. Streaming
+memory should stay flat. Each run is a fresh process; the peak is read from
+/proc, so this runs on Linux only.
+
+    python benchmarks/bench_streaming.py [n_parcels ...]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+from synthetic import make_parcels, make_du_est, make_acs_tables
+
+from main import CONFIG, layer_aggregations
+from lib.data import (
+    DU_EST_COLUMNS,
+    PARCEL_COLUMNS,
+    aggregate_by_geo_id,
+    build_analytic_dataset,
+    get_du_est,
+    get_parcels,
+)
+from lib.variables import process_data
+from lib.streaming import stream_aggregates
+
+CHUNK_SIZE = 100_000
+
+
+def write_inputs(n: int, tmp: str) -> dict:
+    """
+    Function to write synthetic parcels (GeoParquet), estimates (CSV) and
+    census tables.
+    """
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    acs_table_t, acs_table_bg = make_acs_tables(du_est)
+
+    paths = {
+        "parcels": os.path.join(tmp, "parcels.parquet"),
+        "du_est": os.path.join(tmp, "du_est.csv"),
+    }
+    parcels.to_parquet(paths["parcels"])
+    du_est.to_csv(paths["du_est"], index=False)
+    return {
+        **paths,
+        "census": (acs_table_t, acs_table_bg),
+        "work_dir": os.path.join(tmp, "work"),
+    }
+
+
+def in_memory(inputs: dict) -> dict:
+    df = build_analytic_dataset(
+        get_parcels(inputs["parcels"], columns=PARCEL_COLUMNS),
+        get_du_est(inputs["du_est"], columns=DU_EST_COLUMNS),
+        *inputs["census"],
+    )
+    df = process_data(df)
+    return {
+        layer: aggregate_by_geo_id(df, geo_col, layer_aggregations(layer))
+        for layer, geo_col in CONFIG.layer_mapping.items()
+    }
+
+
+def streaming(inputs: dict) -> dict:
+    return stream_aggregates(
+        inputs["parcels"],
+        inputs["du_est"],
+        *inputs["census"],
+        CONFIG.layer_mapping,
+        {layer: layer_aggregations(layer) for layer in CONFIG.layer_mapping},
+        inputs["work_dir"],
+        PARCEL_COLUMNS,
+        DU_EST_COLUMNS,
+        chunk_size=CHUNK_SIZE,
+    )
+
+
+def _rss_mb(field: str) -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 2**10
+
+
+def _measure(run, inputs, queue) -> None:
+    rss_before = _rss_mb("VmRSS")
+    start = time.perf_counter()
+    run(inputs)
+    queue.put((time.perf_counter() - start, _rss_mb("VmHWM") - rss_before))
+
+
+def measure(run, inputs: dict) -> tuple:
+    """
+    Function to return (seconds, peak resident memory above the baseline in
+    MiB) of a run, in a fresh interpreter.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(run, inputs, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [250_000, 1_000_000]
+
+    print(f"streaming in chunks of {CHUNK_SIZE} rows")
+    for n in sizes:
+        tmp = tempfile.mkdtemp()
+        try:
+            inputs = write_inputs(n, tmp)
+            for name, run in [("in memory", in_memory), ("streaming", streaming)]:
+                seconds, peak_mb = measure(run, inputs)
+                print(
+                    f"{n:>9} parcels  {name:<10} {seconds:6.2f}s  peak RSS +{peak_mb:7.1f} MiB"
+                )
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,84 @@
+"""
+Build vector tile pyramids of a synthetic block layer with lib.tiles, without
+and with per-zoom simplification, and report the build time and the number
+and size of the tiles of every zoom level. A map view only fetches the few
+tiles it shows, so the largest tile bounds what a client reads at any zoom.
+
+    python benchmarks/bench_tiles.py [n_blocks] [workers]
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+import numpy as np
+import shapely
+
+from synthetic import make_parcels, make_boundary_layer
+
+from lib.tiles import write_tile_source, write_tile_pyramids
+
+ZOOMS = list(range(8, 15))
+SIMPLIFICATION = {8: 8.0, 11: 4.0, 14: 1.0}
+
+
+def tile_sizes(path: str) -> list:
+    """
+    Function to return (zoom, tiles, total bytes, largest tile bytes) rows.
+    """
+    with sqlite3.connect(path) as db:
+        return db.execute(
+            "SELECT zoom_level, COUNT(*), SUM(LENGTH(tile_data)), "
+            "MAX(LENGTH(tile_data)) FROM tiles GROUP BY zoom_level"
+        ).fetchall()
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 7_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    rng = np.random.default_rng(0)
+    layer = make_boundary_layer(make_parcels(20_000), n, "geo_id_b2020")
+    # digitized boundaries have a vertex every few feet; the displacement is a
+    # function of the position, so neighbouring blocks still share their edges
+    layer.geometry = shapely.transform(
+        shapely.segmentize(layer.geometry.values, 20),
+        lambda xy: xy + 3 * np.sin(xy[:, ::-1] / 40),
+    )
+    columns = ["geo_id_b2020"]
+    for i in range(12):
+        layer[f"indicator_{i}_mean"] = rng.lognormal(8, 1, len(layer))
+        columns.append(f"indicator_{i}_mean")
+
+    tmp = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp, "b2020.parquet")
+        write_tile_source(layer, source, columns)
+
+        print(f"{len(layer)} blocks, 12 indicators, zoom {ZOOMS[0]}-{ZOOMS[-1]}")
+        for name, simplification in [
+            ("no simplification", {}),
+            ("per-zoom", SIMPLIFICATION),
+        ]:
+            tiles_dir = os.path.join(tmp, name.replace(" ", "_"))
+            os.makedirs(tiles_dir)
+            start = time.perf_counter()
+            paths = write_tile_pyramids(
+                {"b2020": source}, tiles_dir, ZOOMS, simplification, workers
+            )
+            seconds = time.perf_counter() - start
+
+            print(
+                f"{name}: built in {seconds:.2f}s with {workers} workers, "
+                f"{os.path.getsize(paths['b2020']) / 2**20:.1f} MiB"
+            )
+            for zoom, count, total, largest in tile_sizes(paths["b2020"]):
+                print(
+                    f"  zoom {zoom:>2}: {count:>4} tiles  {total / 2**10:8.1f} KiB  "
+                    f"largest {largest / 2**10:6.1f} KiB"
+                )
+    finally:
+        shutil.rmtree(tmp)
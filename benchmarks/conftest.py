@@ -0,0 +1,98 @@
+"""
+Fixtures of the pytest-benchmark suite (benchmarks/test_*.py): synthetic
+inputs of every size in --sizes, each generated once and dropped before the
+next size.
+
+    make bench
+    python -m pytest benchmarks --benchmark-only --sizes 10000,100000
+"""
+
+import pytest
+
+from synthetic import (
+    make_parcels,
+    make_du_est,
+    make_acs_tables,
+    make_boundary_layer,
+)
+
+from lib.data import (
+    aggregate_by_geo_id,
+    build_analytic_dataset,
+    convert_datetime_to_str,
+    optimize_dtypes,
+)
+from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+
+SIZES = "10000,100000,1000000"
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--sizes",
+        default=SIZES,
+        help=f"comma separated numbers of synthetic parcels (default {SIZES})",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "n" in metafunc.fixturenames:
+        sizes = [int(n) for n in metafunc.config.getoption("--sizes").split(",")]
+        metafunc.parametrize("n", sizes, ids=[f"{n}" for n in sizes], scope="session")
+
+
+@pytest.fixture(scope="session")
+def inputs(n):
+    """
+    Synthetic parcels, du_est rows and ACS tables.
+    """
+    parcels = make_parcels(n)
+    du_est = make_du_est(parcels)
+    acs_table_t, acs_table_bg = make_acs_tables(du_est)
+    return {
+        "parcels": parcels,
+        "du_est": du_est,
+        "acs_table_t": acs_table_t,
+        "acs_table_bg": acs_table_bg,
+    }
+
+
+@pytest.fixture(scope="session")
+def analytic(inputs):
+    """
+    The analytic dataset, as process_data receives it.
+    """
+    return optimize_dtypes(
+        build_analytic_dataset(
+            inputs["parcels"],
+            inputs["du_est"],
+            inputs["acs_table_t"],
+            inputs["acs_table_bg"],
+        )
+    )
+
+
+@pytest.fixture(scope="session")
+def processed(analytic):
+    """
+    The processed dataset, as the layers are aggregated from.
+    """
+    return optimize_dtypes(
+        process_data(analytic.copy()), code_columns=QUARTILE_CODE_COLUMNS
+    )
+
+
+@pytest.fixture(scope="session")
+def block_layer(inputs, processed):
+    """
+    The b2020 layer with its aggregates joined to block polygons, as
+    export_layer hands it to the GDB writer.
+    """
+    agg = aggregate_by_geo_id(
+        processed,
+        "geo_id_b2020",
+        {"du_est_final": ["sum", "mean"], "unit_val": ["sum", "mean"]},
+    )
+    blocks = make_boundary_layer(inputs["parcels"], len(agg), "geo_id_b2020")
+    blocks["geo_id_b2020"] = agg["geo_id_b2020"].to_numpy()
+    return convert_datetime_to_str(blocks.merge(agg, on="geo_id_b2020"))
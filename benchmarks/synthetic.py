@@ -0,0 +1,288 @@
+"""
+Synthetic, Durham-shaped inputs for the benchmarks.
+
+The frames mimic the three pipeline inputs (Durham Open parcels, the DPS
+du_est CSV and the ACS tables) closely enough that every lib function can run
+on them: nested block/block group/tract GEOIDs, planning units and school
+zones that group parcels, skewed property values and a single/multi split.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from lib.data import build_analytic_dataset
+
+COUNTY_FIPS = "37063"
+CRS = "EPSG:2264"  # NC State Plane (ft), as used by Durham Open
+
+
+def _nested_geo_ids(rng: np.random.Generator, n: int) -> dict:
+    """
+    Function to draw block/block group/tract ids that nest like census GEOIDs.
+    """
+    n_tracts = max(4, n // 1_800)
+    tract = rng.integers(0, n_tracts, n)
+    block_group = rng.integers(1, 5, n)
+    block = rng.integers(0, 40, n)
+
+    t = tract.astype(np.int64) * 100 + 100 + 37063 * 10**6
+    bg = t * 10 + block_group
+    b = bg * 1000 + block
+    return {"t": t, "bg": bg, "b": b}
+
+
+def _nested_school_ids(rng: np.random.Generator, blocks: np.ndarray) -> dict:
+    """
+    Function to draw planning units made of whole blocks, elementary school
+    zones made of whole planning units, middle schools of elementary ones,
+    high schools of middle ones and regions of high schools, as DPS nests them.
+    """
+    block_codes, block = np.unique(blocks, return_inverse=True)
+    pu_of_block = rng.integers(1, 849, len(block_codes))
+    es_of_pu = rng.integers(300, 330, 849)
+    ms_of_es = rng.integers(300, 310, 330)
+    hs_of_ms = rng.integers(300, 308, 310)
+    region_of_hs = rng.integers(1, 6, 308)
+
+    pu = pu_of_block[block]
+    es = es_of_pu[pu]
+    ms = ms_of_es[es]
+    hs = hs_of_ms[ms]
+    return {"pu": pu, "es": es, "ms": ms, "hs": hs, "region": region_of_hs[hs]}
+
+
+def make_parcels(n: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Function to generate n square parcels with the Durham Open columns.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    x = (np.arange(n) % side) * 200.0 + 1_950_000
+    y = (np.arange(n) // side) * 200.0 + 780_000
+    size = rng.uniform(60, 190, n)
+
+    geometry = shapely.multipolygons(
+        [[geom] for geom in shapely.box(x, y, x + size, y + size)]
+    )
+
+    return gpd.GeoDataFrame(
+        {
+            "OBJECTID_1": np.arange(1, n + 1),
+            "OBJECTID": np.arange(1, n + 1),
+            "REID": (100_000 + np.arange(n)).astype(str),
+            "PIN": np.char.add("0800-", (np.arange(n) % 100_000).astype(str)),
+            "PROPERTY_D": rng.choice(["LOT 1", "LOT 2", "TRACT A", ""], n),
+            "LOCATION_A": np.char.add(
+                (rng.integers(1, 9_999, n)).astype(str), " MAIN ST"
+            ),
+            "SPEC_DIST": rng.choice(["DURHAM", "COUNTY", "RTP"], n),
+            "LAND_CLASS": rng.choice(["RES/ 1-FAMILY", "RES/ MULTI", "COMMERCIAL"], n),
+            "ACREAGE": np.round(size**2 / 43_560, 3),
+            "PROPERTY_O": np.char.add("OWNER ", (np.arange(n) % 5_000).astype(str)),
+            "OWNER_MAIL": np.char.add("PO BOX ", (np.arange(n) % 900).astype(str)),
+            "DATE_SOLD": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(rng.integers(0, 1_500, n), unit="D"),
+        },
+        geometry=geometry,
+        crs=CRS,
+    )
+
+
+def make_du_est(parcels: gpd.GeoDataFrame, seed: int = 0) -> pd.DataFrame:
+    """
+    Function to generate the DPS du_est CSV rows for a set of parcels.
+    """
+    rng = np.random.default_rng(seed + 1)
+    n = len(parcels)
+    geo_2020 = _nested_geo_ids(rng, n)
+    geo_2010 = _nested_geo_ids(rng, n)
+
+    designation = rng.choice(["single", "multi", "other"], n, p=[0.7, 0.25, 0.05])
+    du_est = np.where(designation == "multi", rng.integers(2, 200, n), 1)
+    du_est[rng.random(n) < 0.05] = 0
+
+    nested = _nested_school_ids(rng, geo_2020["b"])
+
+    def school(k):
+        return rng.integers(300, 300 + k, n)
+
+    du_df = pd.DataFrame(
+        {
+            "REID": parcels["REID"].values,
+            "designation": designation,
+            "housing_type": rng.choice(["SF", "MF", "TH", "MH"], n),
+            "du_est_final": du_est,
+            "students2324": rng.poisson(0.4 * du_est),
+            "students2223": rng.poisson(0.4 * du_est),
+            "students2122": rng.poisson(0.4 * du_est),
+            "students2021": rng.poisson(0.4 * du_est),
+            "geo_id_b2010": geo_2010["b"].astype(float),
+            "geo_id_b2020": geo_2020["b"].astype(float),
+            "geo_id_bg2010": geo_2010["bg"].astype(float),
+            "geo_id_bg2020": geo_2020["bg"].astype(float),
+            "sch_id_base1819_es": school(30),
+            "sch_id_base_es": nested["es"],
+            "sch_id_gt_es": school(30),
+            "sch_id_yr_es": school(30),
+            "sch_id_yr_optout_es": school(30),
+            "sch_id_zone": school(8),
+            "sch_id_base_hs": nested["hs"],
+            "sch_id_gt_hs": school(8),
+            "sch_id_base1819_ms": school(10),
+            "sch_id_base_ms": nested["ms"],
+            "sch_id_gt_ms": school(10),
+            "sch_id_yr_ms": school(10),
+            "pu_2122_833": rng.integers(1, 834, n),
+            "pu_2324_848": nested["pu"],
+            "geo_id_t2010": geo_2010["t"].astype(float),
+            "geo_id_t2020": geo_2020["t"].astype(float),
+            "region": nested["region"],
+            "TOTAL_PROP_VALUE": np.round(rng.lognormal(12.3, 0.8, n), -2),
+        }
+    )
+
+    # a sprinkle of parcels the DPS file could not place
+    missing = rng.random(n) < 0.01
+    du_df.loc[missing, ["geo_id_b2010", "pu_2122_833"]] = np.nan
+
+    return du_df
+
+
+def make_acs_tables(du_est: pd.DataFrame, seed: int = 0) -> tuple:
+    """
+    Function to generate tract and block group ACS tables for the GEOIDs in du_est.
+    """
+    rng = np.random.default_rng(seed + 2)
+    tables = []
+    for col in ["geo_id_t2020", "geo_id_bg2020"]:
+        geoid = pd.Series(du_est[col].dropna().unique()).astype(np.int64).astype(str)
+        k = len(geoid)
+        tables.append(
+            pd.DataFrame(
+                {
+                    "GEOID": geoid.values,
+                    "NAME": "Durham County, North Carolina",
+                    "estimate_rent_total": rng.integers(0, 2_000, k).astype(float),
+                    "moe_rent_total": rng.integers(10, 300, k).astype(float),
+                    "estimate_median_house_value": rng.integers(
+                        90_000, 900_000, k
+                    ).astype(float),
+                    "estimate_median_year_structure_build": rng.integers(
+                        1940, 2020, k
+                    ).astype(float),
+                    "estimate_housing_units": rng.integers(100, 3_000, k).astype(float),
+                    "pct_vacant": rng.uniform(0, 0.3, k),
+                    "pct_owner_occupied": rng.uniform(0.1, 0.95, k),
+                }
+            )
+        )
+    return tuple(tables)
+
+
+def make_layer(n: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Function to generate an aggregated output layer with n features, shaped like
+    the merged frames main.py writes to the GDB.
+    """
+    rng = np.random.default_rng(seed + 3)
+    parcels = make_parcels(n, seed)
+    layer = parcels[["OBJECTID", "REID", "LAND_CLASS", "DATE_SOLD", "geometry"]]
+    layer = layer.rename(columns={"REID": "geo_id_b2020"})
+    for col in ["du_est_final", "TOTAL_PROP_VALUE", "unit_val"]:
+        layer[f"{col}_sum"] = rng.lognormal(10, 1, n)
+        layer[f"{col}_mean"] = rng.lognormal(8, 1, n)
+    layer["unit_val_cat_single_mean_and_round"] = rng.choice([1.0, 2.0, np.nan], n)
+    return layer
+
+
+def make_boundary_layer(
+    parcels: gpd.GeoDataFrame, n_polygons: int, geo_col: str, seed: int = 0
+) -> gpd.GeoDataFrame:
+    """
+    Function to generate a boundary layer of n_polygons irregular polygons
+    (Voronoi cells) tiling the extent of the parcels, with ids in geo_col.
+    """
+    rng = np.random.default_rng(seed + 4)
+    xmin, ymin, xmax, ymax = parcels.total_bounds
+    extent = shapely.box(xmin - 1, ymin - 1, xmax + 1, ymax + 1)
+    sites = shapely.multipoints(
+        np.column_stack(
+            [rng.uniform(xmin, xmax, n_polygons), rng.uniform(ymin, ymax, n_polygons)]
+        )
+    )
+    cells = shapely.get_parts(shapely.voronoi_polygons(sites, extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+
+    return gpd.GeoDataFrame(
+        {geo_col: np.arange(len(cells), dtype=np.int64) + 1},
+        geometry=cells,
+        crs=parcels.crs,
+    )
+
+
+def make_coverage_layer(
+    n_polygons: int, geo_col: str, cells_per_polygon: int = 100, seed: int = 0
+) -> gpd.GeoDataFrame:
+    """
+    Function to generate a boundary layer of n_polygons tiling a square with
+    jagged boundaries, as boundaries dissolved from parcels have: every cell
+    of a grid of about 25 ft cells, its corners jittered, goes to the nearest
+    of n_polygons random sites, and the cells of a site are dissolved.
+    Neighbours share the vertices of their boundaries exactly, as in a valid
+    coverage.
+    """
+    rng = np.random.default_rng(seed + 5)
+    side = int(np.ceil(np.sqrt(n_polygons * cells_per_polygon)))
+    nodes = np.stack(
+        np.meshgrid(np.arange(side + 1) * 25.0, np.arange(side + 1) * 25.0),
+        axis=-1,
+    )
+    nodes += rng.uniform(-2.5, 2.5, nodes.shape) + [1_950_000, 780_000]
+    # corners of every cell, counterclockwise from the lower left
+    corners = np.stack(
+        [nodes[:-1, :-1], nodes[:-1, 1:], nodes[1:, 1:], nodes[1:, :-1]], axis=2
+    ).reshape(-1, 4, 2)
+
+    xmin, ymin = nodes.min(axis=(0, 1))
+    xmax, ymax = nodes.max(axis=(0, 1))
+    sites = shapely.points(
+        rng.uniform(xmin, xmax, n_polygons), rng.uniform(ymin, ymax, n_polygons)
+    )
+    cells, nearest = shapely.STRtree(sites).query_nearest(
+        shapely.points(corners.mean(axis=1)), all_matches=False
+    )
+
+    # the cells of a site are a coverage, unioned as such much faster than
+    # by dissolve
+    order = np.argsort(nearest, kind="stable")
+    cells, nearest = cells[order], nearest[order]
+    starts = np.flatnonzero(np.diff(nearest, prepend=-1))
+    quads = shapely.polygons(corners[cells])
+    polygons = [
+        shapely.multipolygons(shapely.get_parts(shapely.coverage_union_all(part)))
+        for part in np.split(quads, starts[1:])
+    ]
+
+    return gpd.GeoDataFrame(
+        {geo_col: nearest[starts] + 1},
+        geometry=polygons,
+        crs=CRS,
+    )
+
+
+def make_analytic_dataset(n: int, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Function to run the join chain of main.py on synthetic inputs, returning the
+    frame process_data receives.
+    """
+    parcels = make_parcels(n, seed)
+    du_est = make_du_est(parcels, seed)
+    acs_table_t, acs_table_bg = make_acs_tables(du_est, seed)
+    return build_analytic_dataset(parcels, du_est, acs_table_t, acs_table_bg)
@@ -0,0 +1,101 @@
+"""
+pytest-benchmark suite of the pipeline stages, on synthetic parcels of every
+size in --sizes (see conftest.py). Run with make bench, which saves every run
+under .benchmarks/ and fails on a regression against the previous one.
+"""
+
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from main import CONFIG, layer_aggregations
+from lib.data import aggregate_by_geo_id, build_analytic_dataset
+from lib.geometry import optimize_geometry
+from lib.panel import panel_aggregates
+from lib.scenarios import current_assignment, evaluate_scenarios, unit_statistics
+from lib.variables import process_data
+from lib.writer import write_gdb_layer
+
+# stages that change their input, or write files, run on fresh arguments
+# made outside of the timing for every round
+ROUNDS = 3
+
+# layers of every kind of geography: census, planning units and schools
+LAYERS = ["b2020", "bg2020", "t2020", "PU_2324_848", "ES_base_2223", "regions_2025_26"]
+
+
+def test_build_analytic_dataset(benchmark, inputs):
+    benchmark(
+        build_analytic_dataset,
+        inputs["parcels"],
+        inputs["du_est"],
+        inputs["acs_table_t"],
+        inputs["acs_table_bg"],
+    )
+
+
+def test_process_data(benchmark, analytic):
+    benchmark.pedantic(
+        process_data,
+        setup=lambda: ((analytic.copy(),), {}),
+        rounds=ROUNDS,
+    )
+
+
+@pytest.mark.parametrize("layer", LAYERS)
+def test_aggregate_by_geo_id(benchmark, processed, layer):
+    benchmark(
+        aggregate_by_geo_id,
+        processed,
+        CONFIG.layer_mapping[layer],
+        layer_aggregations(layer),
+    )
+
+
+@pytest.mark.parametrize("layer", LAYERS)
+def test_distributional_aggregates(benchmark, processed, layer):
+    benchmark(
+        aggregate_by_geo_id,
+        processed,
+        CONFIG.layer_mapping[layer],
+        {
+            "unit_val": ["p10", "p90", "median@du_est_final", "gini@du_est_final"],
+            "TOTAL_PROP_VALUE": ["mean@students2324", "gini"],
+        },
+    )
+
+
+def test_evaluate_scenarios(benchmark, processed):
+    state = unit_statistics(processed, "pu_2324_848", CONFIG.aggregations)
+    current = current_assignment(processed, "pu_2324_848", "sch_id_base_es")
+    rng = np.random.default_rng(0)
+    assignments = np.tile(current.to_numpy(), (1000, 1))
+    changed = rng.random(assignments.shape) < 0.05
+    assignments[changed] = rng.choice(current.unique(), np.count_nonzero(changed))
+    benchmark(evaluate_scenarios, state, assignments, CONFIG.aggregations)
+
+
+@pytest.mark.parametrize("layer", LAYERS)
+def test_panel_aggregates(benchmark, processed, layer):
+    benchmark(
+        panel_aggregates,
+        processed,
+        CONFIG.layer_mapping[layer],
+        CONFIG.PANEL_AGGREGATIONS,
+    )
+
+
+def test_optimize_geometry(benchmark, block_layer):
+    benchmark(optimize_geometry, block_layer, **CONFIG.GEOMETRY_TOLERANCES["b2020"])
+
+
+def test_export_gdb(benchmark, block_layer, tmp_path):
+    paths = (tmp_path / f"{i}.gdb" for i in itertools.count())
+    benchmark.pedantic(
+        write_gdb_layer,
+        setup=lambda: ((block_layer, str(next(paths)), "b2020"), {}),
+        rounds=ROUNDS,
+    )
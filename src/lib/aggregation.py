@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+from lib.data import ROUNDED_MEAN, is_rounded_mean, _agg_name, rounded_means
+
+# aggregations that can be computed from per-group sums and counts
+STATE_AGGREGATIONS = ["sum", "count", "mean", ROUNDED_MEAN]
+
+# column of a group state holding the number of rows in each group
+ROWS = "_rows"
+
+
+def is_stateful(func) -> bool:
+    """
+    Function to check if an aggregation can be kept up to date from group state.
+    """
+    return is_rounded_mean(func) or (
+        isinstance(func, str) and func in STATE_AGGREGATIONS
+    )
+
+
+def group_state(df: pd.DataFrame, geo_col: str, columns: list) -> pd.DataFrame:
+    """
+    Function to compute the per-group state of columns: for every geo id the
+    sum ("{col}_sum") and the number of non-null values ("{col}_count") of
+    each column, and the number of rows (ROWS). Rows without a geo id are
+    left out, as groupby does.
+    """
+    grouped = df.groupby(geo_col, observed=True)
+    sizes = grouped.size()
+    sums = grouped[columns].sum().add_suffix("_sum")
+    # columns without missing values have a value in every row of a group
+    missing = [col for col in columns if df[col].hasnans]
+    missing_counts = grouped[missing].count() if missing else None
+    counts = pd.DataFrame(
+        {col: missing_counts[col] if col in missing else sizes for col in columns},
+        index=sizes.index,
+    ).add_suffix("_count")
+    state = pd.concat([sums, counts, sizes.rename(ROWS)], axis=1)
+    return state
+
+
+def update_group_state(
+    state: pd.DataFrame, removed: pd.DataFrame, added: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Function to update a group state for changed rows, given the state of the
+    rows as they were (removed) and as they are now (added). Groups left
+    without rows are dropped.
+
+    Sums are updated by subtraction, so a group whose removed sum is not
+    finite (inf - inf) has to be recomputed from its rows by the caller.
+    """
+    index = state.index.union(removed.index).union(added.index)
+    # reindex with a fill value keeps integer sums integer
+    updated = (
+        state.reindex(index, fill_value=0)
+        - removed.reindex(index, columns=state.columns, fill_value=0)
+        + added.reindex(index, columns=state.columns, fill_value=0)
+    )
+    updated.index.name = state.index.name
+    return updated[updated[ROWS] > 0]
+
+
+def combine_group_states(states: list) -> pd.DataFrame:
+    """
+    Function to combine the group states of disjoint sets of rows, e.g. of
+    the chunks of a dataset, into the state of all their rows.
+    """
+    states = [state for state in states if state is not None]
+    combined = pd.concat(states).groupby(level=0).sum()
+    combined.index.name = states[0].index.name
+    return combined
+
+
+def aggregate_from_state(state: pd.DataFrame, geo_col: str, agg: dict) -> pd.DataFrame:
+    """
+    Function to aggregate from a group state, giving the same frame as
+    aggregate_by_geo_id for stateful aggregations.
+    """
+    columns = {}
+    for col, funcs in agg.items():
+        for func in funcs if isinstance(funcs, list) else [funcs]:
+            name = _agg_name(func)
+            sums = state[[f"{col}_sum"]].set_axis([col], axis=1)
+            # groups without values have a NaN mean, as in groupby
+            counts = state[[f"{col}_count"]].set_axis([col], axis=1)
+            nonzero_counts = counts.where(counts > 0, np.nan)
+            if name == "sum":
+                columns[f"{col}_sum"] = sums[col]
+            elif name == "count":
+                columns[f"{col}_count"] = counts[col]
+            elif name == "mean":
+                columns[f"{col}_mean"] = (sums / nonzero_counts)[col]
+            elif name == ROUNDED_MEAN:
+                columns[f"{col}_{ROUNDED_MEAN}"] = rounded_means(sums, nonzero_counts)[
+                    col
+                ]
+            else:
+                raise ValueError(f"{name} cannot be computed from group state")
+
+    agg_df = pd.DataFrame(columns, index=state.index).sort_index()
+    agg_df.index.name = geo_col
+    return agg_df.reset_index()
@@ -0,0 +1,114 @@
+import os
+import json
+import glob
+import inspect
+import hashlib
+
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+from lib.data import path_fingerprint
+
+
+def stage_key(*parts) -> str:
+    """
+    Function to hash the inputs of a pipeline stage into a cache key.
+    Parts can be anything JSON serializable (dicts are hashed with sorted
+    keys), e.g. config values, file fingerprints or the keys of other stages.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def source_fingerprint(func) -> str:
+    """
+    Function to fingerprint the source file a function is defined in, so that
+    cached results are recomputed when the code producing them changes.
+    """
+    return path_fingerprint(inspect.getfile(func), content=True)
+
+
+def _read_frame(path: str) -> pd.DataFrame:
+    """
+    Function to read a cached frame, as a GeoDataFrame if it was written as GeoParquet.
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    if b"geo" in metadata:
+        return gpd.read_parquet(path)
+    return pd.read_parquet(path)
+
+
+def _write_frame(df: pd.DataFrame, path: str) -> None:
+    """
+    Function to write a frame to the cache atomically.
+    """
+    df.to_parquet(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def evict_stages(cache_dir: str, max_bytes: int) -> None:
+    """
+    Function to delete the least recently used cached stages until the cache
+    takes at most max_bytes.
+    """
+    files = [
+        (os.stat(path).st_mtime_ns, os.stat(path).st_size, path)
+        for path in glob.glob(os.path.join(cache_dir, "*.parquet"))
+    ]
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def cached_stage(
+    cache_dir: str,
+    name: str,
+    key: str,
+    compute,
+    force: bool = False,
+    max_bytes: int = 2 * 2**30,
+):
+    """
+    Function to return the result of a pipeline stage, computing it only if
+    no result is cached for the same key.
+
+    Parameters:
+    cache_dir: Directory the stage results are kept in.
+    name: Name of the stage, used in the file names.
+    key: Hash of everything the result depends on, see stage_key.
+    compute: Function without arguments returning a DataFrame or GeoDataFrame,
+        or a tuple of them.
+    force: Recompute and overwrite the cached result.
+    max_bytes: Size of the cache; least recently used stages are evicted beyond it.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix = os.path.join(cache_dir, f"{name}-{key}")
+    single_path = prefix + ".parquet"
+    # tuples are stored one frame per file, named "{prefix}.{i}of{n}.parquet"
+    part_paths = sorted(
+        glob.glob(prefix + ".*of*.parquet"),
+        key=lambda path: int(path.split(".")[-2].split("of")[0]),
+    )
+
+    if not force and os.path.exists(single_path):
+        os.utime(single_path)  # mark as recently used
+        return _read_frame(single_path)
+    if not force and part_paths:
+        if len(part_paths) == int(part_paths[0].split(".")[-2].split("of")[1]):
+            for path in part_paths:
+                os.utime(path)
+            return tuple(_read_frame(path) for path in part_paths)
+
+    result = compute()
+    if isinstance(result, tuple):
+        for i, df in enumerate(result):
+            _write_frame(df, f"{prefix}.{i}of{len(result)}.parquet")
+    else:
+        _write_frame(result, single_path)
+
+    evict_stages(cache_dir, max_bytes)
+    return result
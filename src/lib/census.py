@@ -0,0 +1,107 @@
+import os
+
+import pandas as pd
+
+from lib.data import CENSUS_COLUMNS
+
+# bump when the stored columns or their preparation change, so that stores
+# written by older code are refetched instead of read
+CENSUS_STORE_VERSION = 1
+
+# geography of each ACS table: the R function building it in DataGathering.R
+CENSUS_TABLES = {
+    "t": "make_acs_table_t",
+    "bg": "make_acs_table_bg",
+}
+
+
+def census_store_dir(store_dir: str, year: int) -> str:
+    """
+    Function to return the directory of the stored ACS tables for a year.
+    """
+    return os.path.join(store_dir, f"acs{year}-v{CENSUS_STORE_VERSION}")
+
+
+def _table_path(store_dir: str, year: int, census_type: str) -> str:
+    return os.path.join(census_store_dir(store_dir, year), f"{census_type}.parquet")
+
+
+def write_census_store(tables: dict, year: int, store_dir: str) -> str:
+    """
+    Function to store ACS tables as Parquet, keeping only the columns
+    build_analytic_dataset uses. Returns the directory of the year.
+
+    Parameters:
+    tables: ACS table for each key of CENSUS_TABLES, e.g. {"t": ..., "bg": ...}.
+        Tables exported from tidycensus by other means can be stored this way too.
+    """
+    year_dir = census_store_dir(store_dir, year)
+    os.makedirs(year_dir, exist_ok=True)
+
+    for census_type in CENSUS_TABLES:
+        table = tables[census_type][CENSUS_COLUMNS].copy()
+        table["GEOID"] = table["GEOID"].astype(str)
+        path = _table_path(store_dir, year, census_type)
+        table.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    return year_dir
+
+
+def fetch_census_tables(year: int, script_path: str) -> dict:
+    """
+    Function to fetch the ACS tables with tidycensus by running the R script
+    through rpy2. R is only started here, when the store has no tables.
+    """
+    import rpy2.robjects as robjects
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
+
+    robjects.r(f"source('{script_path}')")
+
+    tables = {}
+    # Convert the R DataFrames to pandas DataFrames
+    with localconverter(robjects.default_converter + pandas2ri.converter):
+        for census_type, r_function in CENSUS_TABLES.items():
+            make_acs_table = robjects.conversion.rpy2py(robjects.globalenv[r_function])
+            tables[census_type] = robjects.conversion.rpy2py(make_acs_table(year))
+
+    return tables
+
+
+def ensure_census_store(year: int, store_dir: str, script_path: str = None) -> str:
+    """
+    Function to make sure the ACS tables of a year are stored, fetching them
+    through R if they are not. Returns the directory of the year.
+    """
+    missing = [
+        census_type
+        for census_type in CENSUS_TABLES
+        if not os.path.exists(_table_path(store_dir, year, census_type))
+    ]
+    if missing:
+        if script_path is None:
+            raise FileNotFoundError(
+                f"No ACS {year} tables in {census_store_dir(store_dir, year)} "
+                f"(missing: {', '.join(missing)}) and no R script to fetch them"
+            )
+        write_census_store(fetch_census_tables(year, script_path), year, store_dir)
+
+    return census_store_dir(store_dir, year)
+
+
+def get_census_tables(year: int, store_dir: str, script_path: str = None) -> tuple:
+    """
+    Function to load the ACS tract and block group tables of a year from the
+    local store, fetching and storing them first if needed.
+
+    Parameters:
+    year: ACS 5-year estimate year, e.g. CONFIG.CENSUS_YEAR.
+    store_dir: Root of the store; each year is kept in its own directory.
+    script_path: R script defining the make_acs_table_* functions, used on a miss.
+    """
+    ensure_census_store(year, store_dir, script_path)
+    return tuple(
+        pd.read_parquet(_table_path(store_dir, year, census_type))
+        for census_type in CENSUS_TABLES
+    )
@@ -1,74 +1,173 @@
+import os
+import re
+import shutil
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+import psutil
 import pandas as pd
 import geopandas as gpd
+import shapely
+
+from lib.profiling import stage, frame_shape
+from lib.distribution import (
+    distributional_aggregates,
+    distributional_name,
+    is_distributional,
+)
+
+# pyogrio is optional: it reads only the requested columns, straight into arrays
+try:
+    import pyogrio
+except ImportError:  # pragma: no cover
+    pyogrio = None
+
+# Durham Open parcel columns used by the pipeline
+PARCEL_COLUMNS = [
+    "OBJECTID_1",
+    "OBJECTID",
+    "REID",
+    "PIN",
+    "PROPERTY_D",
+    "LOCATION_A",
+    "SPEC_DIST",
+    "LAND_CLASS",
+    "ACREAGE",
+    "PROPERTY_O",
+    "OWNER_MAIL",
+]
+
+# DPS parcel estimate columns joined onto the parcels
+DU_EST_COLUMNS = [
+    "REID",
+    "designation",
+    "housing_type",
+    "du_est_final",
+    "students2324",
+    "students2223",
+    "students2122",
+    "students2021",
+    "geo_id_b2010",
+    "geo_id_b2020",
+    "geo_id_bg2010",
+    "geo_id_bg2020",
+    "sch_id_base1819_es",
+    "sch_id_base_es",
+    "sch_id_gt_es",
+    "sch_id_yr_es",
+    "sch_id_yr_optout_es",
+    "sch_id_zone",
+    "sch_id_base_hs",
+    "sch_id_gt_hs",
+    "sch_id_base1819_ms",
+    "sch_id_base_ms",
+    "sch_id_gt_ms",
+    "sch_id_yr_ms",
+    "pu_2122_833",
+    "pu_2324_848",
+    "geo_id_t2010",
+    "geo_id_t2020",
+    "region",
+    "TOTAL_PROP_VALUE",
+]
+
+# yearly student counts of the DPS parcel estimates, "students" and the
+# school year, e.g. students2324 for 2023-24; years beyond those listed in
+# DU_EST_COLUMNS are picked up from the file, see du_est_columns
+STUDENT_COLUMN = re.compile(r"students(\d{2})(\d{2})")
+
+
+def student_columns(columns) -> list:
+    """
+    Function to pick the yearly student count columns out of columns, from
+    the earliest school year to the latest.
+    """
+    return sorted(
+        (col for col in columns if STUDENT_COLUMN.fullmatch(col)),
+        key=lambda col: int(STUDENT_COLUMN.fullmatch(col)[1]),
+    )
+
+
+def du_est_columns(path: str) -> list:
+    """
+    Function to list the columns to read from the DPS parcel estimates at
+    path: DU_EST_COLUMNS and the student counts of any other school year the
+    file has.
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+
+        header = pyarrow.parquet.read_schema(path).names
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+    return DU_EST_COLUMNS + [
+        col for col in student_columns(header) if col not in DU_EST_COLUMNS
+    ]
+
+
+# dtypes to read the DPS parcel estimates with
+DU_EST_DTYPES = {
+    "REID": str,
+    "designation": "category",
+    "housing_type": "category",
+    "geo_id_b2010": "Int64",
+    "geo_id_b2020": "Int64",
+    "geo_id_bg2010": "Int64",
+    "geo_id_bg2020": "Int64",
+    "geo_id_t2010": "Int64",
+    "geo_id_t2020": "Int64",
+}
+
+# census GEOIDs joined to the ACS tables, as int64 (see geoid_codes)
+GEOID_COLUMNS = ["geo_id_t2020", "geo_id_b2020", "geo_id_bg2020"]
+
+# DPS counts of dwelling units and students
+COUNT_COLUMNS = [
+    "du_est_final",
+    "students2324",
+    "students2223",
+    "students2122",
+    "students2021",
+]
+
+# columns optimize_dtypes leaves as they are: REID is the key parcels are
+# matched on across inputs and runs
+KEEP_DTYPES = ["REID"]
+
+# columns used from the ACS tract and block group tables
+CENSUS_COLUMNS = [
+    "GEOID",
+    "estimate_rent_total",
+    "moe_rent_total",
+    "estimate_median_house_value",
+    "estimate_median_year_structure_build",
+    "estimate_housing_units",
+    "pct_vacant",
+    "pct_owner_occupied",
+]
+
+
+# columns of the analytic dataset, in order
+ANALYTIC_COLUMNS = (
+    # durham open
+    PARCEL_COLUMNS
+    + ["geometry"]
+    # du est
+    + DU_EST_COLUMNS[1:]
+    # census t
+    + [f"{col}_t" for col in CENSUS_COLUMNS[1:]]
+    # bg
+    + [f"{col}_bg" for col in CENSUS_COLUMNS[1:]]
+)
 
 
 def subset_analytic_dataset(df: pd.DataFrame) -> pd.DataFrame:
     """
     Function to keep a pre-determined set of columns.
     """
-    subset_list = [
-        # durham open
-        "OBJECTID_1",
-        "OBJECTID",
-        "REID",
-        "PIN",
-        "PROPERTY_D",
-        "LOCATION_A",
-        "SPEC_DIST",
-        "LAND_CLASS",
-        "ACREAGE",
-        "PROPERTY_O",
-        "OWNER_MAIL",
-        "geometry",
-        # du est
-        "designation",
-        "housing_type",
-        "du_est_final",
-        "students2324",
-        "students2223",
-        "students2122",
-        "students2021",
-        "geo_id_b2010",
-        "geo_id_b2020",
-        "geo_id_bg2010",
-        "geo_id_bg2020",
-        "sch_id_base1819_es",
-        "sch_id_base_es",
-        "sch_id_gt_es",
-        "sch_id_yr_es",
-        "sch_id_yr_optout_es",
-        "sch_id_zone",
-        "sch_id_base_hs",
-        "sch_id_gt_hs",
-        "sch_id_base1819_ms",
-        "sch_id_base_ms",
-        "sch_id_gt_ms",
-        "sch_id_yr_ms",
-        "pu_2122_833",
-        "pu_2324_848",
-        "geo_id_t2010",
-        "geo_id_t2020",
-        "region",
-        "TOTAL_PROP_VALUE",
-        # census t
-        "estimate_rent_total_t",
-        "moe_rent_total_t",
-        "estimate_median_house_value_t",
-        "estimate_median_year_structure_build_t",
-        "estimate_housing_units_t",
-        "pct_vacant_t",
-        "pct_owner_occupied_t",
-        # bg
-        "estimate_rent_total_bg",
-        "moe_rent_total_bg",
-        "estimate_median_house_value_bg",
-        "estimate_median_year_structure_build_bg",
-        "estimate_housing_units_bg",
-        "pct_vacant_bg",
-        "pct_owner_occupied_bg",
-    ]
-    df_output = df[subset_list]
+    df_output = df[ANALYTIC_COLUMNS]
     df_output = df_output[df_output["du_est_final"] != 0]
 
     return df_output
@@ -77,6 +176,7 @@ def subset_analytic_dataset(df: pd.DataFrame) -> pd.DataFrame:
 def mean_and_round(x: pd.Series) -> float:
     """
     Function to return rounded mean.
+    aggregate_by_geo_id computes it natively when named as ROUNDED_MEAN.
     """
     if np.isnan(x.mean()):
         return np.nan
@@ -84,26 +184,268 @@ def mean_and_round(x: pd.Series) -> float:
         return round(x.mean())
 
 
-def get_parcels(path: str) -> gpd.GeoDataFrame:
+# name of the rounded mean in aggregation dicts, e.g. {"unit_val_cat_single": ROUNDED_MEAN}
+ROUNDED_MEAN = "mean_and_round"
+
+
+def is_rounded_mean(func) -> bool:
+    """
+    Function to check if an aggregation refers to the rounded mean.
+    """
+    return func is mean_and_round or (isinstance(func, str) and func == ROUNDED_MEAN)
+
+
+def _agg_name(func) -> str:
+    """
+    Function to return the column label pandas gives an aggregation.
+    """
+    if is_rounded_mean(func):
+        return ROUNDED_MEAN
+    if is_distributional(func):
+        return distributional_name(func)
+    return getattr(func, "__name__", func)
+
+
+def aggregate_column_names(agg: dict) -> list:
+    """
+    Function to list the columns aggregate_by_geo_id names after an agg dict,
+    without the geo id column.
+    """
+    return [
+        f"{col}_{_agg_name(func)}"
+        for col, funcs in agg.items()
+        for func in (funcs if isinstance(funcs, list) else [funcs])
+    ]
+
+
+def rounded_means(sums: pd.DataFrame, counts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to round means given as sums and counts, like mean_and_round does.
+    np.round rounds halves to even like round(), and NaN means stay NaN. Columns
+    without NaN are returned as integers, as round() would give.
+    """
+    # nullable integer sums would give Float64 means, keep them float64
+    means = np.round(sums.astype(np.float64) / counts)
+    for col in means.columns:
+        if means[col].notna().all():
+            means[col] = means[col].astype(np.int64)
+    return means
+
+
+def get_parcels(path: str, columns: list = None) -> gpd.GeoDataFrame:
     """
     Function to read in parcel data downloaded from Durham Open.
     This can be changed to download the data programatically from
     https://live-durhamnc.opendata.arcgis.com/datasets/da3d194d1e2e4c37afa851b46e29a3f6_0/explore
 
     The data needs to be downloaded as a shapefile, the path to which can be
-    provided in the main script CONFIG.
+    provided in the main script CONFIG. A GeoParquet copy (.parquet) can be
+    read instead. Only the given columns and the geometry are read, or all
+    columns if None.
     """
-    parcels_df = gpd.read_file(path)
-    return parcels_df
+    if path.endswith(".parquet"):
+        return gpd.read_parquet(
+            path, columns=None if columns is None else columns + ["geometry"]
+        )
+    return read_vector(path, columns=columns)
 
 
-def get_du_est(path: str) -> pd.DataFrame:
+def get_du_est(path: str, columns: list = None, dtype: dict = None) -> pd.DataFrame:
     """
     Function to read in the cleaned parcels file from DPS. This should have
     the estimated unit counts per parcel.
+
+    Only the given columns are read, or all columns if None. A Parquet copy
+    (.parquet) can be read instead of the CSV, in which case dtype is unused;
+    it defaults to DU_EST_DTYPES.
+    """
+    dtype = DU_EST_DTYPES if dtype is None else dtype
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, dtype=dtype)
+
+
+def read_vector(path: str, layer: str = None, columns: list = None) -> gpd.GeoDataFrame:
+    """
+    Function to read a vector file or a layer of it, keeping only the given
+    attribute columns (all of them if None) and the geometry.
+    """
+    if pyogrio is not None:
+        return pyogrio.read_dataframe(path, layer=layer, columns=columns)
+    elif columns is None:
+        return gpd.read_file(path, layer=layer)
+    else:
+        return gpd.read_file(path, layer=layer, include_fields=columns)
+
+
+def path_fingerprint(path: str, content: bool = False) -> str:
+    """
+    Function to fingerprint a file or a directory such as a .gdb from the
+    names, sizes and modification times of its files. With content=True the
+    file contents are hashed instead, which is slower but ignores touches.
     """
-    du_df = pd.read_csv(path)
-    return du_df
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    else:
+        files = [path]
+
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode())
+        if content:
+            with open(file, "rb") as f:
+                for block in iter(functools.partial(f.read, 2**20), b""):
+                    digest.update(block)
+        else:
+            stat = os.stat(file)
+            digest.update(f":{stat.st_size}:{stat.st_mtime_ns}".encode())
+
+    return digest.hexdigest()[:16]
+
+
+def get_boundary_layers(
+    path: str, layers: list, columns: list = None, cache_dir: str = None
+) -> dict:
+    """
+    Function to read layers from DPS all layers, returning {layer: GeoDataFrame}.
+
+    With a cache_dir, layers are kept as GeoParquet under a key made from the
+    GDB's fingerprint (and the columns read), so later runs load them without
+    opening the GDB, and a newly published GDB is read again automatically.
+
+    Parameters:
+    path: Path to the .gdb.
+    layers: Names of the layers to read.
+    columns: Attribute columns to read, all of them if None.
+    cache_dir: Directory to keep the GeoParquet copies in, no caching if None.
+    """
+    layer_dir = None
+    if cache_dir is not None:
+        key = path_fingerprint(path)
+        if columns is not None:
+            key += "-" + hashlib.sha256(",".join(columns).encode()).hexdigest()[:8]
+        prefix = os.path.basename(os.path.normpath(path)) + "-"
+        layer_dir = os.path.join(cache_dir, prefix + key)
+
+        # drop copies of older versions of this GDB
+        if os.path.isdir(cache_dir):
+            for name in os.listdir(cache_dir):
+                stale = os.path.join(cache_dir, name)
+                if name.startswith(prefix) and stale != layer_dir:
+                    shutil.rmtree(stale, ignore_errors=True)
+        os.makedirs(layer_dir, exist_ok=True)
+
+    boundaries = {}
+    for layer in layers:
+        cached = (
+            None if layer_dir is None else os.path.join(layer_dir, f"{layer}.parquet")
+        )
+        if cached is not None and os.path.exists(cached):
+            boundaries[layer] = gpd.read_parquet(cached)
+            continue
+
+        boundaries[layer] = read_vector(path, layer=layer, columns=columns)
+
+        if cached is not None:
+            boundaries[layer].to_parquet(cached + ".tmp")
+            os.replace(cached + ".tmp", cached)
+
+    return boundaries
+
+
+def _locate_points(points: np.ndarray, trees: list) -> list:
+    """
+    Function to return, for every tree, the index of the tree geometry each
+    point intersects, or -1 if none. Points on a shared edge intersect several
+    polygons and are given the first one, in the order of the layer.
+    """
+    located = []
+    for tree in trees:
+        point_idx, geom_idx = tree.query(points, predicate="intersects")
+        order = np.lexsort((geom_idx, point_idx))
+        point_idx, geom_idx = point_idx[order], geom_idx[order]
+        hit, first = np.unique(point_idx, return_index=True)
+
+        idx = np.full(len(points), -1, dtype=np.int64)
+        idx[hit] = geom_idx[first]
+        located.append(idx)
+    return located
+
+
+def assign_geographies(
+    parcels: gpd.GeoDataFrame,
+    boundaries: dict,
+    layer_mapping: dict,
+    workers: int = 1,
+    chunk_size: int = 50_000,
+) -> pd.DataFrame:
+    """
+    Function to derive the geo ids of every parcel from the boundary layers,
+    instead of taking them from the DPS CSV.
+
+    Each parcel is assigned to the polygon of every layer that contains its
+    representative point, found through an STRtree per layer. All layers are
+    queried for one chunk of parcels at a time, and chunks are spread over
+    threads with workers > 1 (shapely releases the GIL while querying).
+
+    Parameters:
+    parcels: Durham Open parcels, see get_parcels.
+    boundaries: {layer: GeoDataFrame}, see get_boundary_layers.
+    layer_mapping: {layer: geo id column}, the column is read from the layer
+        and named the same in the result, as in CONFIG.layer_mapping.
+    workers: Number of threads.
+    chunk_size: Number of parcels per chunk.
+
+    Returns a DataFrame with REID and one geo id column per layer, NaN for
+    parcels outside every polygon of a layer.
+    """
+    points = parcels.geometry.representative_point().to_numpy()
+
+    trees = []
+    for layer in layer_mapping:
+        layer_gdf = boundaries[layer]
+        if parcels.crs is not None and layer_gdf.crs != parcels.crs:
+            layer_gdf = layer_gdf.to_crs(parcels.crs)
+        trees.append(shapely.STRtree(layer_gdf.geometry.to_numpy()))
+
+    chunks = [
+        points[start : start + chunk_size]
+        for start in range(0, len(points), chunk_size)
+    ]
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_locate_points, chunks, [trees] * len(chunks)))
+    else:
+        results = [_locate_points(chunk, trees) for chunk in chunks]
+
+    geographies = pd.DataFrame({"REID": parcels["REID"].astype(str).to_numpy()})
+    for i, (layer, geo_col) in enumerate(layer_mapping.items()):
+        idx = (
+            np.concatenate([result[i] for result in results])
+            if results
+            else np.empty(0, dtype=np.int64)
+        )
+        # -1 is not a label, so unassigned parcels get NaN, as blanks in the CSV
+        values = boundaries[layer][geo_col].reset_index(drop=True).reindex(idx)
+        if geo_col in DU_EST_DTYPES and pd.api.types.is_numeric_dtype(values):
+            values = values.astype(DU_EST_DTYPES[geo_col])
+        geographies[geo_col] = values.to_numpy()
+
+    return geographies
+
+
+def replace_geographies(csv: pd.DataFrame, geographies: pd.DataFrame) -> pd.DataFrame:
+    """
+    Function to replace the geo id columns of the DPS CSV with those derived
+    by assign_geographies, matching parcels on REID.
+    """
+    lookup = geographies.drop_duplicates("REID").set_index("REID")
+    reid = csv["REID"].astype(str)
+    return csv.assign(**{col: reid.map(lookup[col]) for col in lookup.columns})
 
 
 def convert_datetime_to_str(df: pd.DataFrame) -> pd.DataFrame:
@@ -124,58 +466,6 @@ def convert_datetime_to_str(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def add_columns_from_csv(gdf: gpd.GeoDataFrame, csv: pd.DataFrame) -> gpd.GeoDataFrame:
-    """
-    Function to merge the Durham Open parcel data and the DPS parcel date on REID.
-    """
-    gdf["REID"] = gdf["REID"].astype(str)
-    csv["REID"] = csv["REID"].astype(str)
-
-    merged_csv_gdf = gdf.merge(
-        csv[
-            [
-                "REID",
-                "designation",
-                "housing_type",
-                "du_est_final",
-                "students2324",
-                "students2223",
-                "students2122",
-                "students2021",
-                "geo_id_b2010",
-                "geo_id_b2020",
-                "geo_id_bg2010",
-                "geo_id_bg2020",
-                "sch_id_base1819_es",
-                "sch_id_base_es",
-                "sch_id_gt_es",
-                "sch_id_yr_es",
-                "sch_id_yr_optout_es",
-                "sch_id_zone",
-                "sch_id_base_hs",
-                "sch_id_gt_hs",
-                "sch_id_base1819_ms",
-                "sch_id_base_ms",
-                "sch_id_gt_ms",
-                "sch_id_yr_ms",
-                "pu_2122_833",
-                "pu_2324_848",
-                "geo_id_t2010",
-                "geo_id_t2020",
-                "region",
-                "TOTAL_PROP_VALUE",
-            ]
-        ],
-        left_on="REID",
-        right_on="REID",
-        how="right",
-    )
-
-    merged_csv_gdf.dropna(subset="OBJECTID_1", inplace=True)
-
-    return merged_csv_gdf
-
-
 def fix_geoid_dtypes(series: pd.Series) -> pd.Series:
     """
     Function to convert a column series to str.
@@ -184,6 +474,14 @@ def fix_geoid_dtypes(series: pd.Series) -> pd.Series:
     return series.fillna(-1).astype(int).astype(str)
 
 
+def geoid_codes(series: pd.Series) -> pd.Series:
+    """
+    Function to convert a geo id column to int64, with -1 where missing: the
+    ids of fix_geoid_dtypes, without building a string for every row.
+    """
+    return series.fillna(-1).astype(np.int64)
+
+
 # Function to safely convert a column to int, fallback to str if it fails
 def safe_convert_to_int(df: pd.DataFrame, col_name: str) -> pd.DataFrame:
     """
@@ -196,65 +494,202 @@ def safe_convert_to_int(df: pd.DataFrame, col_name: str) -> pd.DataFrame:
     return df
 
 
-def add_columns_from_census(
-    gdf: gpd.GeoDataFrame, csv: pd.DataFrame, census_type: str = "t"
-) -> gpd.GeoDataFrame:
+def census_lookup(table: pd.DataFrame, geo_ids: pd.Series, suffix: str) -> dict:
+    """
+    Function to look up the census columns of a table for each geo id, as
+    {"{col}_{suffix}": series aligned with geo_ids}. Geo ids missing from the
+    table get NaN, as with a left merge.
     """
-    Function to add census columns.
+    table = table[CENSUS_COLUMNS].set_index("GEOID")
+    # GEOIDs are stored as str; integer geo ids are looked up as integers
+    if pd.api.types.is_integer_dtype(geo_ids):
+        table.index = table.index.astype(np.int64)
+    if not table.index.is_unique:
+        raise ValueError(f"Census table '{suffix}' has duplicate GEOIDs")
 
-    Parameters:
-    census_type: One of "t", "b", "bg", for tract, block and block group.
-    """
-    census_col_list = [
-        "GEOID",
-        "estimate_rent_total",
-        "moe_rent_total",
-        "estimate_median_house_value",
-        "estimate_median_year_structure_build",
-        "estimate_housing_units",
-        "pct_vacant",
-        "pct_owner_occupied",
-    ]
+    # a single hash lookup of the geo ids for all columns
+    values = table.reindex(geo_ids.to_numpy()).set_axis(geo_ids.index)
+    return {f"{col}_{suffix}": values[col] for col in values.columns}
+
+
+def join_positions(left_keys: pd.Series, right_keys: pd.Series) -> tuple:
+    """
+    Function to match rows on equal keys without moving any other column.
+    Returns the positions of the matched rows in left and in right, ordered
+    by left row, then by right row.
+    """
+    pairs = pd.merge(
+        pd.DataFrame({"key": left_keys.to_numpy(), "left": np.arange(len(left_keys))}),
+        pd.DataFrame(
+            {"key": right_keys.to_numpy(), "right": np.arange(len(right_keys))}
+        ),
+        on="key",
+        how="inner",
+    )
+    left, right = pairs["left"].to_numpy(), pairs["right"].to_numpy()
+    order = np.lexsort((right, left))
+    return left[order], right[order]
 
-    csv = csv[census_col_list]
 
-    if census_type == "t":
-        csv = csv.add_suffix("_t")
-        merged_csv_gdf = gdf.merge(
-            csv,
-            left_on="geo_id_t2020",
-            right_on="GEOID_t",
-            how="left",
+def _take(series: pd.Series, positions: np.ndarray, index: pd.Index) -> pd.Series:
+    # taking from the array keeps the dtype without copying the index
+    return pd.Series(series.array.take(positions), index=index, name=series.name)
+
+
+def build_analytic_dataset(
+    durham_open: gpd.GeoDataFrame,
+    parcels_clean: pd.DataFrame,
+    acs_table_t: pd.DataFrame,
+    acs_table_bg: pd.DataFrame,
+    geographies: pd.DataFrame = None,
+) -> gpd.GeoDataFrame:
+    """
+    Function to join the Durham Open parcels, the DPS parcel estimates and the
+    tract and block group census tables into the analytic dataset.
+
+    The rows to keep and the columns to take are planned first, on positions;
+    the census columns are looked up by GEOID, and the dataset is built from
+    those columns in one go instead of after every merge.
+
+    geographies: Geo ids from assign_geographies to use instead of those in
+        parcels_clean, or None to keep the CSV's.
+    """
+    if geographies is not None:
+        parcels_clean = replace_geographies(parcels_clean, geographies)
+
+    # row filters first: parcels without OBJECTID_1 and estimates without
+    # dwelling units are never joined, so none of their columns are copied
+    parcel_rows = np.flatnonzero(durham_open["OBJECTID_1"].notna().to_numpy())
+    du_est_rows = np.flatnonzero((parcels_clean["du_est_final"] != 0).to_numpy())
+
+    # one row per estimate and matching parcel, as the right merge on REID
+    # followed by dropna did
+    with stage("join_du_est") as record:
+        du_est_pos, parcel_pos = join_positions(
+            parcels_clean["REID"].astype(str).iloc[du_est_rows],
+            durham_open["REID"].astype(str).iloc[parcel_rows],
         )
-        merged_csv_gdf.drop(columns="GEOID_t", inplace=True)
-        pass
-
-    elif census_type == "b":
-        csv = csv.add_suffix("_b")
-        merged_csv_gdf = gdf.merge(
-            csv,
-            left_on="geo_id_b2020",
-            right_on="GEOID_b",
-            how="left",
+        du_est_pos, parcel_pos = du_est_rows[du_est_pos], parcel_rows[parcel_pos]
+        index = pd.RangeIndex(len(du_est_pos))
+        record["rows"] = len(index)
+
+    # only the projected columns of the matched rows are taken
+    with stage("take_columns") as record:
+        columns = {
+            col: _take(durham_open[col], parcel_pos, index)
+            for col in PARCEL_COLUMNS + ["geometry"]
+        }
+        columns["REID"] = columns["REID"].astype(str)
+        # student counts of school years beyond those listed are kept as well
+        extra_years = [
+            col
+            for col in student_columns(parcels_clean.columns)
+            if col not in DU_EST_COLUMNS
+        ]
+        columns.update(
+            {
+                col: _take(parcels_clean[col], du_est_pos, index)
+                for col in DU_EST_COLUMNS[1:] + extra_years
+            }
         )
-        merged_csv_gdf.drop(columns="GEOID_b", inplace=True)
-        pass
-
-    elif census_type == "bg":
-        csv = csv.add_suffix("_bg")
-        merged_csv_gdf = gdf.merge(
-            csv,
-            left_on="geo_id_bg2020",
-            right_on="GEOID_bg",
-            how="left",
+
+        # geo ids as int64 for the census lookups
+        for col in GEOID_COLUMNS:
+            columns[col] = geoid_codes(columns[col])
+        record.update(rows=len(index), columns=len(columns))
+
+    # adding columns from census data
+    for table, geo_col, suffix in [
+        (acs_table_t, "geo_id_t2020", "t"),
+        (acs_table_bg, "geo_id_bg2020", "bg"),
+    ]:
+        with stage("join_census", census_type=suffix) as record:
+            columns.update(census_lookup(table, columns[geo_col], suffix))
+            record.update(frame_shape(table))
+
+    # the analytic dataset is assembled once, from the planned columns,
+    # without copying them again
+    with stage("subset_analytic_dataset") as record:
+        gdf = gpd.GeoDataFrame(
+            {col: columns[col] for col in ANALYTIC_COLUMNS + extra_years},
+            geometry="geometry",
+            crs=durham_open.crs,
+            copy=False,
         )
-        merged_csv_gdf.drop(columns="GEOID_bg", inplace=True)
-        pass
+        record.update(frame_shape(gdf))
+    return gdf
+
+
+def is_whole(series: pd.Series, dtype=np.int32) -> bool:
+    """
+    Function to check that the values of a numeric column, missing values
+    aside, are whole numbers within the range of an integer dtype, so casting
+    them to it keeps every value.
+    """
+    values = series.dropna().to_numpy(dtype=np.float64)
+    limits = np.iinfo(dtype)
+    return bool(
+        np.all(np.mod(values, 1) == 0)
+        and np.all((values >= limits.min) & (values <= limits.max))
+    )
 
-    else:
-        raise ValueError
 
-    return merged_csv_gdf
+def optimize_dtypes(
+    df: pd.DataFrame,
+    code_columns: list = (),
+    id_columns: list = tuple(GEOID_COLUMNS),
+    count_columns: list = tuple(COUNT_COLUMNS),
+    max_category_ratio: float = 0.5,
+) -> pd.DataFrame:
+    """
+    Function to store the columns of a dataset in compact dtypes:
+    - id_columns holding integer strings (see fix_geoid_dtypes) become int64,
+    - other string columns become category if they have at most
+      max_category_ratio distinct values per row,
+    - code_columns, small whole numbers such as quartile categories, become
+      int8 (Int8 if they have missing values),
+    - count_columns and the student counts of every school year (see
+      student_columns) become int32 (Int32 if they have missing values) if
+      they only hold whole numbers that fit, and are left as they are
+      otherwise (e.g. fractional dwelling unit estimates),
+    - other int64 columns are downcast to the smallest integer dtype.
+    Floats are left as they are, so values do not change. Columns missing from
+    df are skipped.
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if col in KEEP_DTYPES or col == getattr(df, "_geometry_column_name", None):
+            continue
+
+        if col in id_columns and not pd.api.types.is_numeric_dtype(series):
+            columns[col] = series.astype(np.int64)
+        elif col in code_columns:
+            columns[col] = series.astype("Int8" if series.isna().any() else np.int8)
+        elif col in count_columns or STUDENT_COLUMN.fullmatch(col):
+            if is_whole(series, np.int32):
+                columns[col] = series.astype(
+                    "Int32" if series.isna().any() else np.int32
+                )
+        elif pd.api.types.is_string_dtype(series) or series.dtype == object:
+            if series.nunique() <= max_category_ratio * len(series):
+                columns[col] = series.astype("category")
+        elif series.dtype == np.int64:
+            columns[col] = pd.to_numeric(series, downcast="integer")
+
+    return df.assign(**columns)
+
+
+def memory_report(name: str, df: pd.DataFrame) -> str:
+    """
+    Function to describe the size of a stage's frame, and of the process.
+    """
+    frame_mb = df.memory_usage(deep=True).sum() / 2**20
+    process_mb = psutil.Process().memory_info().rss / 2**20
+    return (
+        f"Stage '{name}': {len(df)} rows x {df.shape[1]} columns, "
+        f"{frame_mb:.1f} MiB (process RSS {process_mb:.1f} MiB)"
+    )
 
 
 def aggregate_by_geo_id(
@@ -262,8 +697,53 @@ def aggregate_by_geo_id(
 ) -> gpd.GeoDataFrame:
     """
     Function to aggregate the geo dataframe by a certain geography encoded in geo_layer.
+
+    agg maps columns to a pandas aggregation or a list of them. ROUNDED_MEAN
+    (or the mean_and_round function) is computed from groupby sum and count
+    instead of calling a Python function for every group. Percentiles,
+    weighted means and medians and Gini coefficients are named as in
+    lib.distribution.DISTRIBUTIONAL, e.g. "p90" or "median@du_est_final",
+    and computed from one sort of the rows per column.
     """
-    agg_df = df.groupby(geo_layer).agg(agg).reset_index()
+    agg = {
+        col: funcs if isinstance(funcs, list) else [funcs] for col, funcs in agg.items()
+    }
+    # observed=True: only geo ids present in df, also for categorical columns
+    grouped = df.groupby(geo_layer, observed=True)
+
+    native_agg = {}
+    rounded_cols = []
+    distributional_agg = {}
+    for col, funcs in agg.items():
+        native = [
+            func
+            for func in funcs
+            if not is_rounded_mean(func) and not is_distributional(func)
+        ]
+        if native:
+            native_agg[col] = native
+        if any(map(is_rounded_mean, funcs)):
+            rounded_cols.append(col)
+        distributional = [func for func in funcs if is_distributional(func)]
+        if distributional:
+            distributional_agg[col] = distributional
+
+    agg_parts = []
+    if native_agg:
+        agg_parts.append(grouped.agg(native_agg))
+    if rounded_cols:
+        rounded = rounded_means(
+            grouped[rounded_cols].sum(), grouped[rounded_cols].count()
+        )
+        rounded.columns = pd.MultiIndex.from_product([rounded_cols, [ROUNDED_MEAN]])
+        agg_parts.append(rounded)
+    if distributional_agg:
+        agg_parts.append(distributional_aggregates(df, geo_layer, distributional_agg))
+
+    # keep the column order of the agg dict
+    agg_df = pd.concat(agg_parts, axis=1)[
+        [(col, _agg_name(func)) for col, funcs in agg.items() for func in funcs]
+    ].reset_index()
 
     # Flatten the column MultiIndex after aggregation
     agg_df.columns = [agg_df.columns[0][0]] + [
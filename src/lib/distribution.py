@@ -0,0 +1,172 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# distributional aggregations, named in agg dicts as "<statistic>" or, weighted
+# by another column, "<statistic>@<weight column>":
+# - "pNN": NNth percentile, e.g. "p90"; weighted, the smallest value with at
+#   least NN% of the weight at or below it
+# - "median": unweighted, pandas computes it natively
+# - "mean": weighted only, unweighted means are native
+# - "gini": Gini coefficient of the values, 0 when they are all equal
+DISTRIBUTIONAL = re.compile(
+    r"(?P<stat>p(?P<pct>[1-9][0-9]?)|median|mean|gini)(@(?P<weight>\w+))?"
+)
+
+
+def parse_distributional(func) -> tuple:
+    """
+    Function to parse the name of a distributional aggregation, as
+    (statistic, quantile, weight column): statistic is "quantile", "mean" or
+    "gini", quantile is None unless the statistic is a quantile, and weight
+    is None if unweighted. Returns None for other aggregations, also for the
+    unweighted median and mean left to pandas.
+    """
+    match = DISTRIBUTIONAL.fullmatch(func) if isinstance(func, str) else None
+    if match is None or (match["weight"] is None and func in ["median", "mean"]):
+        return None
+    if match["pct"] is not None:
+        return "quantile", int(match["pct"]) / 100, match["weight"]
+    if match["stat"] == "median":
+        return "quantile", 0.5, match["weight"]
+    return match["stat"], None, match["weight"]
+
+
+def is_distributional(func) -> bool:
+    return parse_distributional(func) is not None
+
+
+def distributional_name(func) -> str:
+    """
+    Function to name the column of a distributional aggregation after its
+    column, e.g. "unit_val_" + "median_by_du_est_final" for "median@du_est_final".
+    """
+    return func.replace("@", "_by_")
+
+
+def weight_columns(funcs: list) -> list:
+    """
+    Function to list the columns the aggregations of a column are weighted by.
+    """
+    specs = [parse_distributional(func) for func in funcs]
+    return list(dict.fromkeys(spec[2] for spec in specs if spec and spec[2]))
+
+
+def weighted_quantiles(
+    values: np.ndarray,
+    weights: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    q: float,
+) -> np.ndarray:
+    """
+    Function to compute the weighted quantile q of every group of values
+    sorted by group and value, the groups spanning starts:ends: the first
+    value whose cumulative weight within its group reaches q of the weight of
+    the group. Groups without weight are NaN.
+    """
+    # cumulative weights over all groups, less those of the groups before
+    cumulative = np.concatenate([[0], np.cumsum(weights)])
+    offsets = cumulative[starts]
+    totals = cumulative[ends] - offsets
+    if not len(values):
+        return np.full(len(starts), np.nan)
+    positions = np.searchsorted(cumulative[1:], offsets + q * totals, side="left")
+    positions = np.clip(positions, starts, np.maximum(ends - 1, 0))
+    return np.where(totals > 0, values[positions], np.nan)
+
+
+def interpolated_quantiles(
+    values: np.ndarray, starts: np.ndarray, ends: np.ndarray, q: float
+) -> np.ndarray:
+    """
+    Function to compute the quantile q of every group of values sorted by
+    group and value, the groups spanning starts:ends, interpolating linearly
+    between the values around it as pandas quantile does. Groups without
+    values are NaN.
+    """
+    counts = ends - starts
+    result = np.full(len(starts), np.nan)
+    nonempty = counts > 0
+    position = (counts[nonempty] - 1) * q
+    below = np.floor(position).astype(np.int64)
+    low = values[starts[nonempty] + below]
+    high = values[starts[nonempty] + np.minimum(below + 1, counts[nonempty] - 1)]
+    result[nonempty] = low + (high - low) * (position - below)
+    return result
+
+
+def sort_by_group(values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    Function to order rows by group code, then by value. Sorting the values,
+    then the codes with a stable sort (a radix sort for 16 bit codes) is
+    several times faster than np.lexsort.
+    """
+    order = np.argsort(values)
+    codes = codes.astype(np.int16 if n_groups < 2**15 else np.int64)
+    return order[np.argsort(codes[order], kind="stable")]
+
+
+def distributional_aggregates(
+    df: pd.DataFrame, geo_col: str, agg: dict
+) -> pd.DataFrame:
+    """
+    Function to compute distributional aggregations (see DISTRIBUTIONAL) of
+    every group of geo_col, with one sort of the rows by (geo id, value) per
+    column: quantiles, weighted means and Gini coefficients of all groups are
+    then read off cumulative sums of the sorted rows.
+
+    agg maps columns to lists of distributional aggregations. Rows missing
+    the value are left out, and rows missing the weight weigh nothing.
+    Returns a frame indexed by geo id as groupby gives it, with (column,
+    aggregation name) columns.
+    """
+    codes, uniques = pd.factorize(df[geo_col], sort=True)
+    n_groups = len(uniques)
+    columns = {}
+    for col, funcs in agg.items():
+        values = df[col].to_numpy(np.float64, na_value=np.nan)
+        valid = np.flatnonzero((codes >= 0) & ~np.isnan(values))
+        order = valid[sort_by_group(values[valid], codes[valid], n_groups)]
+        values = values[order]
+        groups = codes[order]
+        counts = np.bincount(groups, minlength=n_groups)
+        ends = np.cumsum(counts)
+        starts = ends - counts
+
+        for func in funcs:
+            stat, q, weight = parse_distributional(func)
+            if weight is None:
+                weights = np.ones(len(values))
+            else:
+                weights = df[weight].to_numpy(np.float64, na_value=np.nan)[order]
+                weights[np.isnan(weights)] = 0
+
+            if stat == "quantile" and weight is None:
+                result = interpolated_quantiles(values, starts, ends, q)
+            elif stat == "quantile":
+                result = weighted_quantiles(values, weights, starts, ends, q)
+            else:
+                totals = np.bincount(groups, weights, minlength=n_groups)
+                weighted = weights * values
+                sums = np.bincount(groups, weighted, minlength=n_groups)
+                if stat == "mean":
+                    result = sums / np.where(totals > 0, totals, np.nan)
+                else:
+                    # Gini from the weight at or below every value in its group:
+                    # sum(w x (2 c - w - W)) / (W sum(w x))
+                    cumulative = np.cumsum(weights)
+                    below = (
+                        cumulative - np.concatenate([[0], cumulative])[starts][groups]
+                    )
+                    spread = np.bincount(
+                        groups,
+                        weighted * (2 * below - weights - totals[groups]),
+                        minlength=n_groups,
+                    )
+                    denominator = totals * sums
+                    result = spread / np.where(denominator != 0, denominator, np.nan)
+            columns[(col, distributional_name(func))] = result
+
+    return pd.DataFrame(columns, index=pd.Index(uniques, name=geo_col))
@@ -0,0 +1,69 @@
+import warnings
+
+import numpy as np
+import geopandas as gpd
+import shapely
+
+# shapely >= 2.1 (GEOS >= 3.12) simplifies the polygons of a coverage
+# together, so that neighbours keep sharing their simplified boundaries
+_COVERAGE_SIMPLIFY = hasattr(shapely, "coverage_simplify")
+
+
+def count_vertices(geometry) -> int:
+    """
+    Function to count the vertices of an array of geometries, missing
+    geometries having none.
+    """
+    return int(shapely.get_num_coordinates(np.asarray(geometry)).sum())
+
+
+def simplify_coverage(geometry, tolerance: float) -> np.ndarray:
+    """
+    Function to simplify polygons tiling an area without overlaps (a
+    coverage, as census geographies and school zones are) by tolerance, in
+    the units of their CRS. Every boundary two polygons share is simplified
+    once, so no gaps or overlaps open between neighbours. Missing and empty
+    geometries are left as they are.
+
+    With shapely < 2.1, polygons are simplified one by one (keeping their
+    own topology only), with a warning.
+    """
+    geometry = np.array(geometry, dtype=object)
+    present = ~(shapely.is_missing(geometry) | shapely.is_empty(geometry))
+    if _COVERAGE_SIMPLIFY:
+        geometry[present] = shapely.coverage_simplify(geometry[present], tolerance)
+    else:
+        warnings.warn(
+            "shapely < 2.1 cannot simplify a coverage, polygons are simplified "
+            "one by one and neighbours may no longer share their boundaries"
+        )
+        geometry[present] = shapely.simplify(
+            geometry[present], tolerance, preserve_topology=True
+        )
+    return geometry
+
+
+def optimize_geometry(
+    gdf: gpd.GeoDataFrame, simplify: float = 0.0, precision: float = 0.0
+) -> gpd.GeoDataFrame:
+    """
+    Function to lighten the geometry of a layer before it is written: its
+    polygons are simplified as a coverage by simplify (see simplify_coverage),
+    then their coordinates are snapped to a grid of precision with
+    shapely.set_precision, which keeps them valid. Both are in the units of
+    the CRS, 0 to skip the step.
+
+    Returns a copy of gdf, with the vertices of its geometry before and after
+    in attrs["vertices"].
+    """
+    geometry = gdf.geometry.to_numpy()
+    vertices = count_vertices(geometry)
+    if simplify > 0:
+        geometry = simplify_coverage(geometry, simplify)
+    if precision > 0:
+        geometry = shapely.set_precision(geometry, precision)
+
+    optimized = gdf.copy()
+    optimized[gdf.geometry.name] = gpd.GeoSeries(geometry, index=gdf.index, crs=gdf.crs)
+    optimized.attrs["vertices"] = (vertices, count_vertices(geometry))
+    return optimized
@@ -0,0 +1,375 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from lib.data import aggregate_by_geo_id, _agg_name
+from lib.distribution import weight_columns
+from lib.aggregation import (
+    ROWS,
+    is_stateful,
+    group_state,
+    update_group_state,
+    aggregate_from_state,
+)
+from lib.variables import UNIT_VALUE_CATEGORIES, unit_value_thresholds
+from lib.cache import stage_key
+
+# bump when the snapshot layout changes, so older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+# incremental updates after which the group states are computed from the
+# rows again, so the rounding error of float sums updated by subtraction and
+# addition does not build up over runs
+REBASE_AFTER = 20
+
+# columns identifying a parcel row between runs; REID can repeat, so rows
+# sharing a REID are told apart by their order
+ROW_KEY = ["REID", "_occurrence"]
+
+
+def _as_lists(agg: dict) -> dict:
+    return {
+        col: funcs if isinstance(funcs, list) else [funcs] for col, funcs in agg.items()
+    }
+
+
+def aggregated_columns(agg: dict) -> list:
+    """
+    Function to list the columns an agg dict reads: the aggregated columns and
+    the columns they are weighted by.
+    """
+    columns = list(agg)
+    for funcs in agg.values():
+        columns += [col for col in weight_columns(funcs) if col not in columns]
+    return columns
+
+
+def snapshot_rows(
+    df: pd.DataFrame, layer_mapping: dict, aggregations: dict
+) -> pd.DataFrame:
+    """
+    Function to keep the columns of df the layer aggregates depend on, keyed
+    by ROW_KEY: the geo id column of every layer and every aggregated column
+    (and column aggregations are weighted by).
+    """
+    columns = list(dict.fromkeys(layer_mapping.values()))
+    for agg in aggregations.values():
+        columns += [col for col in aggregated_columns(agg) if col not in columns]
+
+    rows = df[["REID"] + columns].copy()
+    rows["_occurrence"] = rows.groupby("REID").cumcount()
+    return rows.set_index(ROW_KEY)
+
+
+def changed_rows(old: pd.DataFrame, new: pd.DataFrame, columns: list) -> tuple:
+    """
+    Function to diff two snapshots of rows on columns. Returns the rows that
+    were removed, added or modified, as they were in old and as they are in new.
+    """
+    old_hash = pd.util.hash_pandas_object(old[columns], index=False)
+    new_hash = pd.util.hash_pandas_object(new[columns], index=False)
+
+    common = old_hash.index.intersection(new_hash.index)
+    modified = common[old_hash[common].to_numpy() != new_hash[common].to_numpy()]
+    removed = old_hash.index.difference(new_hash.index)
+    added = new_hash.index.difference(old_hash.index)
+
+    return old.loc[modified.union(removed)], new.loc[modified.union(added)]
+
+
+def _full_layer(rows: pd.DataFrame, geo_col: str, agg: dict) -> tuple:
+    """
+    Function to compute the group state and the aggregates of a layer from scratch.
+    """
+    state_cols = [col for col, funcs in agg.items() if any(map(is_stateful, funcs))]
+    return group_state(rows, geo_col, state_cols), aggregate_by_geo_id(
+        rows, geo_col, agg
+    )
+
+
+def _update_layer(
+    state: pd.DataFrame,
+    agg_df: pd.DataFrame,
+    old: pd.DataFrame,
+    new: pd.DataFrame,
+    rows: pd.DataFrame,
+    geo_col: str,
+    agg: dict,
+    recompute: list,
+) -> tuple:
+    """
+    Function to update the group state and the aggregates of a layer for the
+    changed rows old/new. Columns in recompute are aggregated again over all
+    rows. Returns None if no group of the layer is affected.
+    """
+    # rows that changed, but not in the columns of this layer, leave it as is
+    old, new = changed_rows(
+        old,
+        new,
+        [geo_col] + [col for col in aggregated_columns(agg) if col not in recompute],
+    )
+    # columns weighted by a recomputed column are recomputed with it
+    recompute = [
+        col
+        for col, funcs in agg.items()
+        if col in recompute or set(weight_columns(funcs)) & set(recompute)
+    ]
+    touched = pd.Index(old[geo_col].dropna().unique()).union(
+        pd.Index(new[geo_col].dropna().unique())
+    )
+    if touched.empty and not recompute:
+        return None
+
+    state_cols = [col for col, funcs in agg.items() if any(map(is_stateful, funcs))]
+    removed = group_state(old, geo_col, state_cols)
+    state = update_group_state(state, removed, group_state(new, geo_col, state_cols))
+
+    # inf - inf is NaN, so groups that lost a non-finite value are recounted
+    sum_cols = [f"{col}_sum" for col in state_cols]
+    lost_non_finite = removed.index[
+        ~np.isfinite(removed[sum_cols].to_numpy(dtype=np.float64)).all(axis=1)
+    ].intersection(state.index)
+    if not lost_non_finite.empty:
+        recount = group_state(
+            rows[rows[geo_col].isin(lost_non_finite)], geo_col, state_cols
+        )
+        state.loc[lost_non_finite] = recount.loc[lost_non_finite, state.columns]
+
+    # columns whose values changed for unchanged rows are recomputed in full
+    recompute_state = [col for col in recompute if col in state_cols]
+    if recompute_state:
+        full = group_state(rows, geo_col, recompute_state).reindex(state.index)
+        state[full.columns.drop(ROWS)] = full.drop(columns=ROWS)
+
+    agg_parts = [
+        aggregate_from_state(
+            state,
+            geo_col,
+            {
+                col: [func for func in funcs if is_stateful(func)]
+                for col, funcs in agg.items()
+                if col in state_cols
+            },
+        ).set_index(geo_col)
+    ]
+
+    # other aggregations need the rows of a group: only touched groups are
+    # aggregated again, unless the column is recomputed
+    other = {
+        col: [func for func in funcs if not is_stateful(func)]
+        for col, funcs in agg.items()
+    }
+    other = {col: funcs for col, funcs in other.items() if funcs}
+    if other:
+        incremental = {col: f for col, f in other.items() if col not in recompute}
+        full = {col: f for col, f in other.items() if col in recompute}
+        if incremental:
+            fresh = aggregate_by_geo_id(
+                rows[rows[geo_col].isin(touched)], geo_col, incremental
+            ).set_index(geo_col)
+            kept = agg_df.set_index(geo_col)[fresh.columns]
+            agg_parts.append(
+                pd.concat([kept.drop(index=touched, errors="ignore"), fresh])
+            )
+        if full:
+            agg_parts.append(
+                aggregate_by_geo_id(rows, geo_col, full).set_index(geo_col)
+            )
+
+    # keep the column order of the agg dict
+    order = [f"{col}_{_agg_name(func)}" for col, funcs in agg.items() for func in funcs]
+    agg_df = pd.concat(agg_parts, axis=1).reindex(state.index)[order]
+    agg_df.index.name = geo_col
+    return state, agg_df.reset_index()
+
+
+def update_aggregates(
+    df: pd.DataFrame,
+    layer_mapping: dict,
+    aggregations: dict,
+    snapshot_dir: str,
+    force: bool = False,
+    rebase_after: int = REBASE_AFTER,
+) -> tuple:
+    """
+    Function to bring the aggregates of every layer up to date with df,
+    updating only the groups touched by rows that changed since the snapshot.
+
+    Sums and counts are kept per group, so sums, counts and means (rounded or
+    not) are updated from the changed rows alone. Quartile thresholds are
+    global: if they moved, the category columns are aggregated again over all
+    rows. Without a usable snapshot (or with force) every layer is computed
+    from scratch.
+
+    Float sums are updated by subtraction and addition, so they can differ
+    from a full recompute in the last digits, by about the rounding error of
+    the values added and removed since the states were last computed from
+    the rows. Every rebase_after updates they are, and the layers whose
+    aggregates moved are returned as changed.
+
+    Parameters:
+    df: The processed base dataset.
+    layer_mapping: {layer: geo id column of df}, as CONFIG.layer_mapping.
+    aggregations: {layer: agg dict}, as passed to aggregate_by_geo_id.
+    snapshot_dir: Directory of the snapshot, see save_snapshot.
+    force: Ignore the snapshot.
+    rebase_after: Number of incremental updates between full recomputes.
+
+    Returns ({layer: aggregated frame} for the layers whose aggregates
+    changed, new snapshot). Save the snapshot once the outputs are written.
+    """
+    aggregations = {layer: _as_lists(agg) for layer, agg in aggregations.items()}
+    rows = snapshot_rows(df, layer_mapping, aggregations)
+    # a change of dtypes (e.g. geo ids stored as int instead of str) would
+    # mix old and new group keys, so it invalidates the snapshot
+    config = stage_key(
+        SNAPSHOT_VERSION,
+        layer_mapping,
+        {
+            layer: {col: list(map(_agg_name, funcs)) for col, funcs in agg.items()}
+            for layer, agg in aggregations.items()
+        },
+        {col: str(dtype) for col, dtype in rows.dtypes.items()},
+    )
+    thresholds = {
+        col: values.tolist() for col, values in unit_value_thresholds(df).items()
+    }
+
+    snapshot = None if force else load_snapshot(snapshot_dir, layer_mapping)
+    new_snapshot = {
+        "config": config,
+        "thresholds": thresholds,
+        "updates": 0,
+        "rows": rows,
+        "states": {},
+        "aggregates": {},
+    }
+
+    if snapshot is None or snapshot["config"] != config:
+        for layer, geo_col in layer_mapping.items():
+            state, agg_df = _full_layer(rows, geo_col, aggregations[layer])
+            new_snapshot["states"][layer] = state
+            new_snapshot["aggregates"][layer] = agg_df
+        return dict(new_snapshot["aggregates"]), new_snapshot
+
+    # categories of unchanged rows move with the thresholds, so they are left
+    # out of the diff and recomputed instead
+    shifted = [
+        col
+        for col in UNIT_VALUE_CATEGORIES
+        if col in rows.columns
+        and not np.array_equal(
+            snapshot["thresholds"].get(col), thresholds[col], equal_nan=True
+        )
+    ]
+    diff_columns = [col for col in rows.columns if col not in shifted]
+    old, new = changed_rows(snapshot["rows"], rows, diff_columns)
+
+    changed = {}
+    for layer, geo_col in layer_mapping.items():
+        updated = _update_layer(
+            snapshot["states"][layer],
+            snapshot["aggregates"][layer],
+            old,
+            new,
+            rows,
+            geo_col,
+            aggregations[layer],
+            shifted,
+        )
+        if updated is None:
+            new_snapshot["states"][layer] = snapshot["states"][layer]
+            new_snapshot["aggregates"][layer] = snapshot["aggregates"][layer]
+        else:
+            new_snapshot["states"][layer], changed[layer] = updated
+            new_snapshot["aggregates"][layer] = changed[layer]
+
+    new_snapshot["updates"] = snapshot["updates"] + 1
+    if new_snapshot["updates"] >= rebase_after:
+        for layer, geo_col in layer_mapping.items():
+            state, agg_df = _full_layer(rows, geo_col, aggregations[layer])
+            if layer in changed or not agg_df.equals(new_snapshot["aggregates"][layer]):
+                changed[layer] = agg_df
+            new_snapshot["states"][layer] = state
+            new_snapshot["aggregates"][layer] = agg_df
+        new_snapshot["updates"] = 0
+
+    print(
+        f"Incremental refresh: {len(old.index.union(new.index))} changed rows, "
+        f"quartile thresholds {'moved for ' + ', '.join(shifted) if shifted else 'unchanged'}, "
+        f"{len(changed)} of {len(layer_mapping)} layers affected"
+        f"{'' if new_snapshot['updates'] else ', group states recomputed'}"
+    )
+    return changed, new_snapshot
+
+
+def load_snapshot(snapshot_dir: str, layer_mapping: dict) -> dict:
+    """
+    Function to load the snapshot written by save_snapshot, or None if there
+    is no complete one.
+    """
+    meta_path = os.path.join(snapshot_dir, "snapshot.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+
+    paths = [os.path.join(snapshot_dir, "rows.parquet")] + [
+        os.path.join(snapshot_dir, f"{layer}.{part}.parquet")
+        for layer in layer_mapping
+        for part in ["state", "aggregates"]
+    ]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+
+    return {
+        "config": meta["config"],
+        "thresholds": meta["thresholds"],
+        "updates": meta.get("updates", 0),
+        "rows": pd.read_parquet(paths[0]),
+        "states": {
+            layer: pd.read_parquet(os.path.join(snapshot_dir, f"{layer}.state.parquet"))
+            for layer in layer_mapping
+        },
+        "aggregates": {
+            layer: pd.read_parquet(
+                os.path.join(snapshot_dir, f"{layer}.aggregates.parquet")
+            )
+            for layer in layer_mapping
+        },
+    }
+
+
+def save_snapshot(snapshot_dir: str, snapshot: dict, layers: list = None) -> None:
+    """
+    Function to save a snapshot returned by update_aggregates. The metadata is
+    written last, so an interrupted save leaves no snapshot to load.
+
+    Parameters:
+    layers: Layers whose state changed, e.g. the keys returned with the
+        snapshot; the files of the other layers are kept. None saves all.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta_path = os.path.join(snapshot_dir, "snapshot.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    frames = {"rows": snapshot["rows"]}
+    for layer, state in snapshot["states"].items():
+        if layers is None or layer in layers:
+            frames[f"{layer}.state"] = state
+            frames[f"{layer}.aggregates"] = snapshot["aggregates"][layer]
+    for name, frame in frames.items():
+        frame.to_parquet(os.path.join(snapshot_dir, f"{name}.parquet"))
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "config": snapshot["config"],
+                "thresholds": snapshot["thresholds"],
+                "updates": snapshot["updates"],
+            },
+            f,
+        )
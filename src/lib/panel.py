@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+from lib.data import STUDENT_COLUMN, _agg_name, aggregate_by_geo_id, student_columns
+from lib.aggregation import ROWS, aggregate_from_state, is_stateful
+
+# column of the panel holding the school year, as the calendar year it starts
+YEAR = "year"
+
+
+def school_year(col: str) -> int:
+    """
+    Function to give the calendar year the school year of a student count
+    column starts in, e.g. 2023 for students2324.
+    """
+    return 2000 + int(STUDENT_COLUMN.fullmatch(col)[1])
+
+
+def yearly_state(df: pd.DataFrame, geo_col: str, columns: list) -> pd.DataFrame:
+    """
+    Function to compute the group state (see group_state) of the yearly
+    columns by geo_col, the rows grouped once for all years: with the geo ids
+    factorized, the sums and counts of a year are a np.bincount each, a
+    fraction of a pandas groupby reduction.
+    """
+    codes, uniques = pd.factorize(df[geo_col], sort=True)
+    placed = codes >= 0
+    codes = codes[placed]
+    sizes = np.bincount(codes, minlength=len(uniques))
+
+    sums, counts = {}, {}
+    for col in columns:
+        values = df[col].to_numpy(np.float64, na_value=np.nan)[placed]
+        present = ~np.isnan(values)
+        if present.all():
+            sums[col] = np.bincount(codes, values, minlength=len(uniques))
+            counts[col] = sizes
+        else:
+            sums[col] = np.bincount(
+                codes[present], values[present], minlength=len(uniques)
+            )
+            counts[col] = np.bincount(codes[present], minlength=len(uniques))
+        # counts are whole numbers, summed exactly as floats
+        if pd.api.types.is_integer_dtype(df[col]):
+            sums[col] = sums[col].astype(np.int64)
+
+    state = pd.concat(
+        [
+            pd.DataFrame(sums).add_suffix("_sum"),
+            pd.DataFrame(counts).add_suffix("_count"),
+            pd.DataFrame({ROWS: sizes}),
+        ],
+        axis=1,
+    )
+    state.index = pd.Index(uniques, name=geo_col)
+    return state
+
+
+def stack_years(wide: pd.DataFrame, columns: list, suffixes: list) -> pd.DataFrame:
+    """
+    Function to reshape a frame indexed by geo id with a "{col}_{suffix}"
+    column per yearly column and suffix to a "students_{suffix}" column per
+    suffix, indexed by geo id and YEAR in this order.
+    """
+    index = pd.MultiIndex.from_product(
+        [wide.index, [school_year(col) for col in columns]],
+        names=[wide.index.name, YEAR],
+    )
+    # a row per geo id with its years side by side, raveled year by year
+    return pd.DataFrame(
+        {
+            f"students_{suffix}": np.column_stack(
+                [wide[f"{col}_{suffix}"].to_numpy() for col in columns]
+            ).ravel()
+            for suffix in suffixes
+        },
+        index=index,
+    )
+
+
+def panel_aggregates(
+    df: pd.DataFrame, geo_col: str, funcs: list, columns: list = None
+) -> pd.DataFrame:
+    """
+    Function to aggregate the student counts of every school year by geo_col,
+    as a panel with a row per geo id and year (YEAR).
+
+    The yearly columns (all student_columns of df, or columns) are grouped
+    once for all years: sums, counts and means (rounded or not) are computed
+    from the yearly_state of the rows stacked to a row per geo id and year,
+    other aggregations with aggregate_by_geo_id before stacking. Every
+    aggregation gives a "students_<func>" column, next to its change from
+    the previous year of the panel ("students_<func>_delta", NaN in the
+    first year).
+    """
+    funcs = funcs if isinstance(funcs, list) else [funcs]
+    columns = student_columns(df.columns) if columns is None else columns
+    names = [f"students_{_agg_name(func)}" for func in funcs]
+
+    if all(map(is_stateful, funcs)):
+        state = yearly_state(df, geo_col, columns)
+        stacked = stack_years(state, columns, ["sum", "count"])
+        stacked[ROWS] = np.repeat(state[ROWS].to_numpy(), len(columns))
+        panel = aggregate_from_state(stacked, geo_col, {"students": funcs})
+    else:
+        wide = aggregate_by_geo_id(df, geo_col, {col: funcs for col in columns})
+        wide = wide.set_index(geo_col)
+        suffixes = [_agg_name(func) for func in funcs]
+        panel = stack_years(wide, columns, suffixes).reset_index()
+
+    # rows are sorted by geo id and year, the first year of a geo id has no
+    # previous year to differ from
+    first_year = panel[YEAR] == school_year(columns[0])
+    for name in names:
+        deltas = panel[name].diff().mask(first_year)
+        # deltas of integer aggregates (sums, rounded means) stay integers,
+        # with missing values in the first year
+        if pd.api.types.is_integer_dtype(panel[name]):
+            deltas = deltas.astype("Int64")
+        panel[f"{name}_delta"] = deltas
+    return panel
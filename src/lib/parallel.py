@@ -0,0 +1,82 @@
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import geopandas as gpd
+
+# frame shared with the worker processes, set by their pool initializer; see
+# map_layers
+_shared = {}
+
+
+def _set_shared(frame: pd.DataFrame) -> None:
+    """
+    Function to set the shared frame in a worker.
+    """
+    _shared["frame"] = frame
+
+
+def _load_snapshot(path: str, geo: bool) -> None:
+    """
+    Function to load the shared frame in a worker from a Parquet snapshot.
+    """
+    _set_shared(gpd.read_parquet(path) if geo else pd.read_parquet(path))
+
+
+def _run_layer(func, layer: str, shared: pd.DataFrame = None) -> tuple:
+    """
+    Function to run func on one layer, timing it, on the shared frame of the
+    worker unless one is given.
+    """
+    start = time.perf_counter()
+    result = func(layer, _shared["frame"] if shared is None else shared)
+    return layer, result, time.perf_counter() - start
+
+
+def map_layers(func, layers: list, shared: pd.DataFrame, workers: int = 1):
+    """
+    Function to run func(layer, shared) for every layer, yielding
+    (layer, result, seconds) in the order of layers.
+
+    With workers > 1 the layers are spread over a process pool, whose
+    initializer gives every worker the shared frame: through fork
+    copy-on-write where fork is available, and otherwise from a Parquet
+    snapshot, so it is never pickled per task. func must be a module-level
+    function, and only its result is sent back to this process.
+    """
+    layers = list(layers)
+
+    if workers <= 1:
+        for layer in layers:
+            yield _run_layer(func, layer, shared)
+        return
+
+    snapshot_dir = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        # forked workers inherit the initializer arguments without pickling
+        pool_kwargs = {
+            "mp_context": multiprocessing.get_context("fork"),
+            "initializer": _set_shared,
+            "initargs": (shared,),
+        }
+    else:
+        snapshot_dir = tempfile.mkdtemp()
+        snapshot_path = os.path.join(snapshot_dir, "shared.parquet")
+        shared.to_parquet(snapshot_path)
+        pool_kwargs = {
+            "initializer": _load_snapshot,
+            "initargs": (snapshot_path, isinstance(shared, gpd.GeoDataFrame)),
+        }
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, **pool_kwargs) as pool:
+            futures = [pool.submit(_run_layer, func, layer) for layer in layers]
+            for future in futures:
+                yield future.result()
+    finally:
+        if snapshot_dir is not None:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
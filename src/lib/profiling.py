@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: stages are recorded without their peak memory
+    resource = None
+
+# formats stage records are written in: a JSON object per line, or the JSON
+# array of trace events read by chrome://tracing and Perfetto
+TRACE_FORMATS = ["jsonl", "chrome"]
+
+# the settings live in the environment, so worker processes, forked or
+# spawned, record to the same file as the main process
+_ENV = "DPS_PROFILE"
+
+# the memory fields of /proc/self/status and the peak reset of
+# /proc/self/clear_refs are Linux only
+_PROC = sys.platform.startswith("linux")
+
+# stages open in this process, innermost last; see stage
+_open_stages = []
+
+# the process the open stages belong to, and whether a stage is run under
+# cProfile: only one cProfile profiler can be active in a process
+_state = {"pid": None, "cprofile_active": False}
+
+
+def configure_profiling(
+    path: str = None,
+    trace_format: str = "jsonl",
+    cprofile: list = (),
+    cprofile_dir: str = None,
+) -> None:
+    """
+    Function to record every stage of this process and its workers to path,
+    or to stop recording with path None. The file is started afresh.
+
+    Parameters:
+    trace_format: One of TRACE_FORMATS.
+    cprofile: Names of the stages to run under cProfile, or ["all"]. Their
+        stats are dumped to cprofile_dir as <stage>[.<attributes>].<pid>.prof,
+        for pstats, snakeviz or gprof2dot.
+    """
+    if path is None:
+        os.environ.pop(_ENV, None)
+        return
+    if trace_format not in TRACE_FORMATS:
+        raise ValueError(
+            f"Unknown trace format {trace_format!r}, expected one of {TRACE_FORMATS}"
+        )
+    if cprofile and cprofile_dir is None:
+        raise ValueError("cprofile_dir is needed to profile stages with cProfile")
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if cprofile_dir is not None:
+        os.makedirs(cprofile_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        # trace viewers accept an array without its closing bracket, so events
+        # can be appended as they come, by several processes
+        f.write("[\n" if trace_format == "chrome" else "")
+
+    os.environ[_ENV] = json.dumps(
+        {
+            "path": path,
+            "format": trace_format,
+            "cprofile": list(cprofile),
+            "cprofile_dir": cprofile_dir,
+        }
+    )
+
+
+def _settings() -> dict:
+    settings = os.environ.get(_ENV)
+    return json.loads(settings) if settings else None
+
+
+def _status_mb(field: str) -> float:
+    """
+    Function to read a memory field (VmRSS, VmHWM) of this process in MiB,
+    or None where /proc is not available.
+    """
+    if not _PROC:
+        return None
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        return None
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Function to reset the peak resident size of this process to the current
+    one (Linux), so the peak of a stage does not include earlier stages.
+    """
+    if not _PROC:
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss_mb() -> float:
+    # peak of the whole process, in KiB on Linux and bytes on macOS; None
+    # without the resource module
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def _peak_mb() -> float:
+    peak = _status_mb("VmHWM")
+    return _max_rss_mb() if peak is None else peak
+
+
+def frame_shape(result) -> dict:
+    """
+    Function to return the rows and columns of a frame, or of each frame of a
+    tuple, as recorded with a stage.
+    """
+    if isinstance(result, tuple):
+        shapes = [frame_shape(item) for item in result]
+        if shapes and all(shapes):
+            return {
+                "rows": [shape["rows"] for shape in shapes],
+                "columns": [shape["columns"] for shape in shapes],
+            }
+        return {}
+    shape = getattr(result, "shape", None)
+    if shape is None or len(shape) != 2:
+        return {}
+    return {"rows": shape[0], "columns": shape[1]}
+
+
+def _write_record(settings: dict, record: dict) -> None:
+    if settings["format"] == "chrome":
+        args = {
+            key: value
+            for key, value in record.items()
+            if key not in ["stage", "pid", "tid", "start", "wall_s"]
+        }
+        line = json.dumps(
+            {
+                "name": record["stage"],
+                "cat": "stage",
+                "ph": "X",
+                "ts": round(record["start"] * 1e6),
+                "dur": round(record["wall_s"] * 1e6),
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": args,
+            }
+        )
+        line += ",\n"
+    else:
+        line = json.dumps(record) + "\n"
+
+    # a single append of a whole line, so lines of several processes do not mix
+    fd = os.open(settings["path"], os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def stage(name: str, /, **attributes):
+    """
+    Function to record a stage of the pipeline: wall time, CPU time of the
+    process, peak resident memory above the memory at its start, and any
+    attributes given (e.g. layer=...). Does nothing unless configure_profiling
+    was called.
+
+    Yields a dict the stage can add fields to, e.g. frame_shape of its
+    result, see profiled. On Linux the peak is that of the stage alone; elsewhere it is
+    how much the peak of the whole process grew, and where the peak cannot be
+    read (Windows) it is not recorded.
+    """
+    settings = _settings()
+    record = {}
+    if settings is None:
+        yield record
+        return
+
+    # stages opened before a fork belong to the parent process
+    if _state["pid"] != os.getpid():
+        _open_stages.clear()
+        _state["pid"] = os.getpid()
+
+    # the peak so far counts for the enclosing stages before it is reset
+    peak = _peak_mb()
+    if peak is not None:
+        for outer in _open_stages:
+            outer["peak"] = max(outer["peak"], peak)
+    _reset_peak_rss()
+    rss = _status_mb("VmRSS")
+    frame = {"rss": _peak_mb() if rss is None else rss}
+    frame["peak"] = frame["rss"]
+    _open_stages.append(frame)
+
+    profiler = None
+    if not _state["cprofile_active"] and (
+        name in settings["cprofile"] or "all" in settings["cprofile"]
+    ):
+        profiler = cProfile.Profile()
+        _state["cprofile_active"] = True
+        profiler.enable()
+
+    start, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        if profiler is not None:
+            profiler.disable()
+            _state["cprofile_active"] = False
+            suffix = "".join(f".{value}" for value in attributes.values())
+            profiler.dump_stats(
+                os.path.join(
+                    settings["cprofile_dir"], f"{name}{suffix}.{os.getpid()}.prof"
+                )
+            )
+
+        peak = _peak_mb()
+        _open_stages.pop()
+        memory = {}
+        if peak is not None:
+            for outer in _open_stages:
+                outer["peak"] = max(outer["peak"], peak)
+            memory["peak_rss_delta_mb"] = round(
+                max(frame["peak"], peak) - frame["rss"], 3
+            )
+
+        _write_record(
+            settings,
+            {
+                "stage": name,
+                **attributes,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+                "start": start,
+                "wall_s": round(wall, 6),
+                "cpu_s": round(cpu, 6),
+                **memory,
+                **record,
+            },
+        )
+
+
+def profiled(name: str, func, *args, **kwargs):
+    """
+    Function to call func(*args, **kwargs) as a stage, recording the rows and
+    columns of the frame (or tuple of frames) it returns.
+    """
+    with stage(name) as record:
+        result = func(*args, **kwargs)
+        record.update(frame_shape(result))
+    return result
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from lib.aggregation import ROWS, aggregate_from_state, group_state, is_stateful
+
+# school of a planning unit left out of a scenario
+UNASSIGNED = -1
+
+
+def unit_statistics(df: pd.DataFrame, unit_col: str, agg: dict) -> pd.DataFrame:
+    """
+    Function to compute the sufficient statistics of the units scenarios
+    assign to schools (planning units), from which the aggregations of agg
+    can be computed for any union of units: the group state (sums, counts and
+    number of rows, see group_state) of every unit.
+    """
+    funcs = [
+        func
+        for col_funcs in agg.values()
+        for func in (col_funcs if isinstance(col_funcs, list) else [col_funcs])
+    ]
+    if not all(is_stateful(func) for func in funcs):
+        raise ValueError("scenarios can only be evaluated for sums, counts and means")
+    return group_state(df, unit_col, list(agg))
+
+
+def current_assignment(df: pd.DataFrame, unit_col: str, school_col: str) -> pd.Series:
+    """
+    Function to read the school every unit is assigned to in df, e.g. the
+    current boundaries as a scenario to compare proposals with. Units whose
+    parcels are split between schools are assigned to the school of most of
+    them.
+    """
+    pairs = df[[unit_col, school_col]].dropna().value_counts(sort=True)
+    assignment = (
+        pairs.reset_index()
+        .drop_duplicates(unit_col)
+        .set_index(unit_col)[school_col]
+        .sort_index()
+    )
+    return assignment.astype(np.int64)
+
+
+def evaluate_scenarios(
+    state: pd.DataFrame,
+    assignments: np.ndarray,
+    agg: dict,
+    units=None,
+    school_col: str = "school",
+) -> pd.DataFrame:
+    """
+    Function to aggregate the parcels by school under many assignments of
+    units to schools at once, without grouping the parcels again.
+
+    state holds the statistics of the units (see unit_statistics), and
+    assignments the school id of every unit in every scenario, as a 2-D
+    integer array with a row per scenario and a column per unit of units
+    (the units of state, in order, by default); UNASSIGNED leaves a unit out.
+    The statistics of every school of every scenario are summed up in one
+    sparse matrix product, from which the aggregations of agg are computed as
+    aggregate_by_geo_id would give them for a school column assigned that way.
+
+    Returns a row per scenario and school with parcels: the scenario (row of
+    assignments), the school id (school_col) and the aggregates.
+    """
+    assignments = np.asarray(assignments)
+    if assignments.ndim == 1:
+        assignments = assignments[np.newaxis, :]
+    if units is not None:
+        # units without parcels have no statistics
+        state = state.reindex(units, fill_value=0)
+    if assignments.shape[1] != len(state):
+        raise ValueError(
+            f"assignments give schools of {assignments.shape[1]} units, "
+            f"but {len(state)} units have statistics"
+        )
+    n_scenarios, n_units = assignments.shape
+
+    # one row of the indicator matrix per school of every scenario, with a one
+    # in the columns of the units assigned to it; built column by column
+    # (unit by unit), which needs no sorting as every unit is in one school
+    # of every scenario. Hashing the school ids is faster than np.unique.
+    codes, schools = pd.factorize(assignments.T.ravel(), sort=True)
+    codes = codes.reshape(n_units, n_scenarios)
+    assigned = assignments.T != UNASSIGNED
+    rows = np.arange(n_scenarios) * len(schools) + codes
+    membership = sparse.csc_matrix(
+        (
+            np.ones(np.count_nonzero(assigned)),
+            rows[assigned],
+            np.concatenate([[0], np.cumsum(assigned.sum(axis=1))]),
+        ),
+        shape=(n_scenarios * len(schools), n_units),
+    )
+
+    # float sums of integers are exact up to 2**53, so integer columns stay
+    # integer as in groupby (as int64, schools outgrowing the dtype of units)
+    totals = pd.DataFrame(
+        membership @ state.to_numpy(np.float64), columns=state.columns
+    ).astype(
+        {
+            col: np.int64
+            for col, dtype in state.dtypes.items()
+            if pd.api.types.is_integer_dtype(dtype)
+        }
+    )
+    nonempty = totals[ROWS].to_numpy() > 0
+    totals = totals[nonempty].reset_index(drop=True)
+
+    result = aggregate_from_state(totals, school_col, agg).drop(columns=school_col)
+    kept = np.flatnonzero(nonempty)
+    result.insert(0, "scenario", kept // len(schools))
+    result.insert(1, school_col, schools[kept % len(schools)])
+    return result
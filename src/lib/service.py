@@ -0,0 +1,371 @@
+import os
+import json
+import time
+import glob
+import signal
+import asyncio
+import functools
+from http import HTTPStatus
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from lib.data import aggregate_by_geo_id
+
+# manifest of the latest snapshot, replaced last when a snapshot is published
+MANIFEST = "CURRENT.json"
+
+# requests with a longer head are refused
+MAX_HEADER_BYTES = 2**16
+
+
+def publish_snapshot(df: pd.DataFrame, snapshot_dir: str, keep: int = 2) -> dict:
+    """
+    Function to publish the processed parcels (without geometry) as a new
+    snapshot for the query service, see serve. The Parquet file is written
+    before the manifest pointing to it, so a service never reads a partial
+    snapshot, and the keep latest published snapshots are kept, so a service
+    still loading the previous one can finish.
+
+    Snapshots are numbered in the order they are published ("sequence" in
+    the manifest), which tells them apart even if the clock goes back or two
+    are published within a second.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    previous = read_manifest(snapshot_dir)
+    sequence = previous.get("sequence", 0) + 1 if previous else 1
+    snapshot_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{sequence}"
+    name = f"parcels-{snapshot_id}.parquet"
+    path = os.path.join(snapshot_dir, name)
+
+    geometry = getattr(df, "_geometry_column_name", None)
+    frame = pd.DataFrame(df.drop(columns=geometry) if geometry else df)
+    frame.to_parquet(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+    manifest = {
+        "id": snapshot_id,
+        "sequence": sequence,
+        "path": name,
+        "rows": len(frame),
+        "published": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    manifest_path = os.path.join(snapshot_dir, MANIFEST)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    # the names hold the local time, so the older snapshots are pruned by when
+    # they were written, and never the one the manifest points to
+    older = []
+    for old in glob.glob(os.path.join(snapshot_dir, "parcels-*.parquet")):
+        if os.path.basename(old) != name:
+            try:
+                older.append((os.stat(old).st_mtime_ns, old))
+            except FileNotFoundError:
+                pass
+    for _, old in sorted(older)[: max(len(older) - (keep - 1), 0)]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass
+    return manifest
+
+
+def read_manifest(snapshot_dir: str) -> dict:
+    """
+    Function to read the manifest of the latest snapshot, or None if none was
+    published yet.
+    """
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def geo_key(value) -> str:
+    """
+    Function to turn a geo id into the key it is looked up by, as given in the
+    URL: integers and whole floats (ids read with missing values) without
+    decimals, anything else as str.
+    """
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def json_rows(df: pd.DataFrame) -> tuple:
+    """
+    Function to serialize the rows of df to JSON objects in one buffer.
+    Returns the buffer and the offsets of the rows, row i spanning
+    offsets[i]:offsets[i + 1] - 1 (the newline after each row left out).
+    """
+    # floats with as many decimals as to_json writes, rather than 10
+    buffer = (
+        df.to_json(orient="records", lines=True, double_precision=15).encode()
+        if len(df)
+        else b""
+    )
+    if buffer and not buffer.endswith(b"\n"):
+        buffer += b"\n"
+    # newlines within strings are escaped, so every newline ends a row
+    ends = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8) == ord("\n")) + 1
+    return buffer, np.concatenate([[0], ends])
+
+
+def json_body(value) -> bytes:
+    return json.dumps(value).encode()
+
+
+def build_index(
+    df: pd.DataFrame,
+    layer_mapping: dict,
+    aggregations: dict,
+    parcel_columns: list = None,
+    manifest: dict = None,
+) -> dict:
+    """
+    Function to index a snapshot for lookups by geography, with every response
+    serialized up front so a lookup is a dict access:
+    - the aggregates of every geography of every layer, as aggregate_by_geo_id
+      gives them,
+    - the parcels of every geography, as slices of one buffer of JSON rows
+      holding parcel_columns (None for all columns).
+
+    aggregations maps the layers to index to their agg dicts.
+    """
+    geo_cols = {layer: layer_mapping[layer] for layer in aggregations}
+
+    # layer -> {geo key: JSON object of its aggregates}
+    indicators = {}
+    for layer, agg in aggregations.items():
+        geo_col = geo_cols[layer]
+        layer_agg = aggregate_by_geo_id(df, geo_col, agg)
+        layer_agg = layer_agg[layer_agg[geo_col].notna()]
+        buffer, offsets = json_rows(layer_agg)
+        indicators[layer] = {
+            geo_key(geo_id): buffer[start : end - 1]
+            for geo_id, start, end in zip(layer_agg[geo_col], offsets[:-1], offsets[1:])
+        }
+
+    # layer -> ({geo key: group}, parcel rows ordered by group, group starts)
+    parcels = {}
+    for layer, geo_col in geo_cols.items():
+        codes, uniques = pd.factorize(df[geo_col])
+        unplaced = np.count_nonzero(codes < 0)
+        order = np.argsort(codes, kind="stable")[unplaced:].astype(np.int32)
+        starts = np.zeros(len(uniques) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(codes[codes >= 0], minlength=len(uniques)), out=starts[1:]
+        )
+        groups = {geo_key(geo_id): group for group, geo_id in enumerate(uniques)}
+        parcels[layer] = (groups, order, starts)
+
+    if parcel_columns is not None:
+        df = df[[col for col in parcel_columns if col in df.columns]]
+    parcel_buffer, parcel_offsets = json_rows(df)
+
+    return {
+        "status": json_body(
+            {
+                "snapshot": manifest,
+                "loaded": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "parcels": len(df),
+                "layers": {layer: len(geos) for layer, geos in indicators.items()},
+            }
+        ),
+        "manifest": manifest,
+        "layers": json_body(list(indicators)),
+        "geo_ids": {layer: json_body(list(geos)) for layer, geos in indicators.items()},
+        "indicators": indicators,
+        "parcels": parcels,
+        "parcel_rows": parcel_buffer,
+        "parcel_offsets": parcel_offsets,
+    }
+
+
+def load_index(snapshot_dir: str, manifest: dict, **kwargs) -> dict:
+    """
+    Function to read the snapshot of a manifest and index it, see build_index.
+    """
+    df = pd.read_parquet(os.path.join(snapshot_dir, manifest["path"]))
+    return build_index(df, manifest=manifest, **kwargs)
+
+
+def error_body(message: str) -> bytes:
+    return json_body({"error": message})
+
+
+def answer(index: dict, target: str) -> tuple:
+    """
+    Function to answer a GET of target from an index, as (HTTPStatus, JSON body):
+
+    /status                               snapshot and number of geographies
+    /layers                               layers
+    /layers/<layer>                       geo ids of a layer
+    /layers/<layer>/<geo id>              aggregates of a geography
+    /layers/<layer>/<geo id>/parcels      parcels of a geography
+    """
+    if index is None:
+        return HTTPStatus.SERVICE_UNAVAILABLE, error_body("no snapshot loaded yet")
+
+    parts = [unquote(part) for part in urlsplit(target).path.strip("/").split("/")]
+    if parts == ["status"]:
+        return HTTPStatus.OK, index["status"]
+    if parts[0] != "layers" or len(parts) > 4:
+        return HTTPStatus.NOT_FOUND, error_body(f"unknown path {target}")
+    if len(parts) == 1:
+        return HTTPStatus.OK, index["layers"]
+
+    layer = parts[1]
+    if layer not in index["indicators"]:
+        return HTTPStatus.NOT_FOUND, error_body(f"unknown layer {layer}")
+    if len(parts) == 2:
+        return HTTPStatus.OK, index["geo_ids"][layer]
+
+    geo_id = parts[2]
+    if len(parts) == 3:
+        body = index["indicators"][layer].get(geo_id)
+        if body is None:
+            return HTTPStatus.NOT_FOUND, error_body(f"no {layer} {geo_id}")
+        return HTTPStatus.OK, body
+
+    groups, order, starts = index["parcels"][layer]
+    group = groups.get(geo_id)
+    if parts[3] != "parcels" or group is None:
+        return HTTPStatus.NOT_FOUND, error_body(f"no parcels of {layer} {geo_id}")
+    rows, offsets = index["parcel_rows"], index["parcel_offsets"]
+    positions = order[starts[group] : starts[group + 1]].tolist()
+    body = b",".join([rows[offsets[i] : offsets[i + 1] - 1] for i in positions])
+    return HTTPStatus.OK, b"[" + body + b"]"
+
+
+def http_response(status: HTTPStatus, body: bytes, close: bool, head: bool) -> bytes:
+    """
+    Function to frame a JSON body as an HTTP/1.1 response, without the body
+    for HEAD requests.
+    """
+    lines = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+    ]
+    if close:
+        lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + (b"" if head else body)
+
+
+async def serve(
+    snapshot_dir: str,
+    layer_mapping: dict,
+    aggregations: dict,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    parcel_columns: list = None,
+    poll_seconds: float = 2.0,
+) -> None:
+    """
+    Function to answer lookups of indicators and parcels by geography over
+    HTTP (see answer) from the latest snapshot in snapshot_dir, until
+    interrupted or terminated. Every poll_seconds the manifest is checked,
+    and a newly published snapshot is indexed in a worker process while the
+    previous one keeps answering, then swapped in; only receiving the index
+    holds up the lookups.
+    """
+    loop = asyncio.get_running_loop()
+    state = {"index": None}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip().lower()
+                try:
+                    method, target, version = request_line.split(" ")
+                    content_length = int(headers.get("content-length", "0"))
+                    if content_length < 0:
+                        raise ValueError(f"negative content-length {content_length}")
+                except ValueError:
+                    # the end of the request is unknown, so the connection is
+                    # closed after the error
+                    writer.write(
+                        http_response(
+                            HTTPStatus.BAD_REQUEST,
+                            error_body("bad request"),
+                            True,
+                            False,
+                        )
+                    )
+                    await writer.drain()
+                    break
+                if content_length:
+                    try:
+                        await reader.readexactly(content_length)
+                    except asyncio.IncompleteReadError:
+                        break
+
+                close = headers.get("connection") == "close" or (
+                    version == "HTTP/1.0" and headers.get("connection") != "keep-alive"
+                )
+                if method in ["GET", "HEAD"]:
+                    status, body = answer(state["index"], target)
+                else:
+                    status = HTTPStatus.METHOD_NOT_ALLOWED
+                    body = error_body(f"{method} is not supported")
+                writer.write(http_response(status, body, close, method == "HEAD"))
+                await writer.drain()
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def watch():
+        loaded = failed = None
+        while True:
+            manifest = read_manifest(snapshot_dir)
+            if manifest is not None and manifest["id"] not in [loaded, failed]:
+                start = time.perf_counter()
+                try:
+                    state["index"] = await loop.run_in_executor(
+                        pool,
+                        functools.partial(
+                            load_index,
+                            snapshot_dir,
+                            manifest,
+                            layer_mapping=layer_mapping,
+                            aggregations=aggregations,
+                            parcel_columns=parcel_columns,
+                        ),
+                    )
+                    loaded = manifest["id"]
+                    print(
+                        f"Snapshot {manifest['id']} loaded ({manifest['rows']} "
+                        f"parcels) in {time.perf_counter() - start:.2f}s"
+                    )
+                except (OSError, ValueError, KeyError) as e:
+                    failed = manifest["id"]
+                    print(f"Snapshot {manifest['id']} could not be loaded: {e}")
+            await asyncio.sleep(poll_seconds)
+
+    server = await asyncio.start_server(handle, host, port, limit=MAX_HEADER_BYTES)
+    print(f"Serving lookups on http://{host}:{port}/ from {snapshot_dir}")
+    # stop on SIGTERM as well as Ctrl-C, shutting the indexing worker down
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        async with server:
+            watcher = asyncio.create_task(watch())
+            await stop.wait()
+            watcher.cancel()
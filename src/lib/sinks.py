@@ -0,0 +1,138 @@
+import os
+import time
+import inspect
+
+import geopandas as gpd
+
+from lib.writer import write_gdb_layer, pyogrio
+from lib.profiling import stage
+
+# geopandas >= 1.0 can write the bbox covering columns of GeoParquet 1.1
+_WRITE_COVERING_BBOX = (
+    "write_covering_bbox" in inspect.signature(gpd.GeoDataFrame.to_parquet).parameters
+)
+
+
+def write_csv_layer(gdf: gpd.GeoDataFrame, path: str) -> None:
+    """
+    Function to write a layer as CSV, with the geometry as WKT.
+    """
+    gdf.to_csv(path, index=None)
+
+
+def write_geoparquet_layer(gdf: gpd.GeoDataFrame, path: str) -> None:
+    """
+    Function to write a layer as zstd compressed GeoParquet. With geopandas
+    >= 1.0 it gets bbox covering columns, so readers such as GDAL and DuckDB
+    can skip row groups outside an extent.
+    """
+    kwargs = {"write_covering_bbox": True} if _WRITE_COVERING_BBOX else {}
+    gdf.to_parquet(path, compression="zstd", index=False, **kwargs)
+
+
+def write_flatgeobuf_layer(gdf: gpd.GeoDataFrame, path: str) -> None:
+    """
+    Function to write a layer as FlatGeobuf with a packed R-tree spatial
+    index, so that GIS clients only read the features of the extent they show.
+    The layer in the file is named after it, as in sink_path.
+    """
+    if pyogrio is not None:
+        pyogrio.write_dataframe(
+            gdf,
+            path,
+            driver="FlatGeobuf",
+            promote_to_multi=True,
+            layer_options={"SPATIAL_INDEX": "YES"},
+        )
+    else:
+        gdf.to_file(path, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+
+
+# output formats a layer can be written in: the function writing it to a path,
+# and the directory of the output directory and the extension of its files;
+# formats without an extension keep every layer in one file (see shared_path),
+# and their function takes the name of the layer to write as well
+SINKS = {
+    "csv": {
+        "write": write_csv_layer,
+        "dir": "aggregated_flat_files",
+        "extension": ".csv",
+    },
+    "geoparquet": {
+        "write": write_geoparquet_layer,
+        "dir": "geoparquet",
+        "extension": ".parquet",
+    },
+    "flatgeobuf": {
+        "write": write_flatgeobuf_layer,
+        "dir": "flatgeobuf",
+        "extension": ".fgb",
+    },
+    "gdb": {
+        "write": write_gdb_layer,
+        "dir": None,
+        "extension": None,
+    },
+}
+
+
+def is_shared(output_format: str) -> bool:
+    """
+    Function to check if the layers of a format share a single file, so they
+    have to be written one at a time.
+    """
+    if output_format not in SINKS:
+        raise ValueError(
+            f"Unknown output format {output_format!r}, expected one of {list(SINKS)}"
+        )
+    return SINKS[output_format]["extension"] is None
+
+
+def sink_path(
+    output_dir: str, output_format: str, layer: str, shared_path: str = None
+) -> str:
+    """
+    Function to return the path a layer is written to in a format. Formats
+    sharing a file across layers are written to shared_path.
+    """
+    if is_shared(output_format):
+        return shared_path
+    sink = SINKS[output_format]
+    return os.path.join(output_dir, sink["dir"], layer + sink["extension"])
+
+
+def path_size(path: str) -> int:
+    """
+    Function to return the size of a file, or of the files of a directory
+    such as a .gdb, in bytes.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def write_layer(gdf: gpd.GeoDataFrame, layer: str, paths: dict) -> dict:
+    """
+    Function to write the same layer frame in several formats.
+
+    Parameters:
+    paths: {output format: path}, see sink_path.
+
+    Returns {output format: seconds taken}.
+    """
+    seconds = {}
+    for output_format, path in paths.items():
+        start = time.perf_counter()
+        with stage(f"write_{output_format}", layer=layer) as record:
+            write = SINKS[output_format]["write"]
+            if is_shared(output_format):
+                write(gdf, path, layer)
+            else:
+                write(gdf, path)
+            record.update(rows=len(gdf), columns=len(gdf.columns))
+        seconds[output_format] = time.perf_counter() - start
+    return seconds
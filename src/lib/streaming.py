@@ -0,0 +1,451 @@
+import os
+import json
+import glob
+import math
+import shutil
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+from lib.data import (
+    ANALYTIC_COLUMNS,
+    DU_EST_DTYPES,
+    assign_geographies,
+    build_analytic_dataset,
+    pyogrio,
+)
+from lib.aggregation import (
+    is_stateful,
+    group_state,
+    combine_group_states,
+    aggregate_from_state,
+)
+from lib.variables import (
+    UNIT_VALUE_CATEGORIES,
+    quantile_categories,
+    unit_values,
+)
+
+# columns the streaming mode computes from the analytic dataset
+COMPUTED_COLUMNS = ["unit_val"] + list(UNIT_VALUE_CATEGORIES)
+
+# columns unit values and their categories are computed from
+UNIT_VALUE_COLUMNS = ["designation", "TOTAL_PROP_VALUE", "du_est_final"]
+
+
+# Reading inputs in chunks ====================================================
+
+
+def count_features(path: str) -> int:
+    """
+    Function to count the features of a vector file, or the rows of a
+    (Geo)Parquet file, without reading them.
+    """
+    if path.endswith(".parquet"):
+        return pq.ParquetFile(path).metadata.num_rows
+    if pyogrio is not None:
+        return pyogrio.read_info(path)["features"]
+
+    import fiona
+
+    with fiona.open(path) as src:
+        return len(src)
+
+
+def _geoparquet_crs(parquet_file: pq.ParquetFile):
+    # GeoParquet keeps the CRS as PROJJSON; without one it is OGC:CRS84
+    geo = json.loads(parquet_file.schema_arrow.metadata[b"geo"])
+    return geo["columns"][geo["primary_column"]].get("crs", "OGC:CRS84")
+
+
+def iter_parcel_chunks(
+    path: str, columns: list, chunk_size: int, geometry: bool = True
+):
+    """
+    Function to read the parcels chunk_size rows at a time, as get_parcels
+    would read them. Without geometry, chunks are DataFrames of the columns.
+    """
+    if path.endswith(".parquet"):
+        parquet_file = pq.ParquetFile(path)
+        crs = _geoparquet_crs(parquet_file) if geometry else None
+        batches = parquet_file.iter_batches(
+            batch_size=chunk_size,
+            columns=columns + ["geometry"] if geometry else columns,
+        )
+        for batch in batches:
+            chunk = batch.to_pandas()
+            if geometry:
+                chunk = gpd.GeoDataFrame(
+                    chunk,
+                    geometry=gpd.GeoSeries.from_wkb(chunk["geometry"]),
+                    crs=crs,
+                )
+            yield chunk
+        return
+
+    n_features = count_features(path)
+    for start in range(0, n_features, chunk_size):
+        if pyogrio is not None:
+            chunk = pyogrio.read_dataframe(
+                path,
+                columns=columns,
+                skip_features=start,
+                max_features=chunk_size,
+                read_geometry=geometry,
+            )
+        else:
+            chunk = gpd.read_file(
+                path,
+                include_fields=columns,
+                rows=slice(start, start + chunk_size),
+                ignore_geometry=not geometry,
+            )
+        yield chunk
+
+
+def iter_du_est_chunks(path: str, columns: list, chunk_size: int, dtype: dict = None):
+    """
+    Function to read the DPS parcel estimates chunk_size rows at a time, as
+    get_du_est would read them. dtype defaults to DU_EST_DTYPES.
+    """
+    dtype = DU_EST_DTYPES if dtype is None else dtype
+    if path.endswith(".parquet"):
+        batches = pq.ParquetFile(path).iter_batches(
+            batch_size=chunk_size, columns=columns
+        )
+        for batch in batches:
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, dtype=dtype, chunksize=chunk_size)
+
+
+# Partitioning by REID ========================================================
+
+
+def reid_partitions(reid: pd.Series, n_partitions: int) -> np.ndarray:
+    """
+    Function to assign every REID a partition, the same in every input.
+    """
+    values = reid.astype(str).to_numpy(dtype=object)
+    return (pd.util.hash_array(values) % np.uint64(n_partitions)).astype(np.int64)
+
+
+def partition_chunks(chunks, partition_dir: str, n_partitions: int) -> int:
+    """
+    Function to split chunks of rows into n_partitions by REID, appending each
+    part to partition_dir/{partition}/{chunk}.parquet, so the rows of a REID
+    end up in the same partition whatever chunk they were read in. Returns
+    the number of rows.
+    """
+    n_rows = 0
+    for i, chunk in enumerate(chunks):
+        n_rows += len(chunk)
+        partitions = reid_partitions(chunk["REID"], n_partitions)
+        for partition, part in chunk.groupby(partitions, sort=False):
+            part_dir = os.path.join(partition_dir, f"{partition:05d}")
+            os.makedirs(part_dir, exist_ok=True)
+            part.to_parquet(os.path.join(part_dir, f"{i:06d}.parquet"))
+    return n_rows
+
+
+def read_partition(partition_dir: str, partition: int, geometry: bool = False):
+    """
+    Function to read the rows of a partition written by partition_chunks, or
+    None if it has none.
+    """
+    paths = sorted(glob.glob(os.path.join(partition_dir, f"{partition:05d}", "*")))
+    if not paths:
+        return None
+    read = gpd.read_parquet if geometry else pd.read_parquet
+    parts = [read(path) for path in paths]
+    return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+
+# Exact quantiles over chunks =================================================
+
+
+def _lerp(a: float, b: float, t: float) -> float:
+    # numpy's linear interpolation, so results match np.quantile bit for bit
+    diff_b_a = b - a
+    if t >= 0.5:
+        return b - diff_b_a * (1 - t)
+    return a + diff_b_a * t
+
+
+def _flip_negative(bits: np.ndarray) -> np.ndarray:
+    # flips the magnitude bits of negative numbers; its own inverse
+    return bits ^ ((bits >> 63) & np.int64(0x7FFFFFFFFFFFFFFF))
+
+
+def _float_keys(values: np.ndarray) -> np.ndarray:
+    # int64 keys ordered as the floats are
+    return _flip_negative(values.astype(np.float64).view(np.int64))
+
+
+def _key_value(key: int) -> float:
+    return float(_flip_negative(np.array([key], dtype=np.int64)).view(np.float64)[0])
+
+
+def exact_quantiles(
+    read_chunks, probs: np.ndarray, max_values: int = 2**20, n_bins: int = 2**16
+) -> np.ndarray:
+    """
+    Function to compute quantiles of values read in chunks, equal to
+    pd.Series.quantile over all the values (linear interpolation, NaN
+    skipped), while holding at most max_values of them in memory.
+
+    The order statistics the quantiles interpolate between are located by
+    histogram refinement: a first pass counts the values, and each further
+    pass either reads the values of an interval holding a wanted rank, if it
+    has at most max_values of them, or splits the interval into n_bins bins
+    and keeps the one holding the rank. Up to max_values values, two passes
+    are enough; beyond, usually three. Bins are taken over the bits of the
+    floats, so every pass narrows the interval by n_bins.
+
+    Parameters:
+    read_chunks: Function returning a new iterable of float arrays on every call.
+    probs: Quantiles to compute, between 0 and 1.
+    """
+    n = 0
+    lo, hi = None, None
+    for values in read_chunks():
+        keys = _float_keys(values[~np.isnan(values)])
+        n += len(keys)
+        if len(keys):
+            lo = keys.min() if lo is None else min(lo, keys.min())
+            hi = keys.max() if hi is None else max(hi, keys.max())
+
+    if n == 0:
+        return np.full(len(probs), np.nan)
+
+    # ranks of the order statistics each quantile interpolates between
+    virtual = (n - 1) * np.asarray(probs, dtype=np.float64)
+    previous = np.floor(virtual).astype(np.int64)
+    following = np.minimum(previous + 1, n - 1)
+    gamma = virtual - np.floor(virtual)
+
+    # for every rank, the keys [lo, hi] its value is within, the number of
+    # values below lo and the number of values within
+    searches = {
+        int(rank): (int(lo), int(hi), 0, n)
+        for rank in np.unique(np.concatenate([previous, following]))
+    }
+    order_stats = {}
+
+    while searches:
+        collected = {rank: [] for rank, s in searches.items() if s[3] <= max_values}
+        histograms = {rank: 0 for rank in searches if rank not in collected}
+        extremes = {rank: [np.inf, -np.inf] for rank in histograms}
+        widths = {rank: (s[1] - s[0]) // n_bins + 1 for rank, s in searches.items()}
+
+        for values in read_chunks():
+            keys = _float_keys(values[~np.isnan(values)])
+            for rank, (lo, hi, _, _) in searches.items():
+                inside = keys[(keys >= lo) & (keys <= hi)]
+                if rank in collected:
+                    collected[rank].append(inside)
+                elif len(inside):
+                    # unsigned, as hi - lo can exceed the int64 range
+                    offsets = inside.view(np.uint64) - np.uint64(lo % 2**64)
+                    bins = offsets // np.uint64(widths[rank])
+                    histograms[rank] = histograms[rank] + np.bincount(
+                        bins.astype(np.int64), minlength=n_bins
+                    )
+                    extremes[rank][0] = min(extremes[rank][0], inside.min())
+                    extremes[rank][1] = max(extremes[rank][1], inside.max())
+
+        for rank, parts in collected.items():
+            below = searches.pop(rank)[2]
+            order_stats[rank] = _key_value(np.sort(np.concatenate(parts))[rank - below])
+
+        for rank, histogram in histograms.items():
+            lo, hi, below, _ = searches.pop(rank)
+            # all values of the interval are equal: that is the value
+            if extremes[rank][0] == extremes[rank][1]:
+                order_stats[rank] = _key_value(extremes[rank][0])
+                continue
+            cumulative = below + np.cumsum(histogram)
+            j = int(np.searchsorted(cumulative, rank, side="right"))
+            bin_lo = lo + j * widths[rank]
+            searches[rank] = (
+                bin_lo,
+                min(hi, bin_lo + widths[rank] - 1),
+                int(cumulative[j - 1]) if j else below,
+                int(histogram[j]),
+            )
+
+    return np.array(
+        [
+            _lerp(order_stats[p], order_stats[f], g)
+            for p, f, g in zip(previous, following, gamma)
+        ]
+    )
+
+
+# Streaming aggregation =======================================================
+
+
+def streaming_columns(layer_mapping: dict, aggregations: dict) -> list:
+    """
+    Function to list the analytic dataset columns the layer aggregates need,
+    raising ValueError for aggregations that cannot be folded over chunks.
+    """
+    columns = list(dict.fromkeys(layer_mapping.values())) + UNIT_VALUE_COLUMNS
+    for layer, agg in aggregations.items():
+        for col, funcs in agg.items():
+            funcs = funcs if isinstance(funcs, list) else [funcs]
+            unsupported = [func for func in funcs if not is_stateful(func)]
+            if unsupported:
+                raise ValueError(
+                    f"{unsupported} of {col} for layer {layer} cannot be "
+                    "computed in streaming mode, only sums, counts and means"
+                )
+            if col not in ANALYTIC_COLUMNS and col not in COMPUTED_COLUMNS:
+                raise ValueError(
+                    f"{col} for layer {layer} is not available in streaming mode"
+                )
+            if col not in columns and col not in COMPUTED_COLUMNS:
+                columns.append(col)
+    return columns
+
+
+def stream_aggregates(
+    parcels_path: str,
+    du_est_path: str,
+    acs_table_t: pd.DataFrame,
+    acs_table_bg: pd.DataFrame,
+    layer_mapping: dict,
+    aggregations: dict,
+    work_dir: str,
+    parcel_columns: list,
+    du_est_columns: list,
+    chunk_size: int = 250_000,
+    boundaries: dict = None,
+    workers: int = 1,
+) -> dict:
+    """
+    Function to aggregate the parcels by every layer without holding them in
+    memory, giving the frames aggregate_by_geo_id gives on the processed
+    dataset. Float sums are added chunk by chunk, so they can differ from the
+    in-memory ones in the last digits.
+
+    1. The parcels and the estimates are read chunk_size rows at a time and
+       split by REID into partitions of about chunk_size rows on disk.
+    2. Each partition is joined with the census tables (build_analytic_dataset)
+       and its unit values computed; the needed columns are kept on disk.
+    3. The quartile thresholds are computed exactly over all partitions.
+    4. Each partition is binned into quartile categories and folded into
+       per-layer group states (sums and counts), which give the aggregates.
+
+    Memory is bounded by the size of a partition and the number of
+    geographies, not by the number of parcels.
+
+    Parameters:
+    layer_mapping: {layer: geo id column}, for the layers to aggregate.
+    aggregations: {layer: agg dict}, sums, counts and means only.
+    work_dir: Directory for the partitions, removed at the end.
+    boundaries: {layer: GeoDataFrame} to derive the geo ids of the parcels
+        from, see assign_geographies, or None to take them from du_est.
+    workers: Threads to assign geographies with.
+    """
+    columns = streaming_columns(layer_mapping, aggregations)
+    geometry = boundaries is not None
+    n_partitions = max(1, math.ceil(count_features(parcels_path) / chunk_size))
+
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    dirs = {
+        name: os.path.join(work_dir, name) for name in ["parcels", "du_est", "joined"]
+    }
+    os.makedirs(dirs["joined"])
+
+    try:
+        # 1. partitions of both inputs by REID
+        n_parcels = partition_chunks(
+            iter_parcel_chunks(parcels_path, parcel_columns, chunk_size, geometry),
+            dirs["parcels"],
+            n_partitions,
+        )
+        partition_chunks(
+            iter_du_est_chunks(du_est_path, du_est_columns, chunk_size),
+            dirs["du_est"],
+            n_partitions,
+        )
+
+        # 2. joined partitions, with the columns the aggregates need
+        joined_paths = []
+        for partition in range(n_partitions):
+            parcels = read_partition(dirs["parcels"], partition, geometry)
+            du_est = read_partition(dirs["du_est"], partition)
+            if parcels is None or du_est is None:
+                continue
+            if not geometry:
+                # the layer aggregates do not use the parcel geometries
+                parcels = gpd.GeoDataFrame(
+                    parcels, geometry=np.full(len(parcels), None), crs=None
+                )
+
+            geographies = None
+            if geometry:
+                geographies = assign_geographies(
+                    parcels, boundaries, layer_mapping, workers=workers
+                )
+            joined = pd.DataFrame(
+                build_analytic_dataset(
+                    parcels, du_est, acs_table_t, acs_table_bg, geographies
+                )[columns]
+            )
+            joined["unit_val"] = unit_values(joined)
+
+            path = os.path.join(dirs["joined"], f"{partition:05d}.parquet")
+            joined.to_parquet(path)
+            joined_paths.append(path)
+
+        if not joined_paths:
+            raise ValueError("No parcel matches a DPS estimate on REID")
+
+        # 3. quartile thresholds over all partitions
+        probs = np.linspace(0, 1, 5)[1:-1]
+        thresholds = {}
+        for out_column, designation in UNIT_VALUE_CATEGORIES.items():
+
+            def read_unit_values(designation=designation):
+                for path in joined_paths:
+                    df = pd.read_parquet(path, columns=["unit_val", "designation"])
+                    if designation is not None:
+                        df = df[(df["designation"] == designation).to_numpy()]
+                    yield df["unit_val"].to_numpy(dtype=np.float64, na_value=np.nan)
+
+            thresholds[out_column] = exact_quantiles(read_unit_values, probs)
+
+        # 4. group states folded over the partitions
+        states = {layer: None for layer in layer_mapping}
+        for path in joined_paths:
+            df = pd.read_parquet(path)
+            values = df["unit_val"].to_numpy(dtype=np.float64, na_value=np.nan)
+            for out_column, designation in UNIT_VALUE_CATEGORIES.items():
+                categories = quantile_categories(values, thresholds[out_column])
+                if designation is None:
+                    df[out_column] = categories
+                else:
+                    in_partition = (df["designation"] == designation).to_numpy()
+                    df[out_column] = np.where(in_partition, categories, np.nan)
+
+            for layer, geo_col in layer_mapping.items():
+                state = group_state(df, geo_col, list(aggregations[layer]))
+                states[layer] = combine_group_states([states[layer], state])
+
+        print(
+            f"Streaming: {n_parcels} parcels in {n_partitions} partitions "
+            f"of {chunk_size} rows"
+        )
+        return {
+            layer: aggregate_from_state(
+                states[layer], layer_mapping[layer], aggregations[layer]
+            )
+            for layer in layer_mapping
+        }
+    finally:
+        shutil.rmtree(work_dir)
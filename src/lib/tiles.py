@@ -0,0 +1,152 @@
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+
+from lib.writer import pyogrio
+
+# vector tiles are cut in web mercator; sources are projected once for all zooms
+TILE_CRS = "EPSG:3857"
+
+
+def zoom_simplification(zoom: int, simplification: dict) -> float:
+    """
+    Function to pick the simplification of a zoom level from {zoom: factor},
+    the factor of the closest zoom at or below it (0 below every zoom given).
+    Factors are in tile units, 4096 to a tile side, so 16 is one pixel of a
+    256 pixel tile.
+    """
+    below = [z for z in simplification if z <= zoom]
+    return float(simplification[max(below)]) if below else 0.0
+
+
+def write_tile_source(gdf: gpd.GeoDataFrame, path: str, columns: list) -> None:
+    """
+    Function to write the columns of a layer its tiles carry, in web mercator,
+    as GeoParquet for write_zoom_tiles.
+    """
+    gdf[columns + [gdf.geometry.name]].to_crs(TILE_CRS).to_parquet(path)
+
+
+def write_zoom_tiles(
+    source_path: str, path: str, layer: str, zoom: int, simplification: float
+) -> str:
+    """
+    Function to write the vector tiles of one zoom level of a layer to an
+    MBTiles file, simplifying polygons by simplification tile units.
+    """
+    gdf = gpd.read_parquet(source_path)
+    options = {"NAME": layer, "MINZOOM": zoom, "MAXZOOM": zoom}
+    if simplification > 0:
+        # a file of one zoom level is simplified at its max zoom
+        options["SIMPLIFICATION"] = simplification
+        options["SIMPLIFICATION_MAX_ZOOM"] = simplification
+
+    if pyogrio is not None:
+        pyogrio.write_dataframe(
+            gdf, path, layer=layer, driver="MBTiles", dataset_options=options
+        )
+    else:
+        gdf.to_file(path, layer=layer, driver="MBTiles", **options)
+    return path
+
+
+def merge_zoom_tiles(paths: list, path: str) -> None:
+    """
+    Function to merge MBTiles files of single zoom levels of a layer, in
+    increasing zoom order, into one. The metadata (bounds, fields, tile
+    statistics) is that of the highest zoom with the zoom range widened.
+    """
+    tmp_path = path + ".tmp"
+    shutil.copyfile(paths[-1], tmp_path)
+
+    # autocommit, as databases cannot be detached inside a transaction
+    with closing(sqlite3.connect(tmp_path, isolation_level=None)) as db:
+        for zoom_path in paths[:-1]:
+            db.execute("ATTACH DATABASE ? AS zoom", (zoom_path,))
+            db.execute("INSERT INTO tiles SELECT * FROM zoom.tiles")
+            db.execute("DETACH DATABASE zoom")
+
+        min_zoom, max_zoom = db.execute(
+            "SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles"
+        ).fetchone()
+        metadata = dict(db.execute("SELECT name, value FROM metadata"))
+        layers = json.loads(metadata["json"])
+        for vector_layer in layers["vector_layers"]:
+            vector_layer["minzoom"], vector_layer["maxzoom"] = min_zoom, max_zoom
+        center = metadata["center"].split(",")[:2] + [str(min_zoom)]
+
+        db.executemany(
+            "UPDATE metadata SET value = ? WHERE name = ?",
+            [
+                (str(min_zoom), "minzoom"),
+                (str(max_zoom), "maxzoom"),
+                (",".join(center), "center"),
+                (json.dumps(layers), "json"),
+            ],
+        )
+        db.execute("VACUUM")
+
+    os.replace(tmp_path, path)
+
+
+def write_tile_pyramids(
+    sources: dict,
+    tiles_dir: str,
+    zooms: list,
+    simplification: dict,
+    workers: int = 1,
+) -> dict:
+    """
+    Function to build an MBTiles vector tile pyramid for every layer.
+
+    Every (layer, zoom level) is cut on its own, so with workers > 1 the
+    layers and zoom levels are spread over a process pool, the most detailed
+    zoom levels first as they take longest. The zoom levels of a layer are
+    then merged into tiles_dir/<layer>.mbtiles.
+
+    Parameters:
+    sources: {layer: path}, as written by write_tile_source.
+    zooms: Zoom levels of the pyramids.
+    simplification: {zoom: factor}, see zoom_simplification.
+
+    Returns {layer: path of its pyramid}.
+    """
+    zooms = sorted(zooms)
+    work_dir = tempfile.mkdtemp(dir=tiles_dir)
+    jobs = [
+        (
+            source_path,
+            os.path.join(work_dir, f"{layer}.{zoom}.mbtiles"),
+            layer,
+            zoom,
+            zoom_simplification(zoom, simplification),
+        )
+        for zoom in reversed(zooms)
+        for layer, source_path in sources.items()
+    ]
+
+    try:
+        if workers <= 1:
+            for job in jobs:
+                write_zoom_tiles(*job)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for future in [pool.submit(write_zoom_tiles, *job) for job in jobs]:
+                    future.result()
+
+        paths = {}
+        for layer in sources:
+            paths[layer] = os.path.join(tiles_dir, f"{layer}.mbtiles")
+            merge_zoom_tiles(
+                [os.path.join(work_dir, f"{layer}.{zoom}.mbtiles") for zoom in zooms],
+                paths[layer],
+            )
+        return paths
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -2,300 +2,201 @@ import geopandas as gpd
 import pandas as pd
 import numpy as np
 
+# (geography key, suffix) pairs that process_data averages unit values over,
+# in the order the resulting columns are added
+GEOGRAPHY_AVERAGES = [
+    ("pu_2324_848", "pu2020"),
+    ("geo_id_b2020", "b2020"),
+    ("geo_id_bg2020", "bg2020"),
+    ("geo_id_t2020", "t2020"),
+    ("geo_id_b2010", "b2010"),
+    ("geo_id_bg2010", "bg2010"),
+    ("pu_2122_833", "pu2122"),
+    ("geo_id_t2010", "t2010"),
+]
+
+# category column -> designation whose quartiles it uses (None for all parcels)
+UNIT_VALUE_CATEGORIES = {
+    "unit_val_cat": None,
+    "unit_val_cat_single": "single",
+    "unit_val_cat_multi": "multi",
+}
+
+
+# columns holding quartile categories (1 to 4) once process_data has run: the
+# categories and their rounded averages over every geography
+ROUNDED_AVERAGE_COLUMNS = ("unit_val_cat_single", "unit_val_cat_multi")
+QUARTILE_CODE_COLUMNS = list(UNIT_VALUE_CATEGORIES) + [
+    f"{col}_avg_{suffix}"
+    for _, suffix in GEOGRAPHY_AVERAGES
+    for col in ROUNDED_AVERAGE_COLUMNS
+]
+
+
+def quantile_thresholds(
+    df: pd.DataFrame,
+    column: str,
+    n_quantiles: int = 4,
+    by: str = None,
+    partition=None,
+) -> np.ndarray:
+    """
+    Function to return the n_quantiles - 1 inner quantiles of column, over the
+    rows where df[by] equals partition, or over all rows if by is None.
+    """
+    if by is None:
+        values = df[column]
+    else:
+        values = df.loc[(df[by] == partition).to_numpy(), column]
+
+    probs = np.linspace(0, 1, n_quantiles + 1)
+    return values.quantile(probs).to_numpy()[1:-1]
+
+
+def unit_value_thresholds(df: pd.DataFrame) -> dict:
+    """
+    Function to return the quartile thresholds process_data bins unit values
+    with, for each category column in UNIT_VALUE_CATEGORIES.
+    """
+    return {
+        out_column: quantile_thresholds(
+            df,
+            "unit_val",
+            by=None if designation is None else "designation",
+            partition=designation,
+        )
+        for out_column, designation in UNIT_VALUE_CATEGORIES.items()
+    }
+
+
+def quantile_categories(values: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    Function to bin values into categories 1 to len(thresholds) + 1. A value
+    at or above the k-th threshold falls in category k + 1, so ties go to the
+    upper category, and NaN values fall in category 1.
+    """
+    # thresholds are sorted, so counting those <= value is a binary search;
+    # NaN thresholds (empty partition) sort last and are never counted
+    categories = 1 + np.searchsorted(thresholds, values, side="right")
+    categories[np.isnan(values)] = 1
+    return categories
+
+
+def unit_values(df: pd.DataFrame) -> pd.Series:
+    """
+    Function to calculate the property value per dwelling unit of every parcel.
+    """
+    return df["TOTAL_PROP_VALUE"] / df["du_est_final"]
+
+
+def assign_quantile_category(
+    df: pd.DataFrame,
+    column: str,
+    out_column: str,
+    n_quantiles: int = 4,
+    by: str = None,
+    partition=None,
+) -> pd.DataFrame:
+    """
+    Function to bin a column into quantile categories, in place.
+
+    Thresholds are the quantiles of column over the rows where df[by] equals
+    partition, or over all rows if by is None; see quantile_categories for the
+    binning. Rows outside the partition get NaN.
+
+    Parameters:
+    df: The DataFrame to add out_column to.
+    column: The column to bin.
+    out_column: Name of the category column, with values 1 to n_quantiles.
+    n_quantiles: Number of categories, 4 for quartiles.
+    by: Column defining the partitions, e.g. "designation".
+    partition: Value of by whose rows are categorized, e.g. "single".
+    """
+    values = df[column].to_numpy(dtype=np.float64)
+    if by is None:
+        in_partition = np.ones(len(df), dtype=bool)
+    else:
+        in_partition = (df[by] == partition).to_numpy()
+
+    thresholds = quantile_thresholds(df, column, n_quantiles, by, partition)
+    categories = quantile_categories(values, thresholds)
+
+    if in_partition.all():
+        df[out_column] = categories
+    else:
+        df[out_column] = np.where(in_partition, categories, np.nan)
+
+    return df
+
+
+def add_geography_averages(
+    df: gpd.GeoDataFrame,
+    specs: list = None,
+    mean_columns: tuple = ("unit_val",),
+    rounded_columns: tuple = ROUNDED_AVERAGE_COLUMNS,
+) -> gpd.GeoDataFrame:
+    """
+    Function to add per-geography averages to every parcel.
+
+    For each (geography key, suffix) in specs, adds a "{column}_avg_{suffix}"
+    column holding the mean of column over the parcel's geography. Means of
+    rounded_columns are rounded like round() does. Group sums and counts are
+    computed with groupby kernels and broadcast back to parcels by index take,
+    so the parcel frame is only materialized once at the end. Every geography
+    is grouped from the parcels, so float sums add up in the same order as a
+    groupby mean and the averages are exactly those of one. specs defaults to
+    GEOGRAPHY_AVERAGES.
+    """
+    specs = GEOGRAPHY_AVERAGES if specs is None else specs
+    value_cols = list(mean_columns) + list(rounded_columns)
+    values = df[value_cols]
+    no_geography = np.full((1, len(value_cols)), np.nan)
+
+    averages = {}
+    for geo_col, suffix in specs:
+        codes, uniques = pd.factorize(df[geo_col])
+        # grouping by the codes as categories does not hash them again
+        grouped = values.groupby(
+            pd.Categorical.from_codes(codes, categories=range(len(uniques))),
+            observed=False,
+        )
+        group_means = grouped.sum() / grouped.count()
+
+        # parcels without a geography have code -1, which takes the trailing NaN row
+        means = np.vstack([group_means.to_numpy(), no_geography])[codes]
+
+        for i, col in enumerate(value_cols):
+            avg = means[:, i]
+            if col in rounded_columns:
+                avg = np.round(avg)
+                # round() returns ints, so the column stays integer unless
+                # some parcel has no average (NaN mean or missing geography)
+                if not np.isnan(avg).any():
+                    avg = avg.astype(np.int64)
+            averages[f"{col}_avg_{suffix}"] = avg
+
+    return df.assign(**averages)
+
 
 def process_data(df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """
     Function to calculate additional columns.
     """
     # Calculate unit value and add as a new column
-    df["unit_val"] = df["TOTAL_PROP_VALUE"] / df["du_est_final"]
-
-    # Calculate quartile thresholds for unit_val in df
-    quartiles = df["unit_val"].quantile([0, 0.25, 0.5, 0.75, 1])
-
-    # Function to assign quartile category
-    def assign_quartile(unit_val):
-        if unit_val >= quartiles.iloc[3]:  # Fourth quartile
-            return 4
-        elif unit_val >= quartiles.iloc[2]:  # Third quartile
-            return 3
-        elif unit_val >= quartiles.iloc[1]:  # Second quartile
-            return 2
-        else:  # First quartile
-            return 1
-
-    # Apply function to create unit_val_cat column
-    df["unit_val_cat"] = df["unit_val"].apply(assign_quartile)
-
-    # Create subsets based on designation
-    df_single = df[df["designation"] == "single"].copy()
-    df_multi = df[df["designation"] == "multi"].copy()
-
-    # Calculate quartile thresholds for unit_val in df_single
-    quartiles_single = df_single["unit_val"].quantile([0, 0.25, 0.5, 0.75, 1])
-
-    # Function to assign quartile category for df_single
-    def assign_quartile_single(unit_val):
-        if unit_val >= quartiles_single.iloc[3]:  # Fourth quartile
-            return 4
-        elif unit_val >= quartiles_single.iloc[2]:  # Third quartile
-            return 3
-        elif unit_val >= quartiles_single.iloc[1]:  # Second quartile
-            return 2
-        else:  # First quartile
-            return 1
-
-    # Apply function to create unit_val_cat_single column in df_single
-    df_single["unit_val_cat_single"] = df_single["unit_val"].apply(
-        assign_quartile_single
-    )
-
-    # Calculate quartile thresholds for unit_val in df_multi
-    quartiles_multi = df_multi["unit_val"].quantile([0, 0.25, 0.5, 0.75, 1])
-
-    # Function to assign quartile category for df_multi
-    def assign_quartile_multi(unit_val):
-        if unit_val >= quartiles_multi.iloc[3]:  # Fourth quartile
-            return 4
-        elif unit_val >= quartiles_multi.iloc[2]:  # Third quartile
-            return 3
-        elif unit_val >= quartiles_multi.iloc[1]:  # Second quartile
-            return 2
-        else:  # First quartile
-            return 1
-
-    # Apply function to create unit_val_cat_multi column in df_multi
-    df_multi["unit_val_cat_multi"] = df_multi["unit_val"].apply(assign_quartile_multi)
-
-    # Merge unit_val_cat_single column into the original dataframe
-    df = df.merge(df_single[["REID", "unit_val_cat_single"]], on="REID", how="left")
-
-    # Merge unit_val_cat_multi column into the original dataframe
-    df = df.merge(df_multi[["REID", "unit_val_cat_multi"]], on="REID", how="left")
-
-    # Group by pu_2324_848 (Planning Unit)
-    pu_avg = (
-        df.groupby("pu_2324_848")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for PUs
-    pu_avg.columns = [
-        "pu_2324_848",
-        "unit_val_avg_pu2020",
-        "unit_val_cat_single_avg_pu2020",
-        "unit_val_cat_multi_avg_pu2020",
-    ]
-
-    # Merge PU averages back to df
-    df = pd.merge(df, pu_avg, on="pu_2324_848", how="left")
-
-    # Group by geo_id_b2020 (block)
-    block_avg = (
-        df.groupby("geo_id_b2020")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for blocks
-    block_avg.columns = [
-        "geo_id_b2020",
-        "unit_val_avg_b2020",
-        "unit_val_cat_single_avg_b2020",
-        "unit_val_cat_multi_avg_b2020",
-    ]
-
-    # Merge block averages back to df
-    df = pd.merge(df, block_avg, on="geo_id_b2020", how="left")
-
-    # Group by geo_id_bg2020 (block group)
-    block_group_avg = (
-        df.groupby("geo_id_bg2020")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for block groups
-    block_group_avg.columns = [
-        "geo_id_bg2020",
-        "unit_val_avg_bg2020",
-        "unit_val_cat_single_avg_bg2020",
-        "unit_val_cat_multi_avg_bg2020",
-    ]
-
-    # Merge block group averages back to df
-    df = pd.merge(df, block_group_avg, on="geo_id_bg2020", how="left")
-
-    # Group by geo_id_t2020 (tract)
-    tract_avg = (
-        df.groupby("geo_id_t2020")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
+    df["unit_val"] = unit_values(df)
+
+    # Assign unit value quartiles overall, for single and for multi family parcels
+    for out_column, designation in UNIT_VALUE_CATEGORIES.items():
+        assign_quantile_category(
+            df,
+            "unit_val",
+            out_column,
+            by=None if designation is None else "designation",
+            partition=designation,
         )
-        .reset_index()
-    )
-
-    # Rename columns for tracts
-    tract_avg.columns = [
-        "geo_id_t2020",
-        "unit_val_avg_t2020",
-        "unit_val_cat_single_avg_t2020",
-        "unit_val_cat_multi_avg_t2020",
-    ]
-
-    # Merge tract averages back to df
-    df = pd.merge(df, tract_avg, on="geo_id_t2020", how="left")
-
-    # New grouping and merging operations for the additional columns
-    # Group by geo_id_b2010 (block)
-    block_avg_2010 = (
-        df.groupby("geo_id_b2010")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for blocks
-    block_avg_2010.columns = [
-        "geo_id_b2010",
-        "unit_val_avg_b2010",
-        "unit_val_cat_single_avg_b2010",
-        "unit_val_cat_multi_avg_b2010",
-    ]
-
-    # Merge block averages back to df
-    df = pd.merge(df, block_avg_2010, on="geo_id_b2010", how="left")
-
-    # Group by geo_id_bg2010 (block group)
-    block_group_avg_2010 = (
-        df.groupby("geo_id_bg2010")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for block groups
-    block_group_avg_2010.columns = [
-        "geo_id_bg2010",
-        "unit_val_avg_bg2010",
-        "unit_val_cat_single_avg_bg2010",
-        "unit_val_cat_multi_avg_bg2010",
-    ]
-
-    # Merge block group averages back to df
-    df = pd.merge(df, block_group_avg_2010, on="geo_id_bg2010", how="left")
-
-    # Group by pu_2122_833 (Planning Unit)
-    pu_avg_2122 = (
-        df.groupby("pu_2122_833")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for PUs
-    pu_avg_2122.columns = [
-        "pu_2122_833",
-        "unit_val_avg_pu2122",
-        "unit_val_cat_single_avg_pu2122",
-        "unit_val_cat_multi_avg_pu2122",
-    ]
-
-    # Merge PU averages back to df
-    df = pd.merge(df, pu_avg_2122, on="pu_2122_833", how="left")
-
-    # Group by geo_id_t2010 (tract)
-    tract_avg_2010 = (
-        df.groupby("geo_id_t2010")
-        .agg(
-            {
-                "unit_val": "mean",
-                "unit_val_cat_single": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-                "unit_val_cat_multi": lambda x: (
-                    round(x.mean()) if not np.isnan(x.mean()) else np.nan
-                ),
-            }
-        )
-        .reset_index()
-    )
-
-    # Rename columns for tracts
-    tract_avg_2010.columns = [
-        "geo_id_t2010",
-        "unit_val_avg_t2010",
-        "unit_val_cat_single_avg_t2010",
-        "unit_val_cat_multi_avg_t2010",
-    ]
-
-    # Merge tract averages back to df
-    df = pd.merge(df, tract_avg_2010, on="geo_id_t2010", how="left")
+
+    # Average unit values over every geography and broadcast them back to parcels
+    df = add_geography_averages(df)
+    df.index = pd.RangeIndex(len(df))
 
     return df
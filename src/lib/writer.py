@@ -0,0 +1,136 @@
+import fiona
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import mapping
+
+# pyogrio is optional: when it is installed the whole layer is handed to GDAL
+# as columnar arrays, otherwise we fall back to chunked fiona writerecords
+try:
+    import pyogrio
+except ImportError:  # pragma: no cover
+    pyogrio = None
+
+
+def infer_gdb_schema(gdf: gpd.GeoDataFrame) -> dict:
+    """
+    Function to build the fiona schema for an OpenFileGDB layer.
+    Columns are written as int32 or float if their dtype says so, and str
+    otherwise. Nullable dtypes (Int8, Float64, ...) count as their numpy
+    counterparts, whatever the case of their name. Integer fields of a GDB are
+    32-bit (64-bit ones need ArcGIS Pro 3.2, and GDAL writes them as float
+    otherwise), so integer columns with values out of the int32 range are
+    written as float, whichever the writer.
+    """
+    dtypes = {col: str(gdf[col].dtype).lower() for col in gdf.columns}
+    properties = {}
+    for col, dtype in dtypes.items():
+        if col == "geometry":
+            continue
+        if "int" in dtype:
+            properties[col] = "int32" if _fits_int32(gdf[col]) else "float"
+        else:
+            properties[col] = "float" if "float" in dtype else "str"
+    return {"geometry": "MultiPolygon", "properties": properties}
+
+
+def _fits_int32(series: pd.Series) -> bool:
+    """
+    Function to check that the values of an integer column fit in an int32.
+    """
+    values = series.dropna()
+    limits = np.iinfo(np.int32)
+    return values.empty or (values.min() >= limits.min and values.max() <= limits.max)
+
+
+def _to_str_or_none(series: pd.Series) -> pd.Series:
+    """
+    Function to convert non-null values to str, keeping nulls as None.
+    """
+    return series.astype(object).map(str).where(series.notna(), None)
+
+
+def prepare_gdb_frame(gdf: gpd.GeoDataFrame, schema: dict) -> gpd.GeoDataFrame:
+    """
+    Function to cast every column to the type given in the schema, so that the
+    columnar writer creates the same fields as a row-by-row fiona write.
+    """
+    columns = {}
+    for col, field_type in schema["properties"].items():
+        if field_type == "int32":
+            # nullable integers with missing values stay nullable
+            has_na = gdf[col].isna().any()
+            columns[col] = gdf[col].astype("Int32" if has_na else np.int32)
+        elif field_type == "float":
+            columns[col] = gdf[col].astype(np.float64)
+        else:
+            columns[col] = _to_str_or_none(gdf[col])
+
+    return gpd.GeoDataFrame(
+        columns, geometry=gdf.geometry.values, crs=gdf.crs, index=gdf.index
+    )
+
+
+def _iter_record_chunks(gdf: gpd.GeoDataFrame, chunk_size: int):
+    """
+    Function to yield lists of fiona records, chunk_size rows at a time.
+    """
+    properties = gdf.drop(columns="geometry")
+    # fiona does not know pd.NA, nulls of nullable integers are passed as None
+    for col in properties.columns:
+        if properties[col].dtype == "Int32":
+            series = properties[col]
+            properties[col] = series.astype(object).where(series.notna(), None)
+    for start in range(0, len(gdf), chunk_size):
+        chunk = properties.iloc[start : start + chunk_size]
+        geoms = gdf.geometry.values[start : start + chunk_size]
+        yield [
+            {
+                "geometry": mapping(geom) if geom is not None else None,
+                "properties": props,
+            }
+            for geom, props in zip(geoms, chunk.to_dict("records"))
+        ]
+
+
+def write_gdb_layer(
+    gdf: gpd.GeoDataFrame,
+    path: str,
+    layer: str,
+    chunk_size: int = 50_000,
+    use_pyogrio: bool = True,
+) -> None:
+    """
+    Function to write a GeoDataFrame as a layer of an OpenFileGDB in one batch.
+
+    Parameters:
+    gdf: The layer to write. Datetime columns should already be converted to str.
+    path: Path to the .gdb; the layer is added to it if it already exists.
+    layer: Name of the layer.
+    chunk_size: Number of records per writerecords call on the fiona fallback.
+    use_pyogrio: Set to False to force the fiona fallback.
+    """
+    schema = infer_gdb_schema(gdf)
+    prepared = prepare_gdb_frame(gdf, schema)
+
+    if use_pyogrio and pyogrio is not None:
+        pyogrio.write_dataframe(
+            prepared,
+            path,
+            layer=layer,
+            driver="OpenFileGDB",
+            geometry_type=schema["geometry"],
+            promote_to_multi=True,
+        )
+        return
+
+    with fiona.open(
+        path,
+        "w",
+        driver="OpenFileGDB",
+        schema=schema,
+        layer=layer,
+        crs=gdf.crs,
+    ) as dst:
+        for records in _iter_record_chunks(prepared, chunk_size):
+            dst.writerecords(records)
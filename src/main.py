@@ -1,39 +1,111 @@
+from __future__ import annotations
+
 import os
-import geopandas as gpd
-import fiona
-
-# functions to run R code for fetching census data
-import rpy2.robjects as robjects
-import pandas as pd
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.conversion import localconverter
-
-# functions for cleaning/manipulating data
-from lib.data import (
-    get_parcels,
-    get_du_est,
-    add_columns_from_csv,
-    add_columns_from_census,
-    fix_geoid_dtypes,
-    subset_analytic_dataset,
-    aggregate_by_geo_id,
-    safe_convert_to_int,
-    convert_datetime_to_str,
-    mean_and_round,
-)
-
-# functions for aggregation, calculations/creating new variables
-from lib.variables import process_data
+import time
+import shutil
+import argparse
+from typing import TYPE_CHECKING
+
+# pandas, geopandas, GDAL and the lib modules are imported by the functions
+# that use them, so --help, --list-layers and bad arguments return at once
+if TYPE_CHECKING:
+    import pandas as pd
+    import geopandas as gpd
 
 
 # user-defined parameters
 class CONFIG:
     CENSUS_YEAR = 2020
+    PATH_CENSUS_SCRIPT = r"src/lib/DataGathering.R"
     PATH_PARCELS = r"data/Parcels_1"
     PATH_DU_EST = r"data/parcels_clean_duest_stu_spjoin_20240625.csv"
     PATH_DPS_LAYERS = r"data/dps_all_layers20240208.gdb"
     OUTPUT_DIR = r"data/outputs"
     OUTPUT_GDB_NAME = r"dps.gdb"  # must end in gdb
+    # formats every layer is written in, any of "csv", "gdb", "geoparquet"
+    # and "flatgeobuf" (see lib.sinks.SINKS)
+    OUTPUT_FORMATS = ["csv", "gdb"]
+    CACHE_DIR = r"data/cache"
+    # stage timings of --profile, and the cProfile stats of --cprofile
+    PROFILE_DIR = r"data/profile"
+    CENSUS_STORE_DIR = r"data/census"
+    STAGE_CACHE_MAX_BYTES = 2 * 2**30
+
+    # rows read at a time and per partition by --streaming, which bounds its memory
+    STREAMING_CHUNK_SIZE = 250_000
+
+    # vector tile pyramids written by --tiles, one MBTiles per layer in
+    # OUTPUT_DIR/tiles: zoom levels, and {zoom: simplification} applying from
+    # that zoom up, in tile units where 16 is a pixel (see lib.tiles)
+    TILE_ZOOMS = list(range(8, 15))
+    TILE_SIMPLIFICATION = {8: 8.0, 11: 4.0, 14: 1.0}
+
+    # the processed parcels of every run (but --streaming ones) are published
+    # here for --serve, which answers lookups of the indicators of a geography
+    # and of its parcels over HTTP (see lib.service); parcel lookups return
+    # SERVICE_PARCEL_COLUMNS (None for all columns)
+    SNAPSHOT_DIR = r"data/snapshots"
+    SERVICE_HOST = "127.0.0.1"
+    SERVICE_PORT = 8765
+    SERVICE_POLL_SECONDS = 2.0
+    SERVICE_PARCEL_COLUMNS = [
+        "REID",
+        "PIN",
+        "LOCATION_A",
+        "designation",
+        "housing_type",
+        "du_est_final",
+        "students2324",
+        "TOTAL_PROP_VALUE",
+        "unit_val",
+        "unit_val_cat",
+        "unit_val_cat_single",
+        "unit_val_cat_multi",
+    ]
+
+    # --scenarios evaluates proposed assignments of planning units (this geo id
+    # column) to schools, given as a CSV with a row per scenario and a column
+    # per planning unit holding its school id, and writes the aggregations of
+    # every school of every scenario to OUTPUT_DIR/scenarios.csv
+    SCENARIO_UNIT = "pu_2324_848"
+
+    # --panel aggregates the student counts of every school year in the DPS
+    # parcel estimates (studentsYYYY columns, new years included) by every
+    # layer, with their changes from year to year, to OUTPUT_DIR/panel
+    PANEL_AGGREGATIONS = ["sum", "mean"]
+
+    # simplify the boundaries of every layer and snap their coordinates to a
+    # grid before it is written (see lib.geometry), for lighter files that
+    # render faster; the polygons of a layer must tile without overlaps, as
+    # census geographies and school zones do, and keep sharing their boundaries
+    OPTIMIZE_GEOMETRY = False
+    # {layer: {"simplify": tolerance, "precision": grid size}} in feet
+    # (EPSG:2264), 0 to skip a step; layers not listed are written as read
+    GEOMETRY_TOLERANCES = {
+        "b2020": {"simplify": 5.0, "precision": 1.0},
+        "bg2020": {"simplify": 10.0, "precision": 1.0},
+        "t2020": {"simplify": 20.0, "precision": 1.0},
+        "b2010": {"simplify": 5.0, "precision": 1.0},
+        "bg2010": {"simplify": 10.0, "precision": 1.0},
+        "t2010": {"simplify": 20.0, "precision": 1.0},
+        "PU_2324_848": {"simplify": 5.0, "precision": 1.0},
+        "ES_base_2223": {"simplify": 10.0, "precision": 1.0},
+        "ES_zone_2223": {"simplify": 10.0, "precision": 1.0},
+        "ES_gt_2425": {"simplify": 10.0, "precision": 1.0},
+        "MS_base_2223": {"simplify": 20.0, "precision": 1.0},
+        "MS_gt_2526": {"simplify": 20.0, "precision": 1.0},
+        "HS_base_2223": {"simplify": 20.0, "precision": 1.0},
+        "HS_gt_2526": {"simplify": 20.0, "precision": 1.0},
+        "regions_2025_26": {"simplify": 50.0, "precision": 1.0},
+    }
+
+    # derive the geo id columns of layer_mapping from the parcel geometries and
+    # DPS all layers, instead of taking them from the DPS CSV
+    ASSIGN_GEOGRAPHIES = False
+
+    # attribute columns to read from DPS all layers (None for all); the layer's
+    # geo id column from layer_mapping must be included
+    boundary_columns = None
 
     layer_mapping = {
         # 'dps_all_layers_geo_id': 'base_dataset_geo_id'
@@ -55,7 +127,11 @@ class CONFIG:
     }
 
     # options for aggregation functions:
-    # ['sum', 'mean', 'median', 'min', 'max', 'std']
+    # ['sum', 'mean', 'median', 'min', 'max', 'std', 'mean_and_round']
+    # and the distributional ones of lib.distribution: percentiles ('p10',
+    # 'p90', ...) and 'gini', or weighted by another column as in
+    # 'median@du_est_final', 'p90@du_est_final', 'mean@students2324' and
+    # 'gini@du_est_final'. These are not available with --streaming.
     # block_group_aggregations = {
     #     "du_est_final": ["sum", "mean"],
     #     "TOTAL_PROP_VALUE": ["sum", "mean"],
@@ -102,8 +178,8 @@ class CONFIG:
         "estimate_housing_units_bg": "mean",
         "pct_vacant_bg": "mean",
         "pct_owner_occupied_bg": "mean",
-        "unit_val_cat_single": mean_and_round,
-        "unit_val_cat_multi": mean_and_round,
+        "unit_val_cat_single": "mean_and_round",
+        "unit_val_cat_multi": "mean_and_round",
     }
 
     tract_aggregations = {
@@ -118,161 +194,753 @@ class CONFIG:
         "estimate_housing_units_t": "mean",
         "pct_vacant_t": "mean",
         "pct_owner_occupied_t": "mean",
-        "unit_val_cat_single": mean_and_round,
-        "unit_val_cat_multi": mean_and_round,
+        "unit_val_cat_single": "mean_and_round",
+        "unit_val_cat_multi": "mean_and_round",
     }
 
     aggregations = {
         "du_est_final": ["sum", "mean"],
         "TOTAL_PROP_VALUE": ["sum", "mean"],
         "unit_val": ["sum", "mean"],
-        "unit_val_cat_single": mean_and_round,
-        "unit_val_cat_multi": mean_and_round,
+        "unit_val_cat_single": "mean_and_round",
+        "unit_val_cat_multi": "mean_and_round",
     }
 
 
-if __name__ == "__main__":
-
-    if not os.path.exists(CONFIG.OUTPUT_DIR):
-        os.makedirs(CONFIG.OUTPUT_DIR)
+def layer_aggregations(geo_layer: str) -> dict:
+    """
+    Function to pick the aggregations for a layer of DPS all layers.
+    """
+    if geo_layer in ["bg2020", "bg2010"]:
+        return CONFIG.block_group_aggregations
+    elif geo_layer in ["t2020", "t2010"]:
+        return CONFIG.tract_aggregations
     else:
-        pass
+        return CONFIG.aggregations
 
-    flat_file_dir = os.path.join(CONFIG.OUTPUT_DIR, "aggregated_flat_files")
-    if not os.path.exists(flat_file_dir):
-        os.makedirs(flat_file_dir)
-    else:
-        pass
 
-    gdb_path = os.path.join(CONFIG.OUTPUT_DIR, CONFIG.OUTPUT_GDB_NAME)
+def get_layer_boundaries(layers: list) -> dict:
+    """
+    Function to read layers of DPS all layers through the GeoParquet cache.
+    """
+    from lib.data import get_boundary_layers
 
-    # CENSUS ==================================================================
-    robjects.r("source('src/lib/DataGathering.r')")
+    return get_boundary_layers(
+        CONFIG.PATH_DPS_LAYERS,
+        layers,
+        columns=CONFIG.boundary_columns,
+        cache_dir=os.path.join(CONFIG.CACHE_DIR, "boundaries"),
+    )
 
-    make_acs_table_t_r = robjects.globalenv["make_acs_table_t"]
-    make_acs_table_bg_r = robjects.globalenv["make_acs_table_bg"]
 
-    # Convert the R DataFrame to a pandas DataFrame
-    with localconverter(robjects.default_converter + pandas2ri.converter):
-        make_acs_table_t = robjects.conversion.rpy2py(make_acs_table_t_r)
-        make_acs_table_bg = robjects.conversion.rpy2py(make_acs_table_bg_r)
+def output_paths(geo_layer: str, shared: bool) -> dict:
+    """
+    Function to return {output format: path} for a layer, for the formats of
+    CONFIG.OUTPUT_FORMATS keeping every layer in one file (shared), such as
+    the GDB, or those with a file per layer.
+    """
+    from lib.sinks import is_shared, sink_path
 
-        acs_table_t_r = make_acs_table_t(CONFIG.CENSUS_YEAR)
-        acs_table_bg_r = make_acs_table_bg(CONFIG.CENSUS_YEAR)
+    gdb_path = os.path.join(CONFIG.OUTPUT_DIR, CONFIG.OUTPUT_GDB_NAME)
+    return {
+        output_format: sink_path(CONFIG.OUTPUT_DIR, output_format, geo_layer, gdb_path)
+        for output_format in CONFIG.OUTPUT_FORMATS
+        if is_shared(output_format) == shared
+    }
 
-        acs_table_t = robjects.conversion.rpy2py(acs_table_t_r)
-        acs_table_bg = robjects.conversion.rpy2py(acs_table_bg_r)
 
-    # Durham Open/Parcels =====================================================
+def tile_source_path(geo_layer: str) -> str:
+    """
+    Function to return where the tile source of a layer is kept until its
+    vector tiles are built, see build_tiles.
+    """
+    return os.path.join(CONFIG.CACHE_DIR, "tile_sources", f"{geo_layer}.parquet")
+
+
+def save_tile_source(geo_layer: str, merged_gdf: gpd.GeoDataFrame) -> None:
+    """
+    Function to keep the geo id and aggregated columns of a merged layer, the
+    attributes of its vector tiles.
+    """
+    from lib.data import aggregate_column_names
+    from lib.tiles import write_tile_source
+
+    columns = [CONFIG.layer_mapping[geo_layer]] + aggregate_column_names(
+        layer_aggregations(geo_layer)
+    )
+    os.makedirs(os.path.dirname(tile_source_path(geo_layer)), exist_ok=True)
+    write_tile_source(merged_gdf, tile_source_path(geo_layer), columns)
+
+
+def build_tiles(workers: int = 1) -> None:
+    """
+    Function to build the vector tile pyramids of the layers saved by
+    save_tile_source, in CONFIG order, and drop their sources.
+    """
+    from lib.tiles import write_tile_pyramids
+    from lib.profiling import stage
+
+    sources = {
+        geo_layer: tile_source_path(geo_layer)
+        for geo_layer in CONFIG.layer_mapping
+        if os.path.exists(tile_source_path(geo_layer))
+    }
+    tiles_dir = os.path.join(CONFIG.OUTPUT_DIR, "tiles")
+    os.makedirs(tiles_dir, exist_ok=True)
 
-    durham_open = get_parcels(CONFIG.PATH_PARCELS)
-    parcels_clean = get_du_est(CONFIG.PATH_DU_EST)
+    start = time.perf_counter()
+    with stage("tiles", layers=len(sources)):
+        write_tile_pyramids(
+            sources, tiles_dir, CONFIG.TILE_ZOOMS, CONFIG.TILE_SIMPLIFICATION, workers
+        )
+    shutil.rmtree(os.path.join(CONFIG.CACHE_DIR, "tile_sources"), ignore_errors=True)
+    print(
+        f"Vector tiles of {len(sources)} layers written to {tiles_dir} "
+        f"(zoom {min(CONFIG.TILE_ZOOMS)}-{max(CONFIG.TILE_ZOOMS)}) "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+def process_layer(geo_layer: str, base_dataset: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Function to aggregate the base dataset by one layer's geography and export
+    it, see export_layer.
+    """
+    from lib.data import aggregate_by_geo_id
+    from lib.profiling import stage, frame_shape
+
+    with stage("aggregate", layer=geo_layer) as record:
+        base_dataset_agg = aggregate_by_geo_id(
+            base_dataset, CONFIG.layer_mapping[geo_layer], layer_aggregations(geo_layer)
+        )
+        record.update(frame_shape(base_dataset_agg))
+    return export_layer(geo_layer, base_dataset_agg)
 
-    # Joins ===================================================================
 
-    base_dataset = add_columns_from_csv(durham_open, parcels_clean)
+def export_layer(geo_layer: str, base_dataset_agg: pd.DataFrame) -> gpd.GeoDataFrame:
+    """
+    Function to join a layer's aggregates to the layer from DPS all layers and
+    write it out in the output formats with a file per layer.
+    Returns the merged layer, ready to be written to the GDB.
+    """
+    from lib.data import safe_convert_to_int, convert_datetime_to_str
+    from lib.sinks import write_layer
+    from lib.profiling import stage, frame_shape
 
-    # converting geo_ids to integers for joining with census data
-    base_dataset["geo_id_t2020"] = fix_geoid_dtypes(base_dataset["geo_id_t2020"])
-    base_dataset["geo_id_b2020"] = fix_geoid_dtypes(base_dataset["geo_id_b2020"])
-    base_dataset["geo_id_bg2020"] = fix_geoid_dtypes(base_dataset["geo_id_bg2020"])
+    mapped_geo_col_name = CONFIG.layer_mapping[geo_layer]
 
-    # adding columns from census data
-    base_dataset = add_columns_from_census(base_dataset, acs_table_t, "t")
-    base_dataset = add_columns_from_census(base_dataset, acs_table_bg, "bg")
+    # read DPS all layers, and join the aggregated information
+    # by corresponding geography
+    with stage("read_boundaries", layer=geo_layer) as record:
+        gdf = get_layer_boundaries([geo_layer])[geo_layer]
+        record.update(frame_shape(gdf))
 
-    # Calculations ============================================================
-    base_dataset = subset_analytic_dataset(base_dataset)
-    base_dataset = process_data(base_dataset)
+    with stage("merge", layer=geo_layer) as record:
+        # ensure the datatypes of the geo id columns match before merging
+        gdf.dropna(subset=mapped_geo_col_name, inplace=True)
+        gdf = safe_convert_to_int(gdf, mapped_geo_col_name)
 
-    # Join the base dataset with GDB layers ==================================
+        base_dataset_agg.dropna(subset=mapped_geo_col_name, inplace=True)
+        base_dataset_agg = safe_convert_to_int(base_dataset_agg, mapped_geo_col_name)
 
-    for geo_layer in CONFIG.layer_mapping.keys():
-        if geo_layer in ["bg2020", "bg2010"]:
-            base_dataset_agg = aggregate_by_geo_id(
-                base_dataset,
-                CONFIG.layer_mapping[geo_layer],
-                CONFIG.block_group_aggregations,
+        merged_gdf = gdf.merge(base_dataset_agg, how="left", on=mapped_geo_col_name)
+        merged_gdf.crs = gdf.crs
+        record.update(frame_shape(merged_gdf))
+
+    if CONFIG.OPTIMIZE_GEOMETRY and geo_layer in CONFIG.GEOMETRY_TOLERANCES:
+        from lib.geometry import optimize_geometry
+
+        with stage("optimize_geometry", layer=geo_layer) as record:
+            merged_gdf = optimize_geometry(
+                merged_gdf, **CONFIG.GEOMETRY_TOLERANCES[geo_layer]
             )
-            pass
+            before, after = merged_gdf.attrs["vertices"]
+            record.update(vertices_before=before, vertices_after=after)
+
+    # write to csv, GeoParquet, FlatGeobuf, from the same frame
+    write_layer(merged_gdf, geo_layer, output_paths(geo_layer, shared=False))
+
+    # Convert timestamp columns to srt because they give trouble when writing out
+    # as a geodatabase
+    merged_gdf = convert_datetime_to_str(merged_gdf)
 
-        elif geo_layer in ["b2020", "b2010"]:
-            base_dataset_agg = aggregate_by_geo_id(
-                base_dataset, CONFIG.layer_mapping[geo_layer], CONFIG.aggregations
+    return merged_gdf
+
+
+def layer_summary(geo_layer: str, merged_gdf: gpd.GeoDataFrame) -> str:
+    """
+    Function to describe the geometry written for a layer: its vertices (before
+    and after optimize_geometry, when CONFIG.OPTIMIZE_GEOMETRY) and the size of
+    its files in the formats with a file per layer.
+    """
+    from lib.geometry import count_vertices
+    from lib.sinks import path_size
+
+    if "vertices" in merged_gdf.attrs:
+        before, after = merged_gdf.attrs["vertices"]
+        vertices = f"{before:,} -> {after:,} vertices"
+    else:
+        vertices = f"{count_vertices(merged_gdf.geometry):,} vertices"
+    paths = [
+        path
+        for path in output_paths(geo_layer, shared=False).values()
+        if os.path.exists(path)
+    ]
+    return f"{vertices}, {sum(map(path_size, paths)) / 2**20:.2f} MiB"
+
+
+def load_base_dataset(force: bool = False, workers: int = 1) -> gpd.GeoDataFrame:
+    """
+    Function to build the processed base dataset, through the stage cache.
+    """
+    # functions for cleaning/manipulating data
+    from lib.data import (
+        get_parcels,
+        get_du_est,
+        du_est_columns,
+        PARCEL_COLUMNS,
+        path_fingerprint,
+        assign_geographies,
+        build_analytic_dataset,
+        optimize_dtypes,
+        memory_report,
+    )
+
+    # functions for loading census data, fetched through R only when not stored
+    from lib.census import get_census_tables, ensure_census_store
+
+    # functions for aggregation, calculations/creating new variables
+    from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+
+    # functions for caching pipeline stages
+    from lib.cache import cached_stage, stage_key, source_fingerprint
+
+    # functions for timing stages, see --profile
+    from lib.profiling import stage, profiled, frame_shape
+
+    # every stage is cached under a key of its inputs, so only the stages
+    # whose inputs (or code) changed are recomputed
+    def run_stage(name: str, key: str, compute):
+        with stage("cached_stage", cache=name) as record:
+            result = cached_stage(
+                os.path.join(CONFIG.CACHE_DIR, "stages"),
+                name,
+                key,
+                compute,
+                force=force,
+                max_bytes=CONFIG.STAGE_CACHE_MAX_BYTES,
             )
-            pass
+            record.update(frame_shape(result))
+        print(memory_report(name, result))
+        return result
+
+    # the ACS tables are kept in a local store; R only runs if they are missing
+    with stage("census_fetch"):
+        census_path = ensure_census_store(
+            CONFIG.CENSUS_YEAR, CONFIG.CENSUS_STORE_DIR, CONFIG.PATH_CENSUS_SCRIPT
+        )
+    census_key = stage_key(CONFIG.CENSUS_YEAR, path_fingerprint(census_path))
+    parcels_key = stage_key(
+        path_fingerprint(CONFIG.PATH_PARCELS), source_fingerprint(get_parcels)
+    )
+    geographies_key = (
+        stage_key(
+            parcels_key,
+            path_fingerprint(CONFIG.PATH_DPS_LAYERS),
+            CONFIG.layer_mapping,
+            source_fingerprint(assign_geographies),
+        )
+        if CONFIG.ASSIGN_GEOGRAPHIES
+        else None
+    )
+    base_key = stage_key(
+        census_key,
+        parcels_key,
+        geographies_key,
+        path_fingerprint(CONFIG.PATH_DU_EST),
+        source_fingerprint(build_analytic_dataset),
+    )
+    processed_key = stage_key(base_key, source_fingerprint(process_data))
+
+    def build_base_dataset() -> gpd.GeoDataFrame:
+        # CENSUS ==============================================================
+        acs_table_t, acs_table_bg = profiled(
+            "get_census_tables",
+            get_census_tables,
+            CONFIG.CENSUS_YEAR,
+            CONFIG.CENSUS_STORE_DIR,
+        )
+
+        # Durham Open/Parcels =================================================
+        durham_open = run_stage(
+            "durham_open",
+            parcels_key,
+            lambda: profiled(
+                "get_parcels", get_parcels, CONFIG.PATH_PARCELS, columns=PARCEL_COLUMNS
+            ),
+        )
+        parcels_clean = profiled(
+            "get_du_est",
+            get_du_est,
+            CONFIG.PATH_DU_EST,
+            columns=du_est_columns(CONFIG.PATH_DU_EST),
+        )
 
-        elif geo_layer in ["t2020", "t2010"]:
-            base_dataset_agg = aggregate_by_geo_id(
-                base_dataset, CONFIG.layer_mapping[geo_layer], CONFIG.tract_aggregations
+        # Geographies of the parcels from DPS all layers ======================
+        geographies = None
+        if CONFIG.ASSIGN_GEOGRAPHIES:
+            geographies = run_stage(
+                "geographies",
+                geographies_key,
+                lambda: profiled(
+                    "assign_geographies",
+                    assign_geographies,
+                    durham_open,
+                    get_layer_boundaries(list(CONFIG.layer_mapping.keys())),
+                    CONFIG.layer_mapping,
+                    workers=workers,
+                ),
             )
-            pass
 
+        # Joins and subset ====================================================
+        base_dataset = profiled(
+            "build_analytic_dataset",
+            build_analytic_dataset,
+            durham_open,
+            parcels_clean,
+            acs_table_t,
+            acs_table_bg,
+            geographies,
+        )
+
+        # ids, categories and counts in compact dtypes
+        return profiled("optimize_dtypes", optimize_dtypes, base_dataset)
+
+    # Calculations ============================================================
+    def build_processed_dataset() -> gpd.GeoDataFrame:
+        base_dataset = run_stage("base_dataset", base_key, build_base_dataset)
+        return profiled(
+            "optimize_dtypes",
+            optimize_dtypes,
+            profiled("process_data", process_data, base_dataset),
+            code_columns=QUARTILE_CODE_COLUMNS,
+        )
+
+    return run_stage("processed", processed_key, build_processed_dataset)
+
+
+def run(
+    layers: list,
+    workers: int = 1,
+    force: bool = False,
+    incremental: bool = False,
+    streaming: bool = False,
+    tiles: bool = False,
+) -> None:
+    """
+    Function to run the pipeline and write the given layers to the outputs.
+    With incremental, only the layers whose aggregates changed since the last
+    incremental run are written, see run_incremental. With streaming, the
+    parcels are never held in memory at once, see run_streaming. With tiles,
+    a vector tile pyramid is built for every layer written, see build_tiles.
+    Runs holding the parcels in memory publish them for --serve.
+    """
+    if not os.path.exists(CONFIG.OUTPUT_DIR):
+        os.makedirs(CONFIG.OUTPUT_DIR)
+    else:
+        pass
+
+    # directories of the output formats with a file per layer
+    for path in output_paths(layers[0], shared=False).values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # sources left by an interrupted run would be tiled with this one
+    shutil.rmtree(os.path.join(CONFIG.CACHE_DIR, "tile_sources"), ignore_errors=True)
+
+    if streaming:
+        run_streaming(layers, workers, tiles)
+    else:
+        from lib.service import publish_snapshot
+        from lib.profiling import stage
+
+        base_dataset = load_base_dataset(force, workers)
+        if incremental:
+            run_incremental(base_dataset, force, tiles)
         else:
-            base_dataset_agg = aggregate_by_geo_id(
-                base_dataset, CONFIG.layer_mapping[geo_layer], CONFIG.aggregations
-            )
-            pass
+            run_layers(layers, base_dataset, workers, tiles)
 
-        # read DPS all layers, and join the aggregated information
-        # by corresponding geography
-        gdf = gpd.read_file(CONFIG.PATH_DPS_LAYERS, layer=geo_layer)
+        with stage("publish_snapshot"):
+            publish_snapshot(base_dataset, CONFIG.SNAPSHOT_DIR)
 
-        # ensure the datatypes of the geo id columns match before merging
-        mapped_geo_col_name = CONFIG.layer_mapping[geo_layer]
-        gdf.dropna(subset=mapped_geo_col_name, inplace=True)
-        gdf = safe_convert_to_int(gdf, mapped_geo_col_name)
+    if tiles:
+        build_tiles(workers)
 
-        base_dataset_agg.dropna(subset=mapped_geo_col_name, inplace=True)
-        base_dataset_agg = safe_convert_to_int(base_dataset_agg, mapped_geo_col_name)
 
-        merged_gdf = gdf.merge(base_dataset_agg, how="left", on=mapped_geo_col_name)
-        merged_gdf.crs = gdf.crs
+def run_layers(
+    layers: list, base_dataset: gpd.GeoDataFrame, workers: int = 1, tiles: bool = False
+) -> None:
+    """
+    Function to aggregate the processed base dataset by the given layers and
+    write them, see process_layer.
+    """
+    # functions for running layers in parallel and writing outputs
+    from lib.parallel import map_layers
+    from lib.sinks import write_layer
+
+    # Join the base dataset with GDB layers ==================================
 
-        # write to csv
-        merged_gdf.to_csv(os.path.join(flat_file_dir, f"{geo_layer}.csv"), index=None)
-
-        # Convert timestamp columns to srt because they give trouble when writing out
-        # as a geodatabase
-        merged_gdf = convert_datetime_to_str(merged_gdf)
-
-        # Identify and convert timestamp fields to strings
-        schema = {
-            "geometry": "MultiPolygon",
-            "properties": {
-                col: (
-                    "int"
-                    if "int" in str(merged_gdf[col].dtype)
-                    else "float" if "float" in str(merged_gdf[col].dtype) else "str"
-                )
-                for col in merged_gdf.columns
-                if col != "geometry"
-            },
-        }
-
-        # Write the merged GeoDataFrame to a new GDB as a new layer using fiona
-        with fiona.open(
-            gdb_path,
-            "w",
-            driver="OpenFileGDB",
-            schema=schema,
-            layer=geo_layer,
-            crs=merged_gdf.crs,
-        ) as layer:
-            for idx, row in merged_gdf.iterrows():
-                layer.write(
-                    {
-                        "geometry": row["geometry"].__geo_interface__,
-                        "properties": {
-                            col: row[col]
-                            for col in merged_gdf.columns
-                            if col != "geometry"
-                        },
-                    }
-                )
+    # read the layers of DPS all layers in one pass, unless they are cached
+    get_layer_boundaries(layers)
+
+    # layers are processed (and written to the files of their own) in
+    # parallel with --workers, but written to the single GDB one at a time and
+    # in CONFIG order; rewriting a layer of an existing GDB replaces it
+    for geo_layer, merged_gdf, process_seconds in map_layers(
+        process_layer, layers, base_dataset, workers
+    ):
+        start = time.perf_counter()
+
+        # Write the merged GeoDataFrame to the GDB as a new layer in one batch
+        write_layer(merged_gdf, geo_layer, output_paths(geo_layer, shared=True))
+        if tiles:
+            save_tile_source(geo_layer, merged_gdf)
 
         # Inspect the written layer
         print(
-            f"Layer '{geo_layer}' written to {os.path.join(CONFIG.OUTPUT_DIR, CONFIG.OUTPUT_GDB_NAME)}"
+            f"Layer '{geo_layer}' written as {', '.join(CONFIG.OUTPUT_FORMATS)} "
+            f"(processed in {process_seconds:.2f}s, "
+            f"written in {time.perf_counter() - start:.2f}s; "
+            f"{layer_summary(geo_layer, merged_gdf)})"
         )
-        pass
+
+
+def run_incremental(
+    base_dataset: gpd.GeoDataFrame, force: bool = False, tiles: bool = False
+) -> None:
+    """
+    Function to update the aggregates of the groups touched by parcels that
+    changed since the last incremental run, and rewrite only the layers whose
+    aggregates changed. The first run (or one with force) writes every layer.
+    """
+    from lib.sinks import write_layer
+    from lib.incremental import update_aggregates, save_snapshot
+
+    snapshot_dir = os.path.join(CONFIG.CACHE_DIR, "incremental")
+    changed, snapshot = update_aggregates(
+        base_dataset,
+        CONFIG.layer_mapping,
+        {layer: layer_aggregations(layer) for layer in CONFIG.layer_mapping},
+        snapshot_dir,
+        force=force,
+    )
+
+    # layers without outputs are written from the snapshot as well
+    layers = [
+        layer
+        for layer in CONFIG.layer_mapping
+        if layer in changed
+        or not all(
+            os.path.exists(path)
+            for shared in [False, True]
+            for path in output_paths(layer, shared).values()
+        )
+    ]
+
+    get_layer_boundaries(layers)
+    for geo_layer in layers:
+        start = time.perf_counter()
+        merged_gdf = export_layer(geo_layer, snapshot["aggregates"][geo_layer].copy())
+        write_layer(merged_gdf, geo_layer, output_paths(geo_layer, shared=True))
+        if tiles:
+            save_tile_source(geo_layer, merged_gdf)
+        print(
+            f"Layer '{geo_layer}' updated as {', '.join(CONFIG.OUTPUT_FORMATS)} "
+            f"in {time.perf_counter() - start:.2f}s "
+            f"({layer_summary(geo_layer, merged_gdf)})"
+        )
+
+    # saved last, so an interrupted run is redone from the previous snapshot
+    save_snapshot(snapshot_dir, snapshot, layers=list(changed))
+
+
+def run_streaming(layers: list, workers: int = 1, tiles: bool = False) -> None:
+    """
+    Function to aggregate the parcels chunk by chunk, for inputs too large to
+    fit in memory, and write the given layers. The outputs are those of a
+    full run, up to the last digits of float sums; the stage cache is not used.
+    Only sums, counts and means can be aggregated this way.
+    """
+    from lib.sinks import write_layer
+    from lib.census import get_census_tables
+    from lib.data import PARCEL_COLUMNS, DU_EST_COLUMNS
+    from lib.streaming import stream_aggregates
+    from lib.profiling import stage, profiled
+
+    acs_table_t, acs_table_bg = profiled(
+        "get_census_tables",
+        get_census_tables,
+        CONFIG.CENSUS_YEAR,
+        CONFIG.CENSUS_STORE_DIR,
+        CONFIG.PATH_CENSUS_SCRIPT,
+    )
+    layer_mapping = {layer: CONFIG.layer_mapping[layer] for layer in layers}
+    boundaries = get_layer_boundaries(layers)
+
+    with stage("stream_aggregates", layers=len(layers)):
+        aggregates = stream_aggregates(
+            CONFIG.PATH_PARCELS,
+            CONFIG.PATH_DU_EST,
+            acs_table_t,
+            acs_table_bg,
+            layer_mapping,
+            {layer: layer_aggregations(layer) for layer in layers},
+            os.path.join(CONFIG.CACHE_DIR, "streaming"),
+            PARCEL_COLUMNS,
+            DU_EST_COLUMNS,
+            chunk_size=CONFIG.STREAMING_CHUNK_SIZE,
+            boundaries=boundaries if CONFIG.ASSIGN_GEOGRAPHIES else None,
+            workers=workers,
+        )
+
+    for geo_layer in layers:
+        start = time.perf_counter()
+        merged_gdf = export_layer(geo_layer, aggregates[geo_layer])
+        write_layer(merged_gdf, geo_layer, output_paths(geo_layer, shared=True))
+        if tiles:
+            save_tile_source(geo_layer, merged_gdf)
+        print(
+            f"Layer '{geo_layer}' written as {', '.join(CONFIG.OUTPUT_FORMATS)} "
+            f"in {time.perf_counter() - start:.2f}s "
+            f"({layer_summary(geo_layer, merged_gdf)})"
+        )
+
+
+def run_scenarios(path: str, force: bool = False, workers: int = 1) -> None:
+    """
+    Function to evaluate the assignments of planning units to schools in the
+    CSV at path (see CONFIG.SCENARIO_UNIT) on the processed base dataset, all
+    scenarios at once from the statistics of the planning units, see
+    lib.scenarios. Planning units left blank are assigned to no school.
+    """
+    import numpy as np
+    import pandas as pd
+    from lib.profiling import stage
+    from lib.scenarios import UNASSIGNED, evaluate_scenarios, unit_statistics
+
+    base_dataset = load_base_dataset(force, workers)
+
+    # scenarios are named by the first column
+    scenarios = pd.read_csv(path, index_col=0)
+    units = scenarios.columns.astype(np.int64)
+    assignments = scenarios.fillna(UNASSIGNED).to_numpy(np.int64)
+
+    with stage("evaluate_scenarios", scenarios=len(scenarios)):
+        state = unit_statistics(base_dataset, CONFIG.SCENARIO_UNIT, CONFIG.aggregations)
+        results = evaluate_scenarios(
+            state, assignments, CONFIG.aggregations, units=units, school_col="school"
+        )
+    results["scenario"] = scenarios.index[results["scenario"]]
+
+    output_path = os.path.join(CONFIG.OUTPUT_DIR, "scenarios.csv")
+    os.makedirs(CONFIG.OUTPUT_DIR, exist_ok=True)
+    results.to_csv(output_path, index=False)
+    print(
+        f"{len(scenarios)} scenarios of {len(units)} planning units "
+        f"evaluated to {output_path}"
+    )
+
+
+def run_panel(layers: list, force: bool = False, workers: int = 1) -> None:
+    """
+    Function to write the student counts of every school year aggregated by
+    the given layers, a row per geo id and year, see lib.panel.
+    """
+    from lib.panel import YEAR, panel_aggregates
+    from lib.profiling import stage
+
+    base_dataset = load_base_dataset(force, workers)
+
+    output_dir = os.path.join(CONFIG.OUTPUT_DIR, "panel")
+    os.makedirs(output_dir, exist_ok=True)
+    for geo_layer in layers:
+        with stage("panel_aggregates", layer=geo_layer):
+            panel = panel_aggregates(
+                base_dataset,
+                CONFIG.layer_mapping[geo_layer],
+                CONFIG.PANEL_AGGREGATIONS,
+            )
+        panel.to_csv(os.path.join(output_dir, f"{geo_layer}.csv"), index=False)
+        print(
+            f"Panel of '{geo_layer}' written: {panel[YEAR].nunique()} years of "
+            f"{panel[CONFIG.layer_mapping[geo_layer]].nunique()} geographies"
+        )
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    Function to parse the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description="Aggregate DPS parcel indicators by geography."
+    )
+    parser.add_argument(
+        "--layers",
+        nargs="+",
+        choices=list(CONFIG.layer_mapping.keys()),
+        metavar="LAYER",
+        help="layers to refresh (default: all, see --list-layers)",
+    )
+    parser.add_argument(
+        "--list-layers",
+        action="store_true",
+        help="print the layers and their geo id columns, and exit",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes to aggregate and export the layers with "
+        "(and of threads to assign geographies with)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="recompute every stage instead of using cached results",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="update only the aggregates of geographies with changed parcels "
+        "since the last incremental run, and rewrite only those layers",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="read and aggregate the parcels in chunks of "
+        f"{CONFIG.STREAMING_CHUNK_SIZE} rows, for inputs that do not fit in memory",
+    )
+    parser.add_argument(
+        "--tiles",
+        action="store_true",
+        help="also build a vector tile pyramid (MBTiles) of every layer written, "
+        f"in {os.path.join(CONFIG.OUTPUT_DIR, 'tiles')}",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=["jsonl", "chrome"],
+        help="record the time, CPU time, peak memory and rows/columns of every "
+        f"stage to {CONFIG.PROFILE_DIR}, as JSON lines or a Chrome trace "
+        "(chrome://tracing, ui.perfetto.dev)",
+    )
+    parser.add_argument(
+        "--cprofile",
+        nargs="+",
+        metavar="STAGE",
+        help="run the given stages (or 'all') under cProfile, with --profile, "
+        f"and write their stats to {os.path.join(CONFIG.PROFILE_DIR, 'cprofile')}",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="instead of running the pipeline, answer lookups of indicators and "
+        "parcels by geography over HTTP from the parcels the last run published "
+        f"to {CONFIG.SNAPSHOT_DIR}, reloading them when a run publishes new ones",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=CONFIG.SERVICE_PORT,
+        help=f"port of --serve (default {CONFIG.SERVICE_PORT})",
+    )
+    parser.add_argument(
+        "--scenarios",
+        metavar="CSV",
+        help="instead of writing the layers, evaluate the assignments of planning "
+        "units to schools in CSV (a row per scenario, a column per "
+        f"{CONFIG.SCENARIO_UNIT} id) and write the aggregations of every school "
+        f"of every scenario to {os.path.join(CONFIG.OUTPUT_DIR, 'scenarios.csv')}",
+    )
+    parser.add_argument(
+        "--panel",
+        action="store_true",
+        help="instead of writing the layers, write the student counts of every "
+        "school year (and their yearly changes) aggregated by the layers, to "
+        f"{os.path.join(CONFIG.OUTPUT_DIR, 'panel')}",
+    )
+    args = parser.parse_args(argv)
+
+    if args.cprofile and args.profile is None:
+        parser.error("--cprofile needs --profile")
+    if args.incremental and args.streaming:
+        parser.error("--incremental and --streaming cannot be combined")
+    if args.incremental and args.layers is not None:
+        parser.error("--incremental keeps every layer up to date; drop --layers")
+    if args.scenarios is not None and (args.incremental or args.streaming):
+        parser.error("--scenarios cannot be combined with --incremental or --streaming")
+    if args.panel and (args.incremental or args.streaming or args.scenarios):
+        parser.error(
+            "--panel cannot be combined with --incremental, --streaming or --scenarios"
+        )
+    if args.layers is None:
+        args.layers = list(CONFIG.layer_mapping.keys())
+
+    return args
+
+
+def main(argv: list = None) -> None:
+    """
+    Function to run the command line, see parse_args.
+    """
+    args = parse_args(argv)
+
+    if args.list_layers:
+        for geo_layer, geo_col in CONFIG.layer_mapping.items():
+            print(f"{geo_layer}\t{geo_col}")
+    elif args.serve:
+        import asyncio
+        from lib.service import serve
+
+        asyncio.run(
+            serve(
+                CONFIG.SNAPSHOT_DIR,
+                CONFIG.layer_mapping,
+                {layer: layer_aggregations(layer) for layer in CONFIG.layer_mapping},
+                host=CONFIG.SERVICE_HOST,
+                port=args.port,
+                parcel_columns=CONFIG.SERVICE_PARCEL_COLUMNS,
+                poll_seconds=CONFIG.SERVICE_POLL_SECONDS,
+            )
+        )
+    else:
+        if args.profile is not None:
+            from lib.profiling import configure_profiling
+
+            configure_profiling(
+                os.path.join(
+                    CONFIG.PROFILE_DIR,
+                    "stages.jsonl" if args.profile == "jsonl" else "stages.trace.json",
+                ),
+                args.profile,
+                cprofile=args.cprofile or [],
+                cprofile_dir=os.path.join(CONFIG.PROFILE_DIR, "cprofile"),
+            )
+
+        # keep CONFIG order whatever the order given on the command line
+        layers = [layer for layer in CONFIG.layer_mapping if layer in args.layers]
+        if args.scenarios is not None:
+            run_scenarios(args.scenarios, force=args.force, workers=args.workers)
+        elif args.panel:
+            run_panel(layers, force=args.force, workers=args.workers)
+        else:
+            run(
+                layers,
+                workers=args.workers,
+                force=args.force,
+                incremental=args.incremental,
+                streaming=args.streaming,
+                tiles=args.tiles,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Fixtures of the tests: small synthetic inputs from benchmarks/synthetic.py,
+on which the lib functions are checked against the implementations they
+replaced (kept in the benchmarks/bench_*.py scripts that time them).
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path[:0] = [os.path.join(ROOT, "src"), os.path.join(ROOT, "benchmarks")]
+
+# synthetic parcels the checks run on, enough for every layer to have
+# several groups and every quartile several parcels
+N_PARCELS = 5_000
+
+
+@pytest.fixture(scope="session")
+def inputs():
+    """
+    Synthetic parcels, du_est rows and ACS tables.
+    """
+    from synthetic import make_parcels, make_du_est, make_acs_tables
+
+    parcels = make_parcels(N_PARCELS)
+    du_est = make_du_est(parcels)
+    acs_table_t, acs_table_bg = make_acs_tables(du_est)
+    return {
+        "parcels": parcels,
+        "du_est": du_est,
+        "acs_table_t": acs_table_t,
+        "acs_table_bg": acs_table_bg,
+    }
+
+
+@pytest.fixture(scope="session")
+def analytic(inputs):
+    """
+    The analytic dataset, as process_data receives it.
+    """
+    from lib.data import build_analytic_dataset, optimize_dtypes
+
+    return optimize_dtypes(
+        build_analytic_dataset(
+            inputs["parcels"],
+            inputs["du_est"],
+            inputs["acs_table_t"],
+            inputs["acs_table_bg"],
+        )
+    )
+
+
+@pytest.fixture
+def processed(analytic):
+    """
+    The processed dataset, as the layers are aggregated from; a fresh frame
+    for every test, as some stages change their input.
+    """
+    from lib.data import optimize_dtypes
+    from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+
+    return optimize_dtypes(
+        process_data(analytic.copy()), code_columns=QUARTILE_CODE_COLUMNS
+    )
@@ -0,0 +1,109 @@
+import glob
+import importlib.util
+import os
+
+import pandas as pd
+import pytest
+
+from lib.cache import cached_stage, evict_stages, source_fingerprint, stage_key
+
+
+class Compute:
+    """
+    Stage computation counting its calls.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({"geo_id": [1, 2, 3], "du_est_final": [1.5, 2.0, 0.0]})
+
+
+def load_module(path: str):
+    spec = importlib.util.spec_from_file_location("stage_source", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_hit_reads_cached_result(tmp_path, frame):
+    compute = Compute(frame)
+    first = cached_stage(str(tmp_path), "stage", "key", compute)
+    second = cached_stage(str(tmp_path), "stage", "key", compute)
+
+    assert compute.calls == 1
+    pd.testing.assert_frame_equal(first, frame)
+    pd.testing.assert_frame_equal(second, frame)
+
+
+def test_hit_reads_cached_tuple(tmp_path, frame):
+    compute = Compute((frame, frame.head(1)))
+    cached_stage(str(tmp_path), "stage", "key", compute)
+    first, second = cached_stage(str(tmp_path), "stage", "key", compute)
+
+    assert compute.calls == 1
+    pd.testing.assert_frame_equal(first, frame)
+    pd.testing.assert_frame_equal(second, frame.head(1))
+
+
+def test_source_change_misses(tmp_path, frame):
+    source = tmp_path / "stage_source.py"
+    source.write_text("def build():\n    return 1\n", encoding="utf-8")
+    key = stage_key("inputs", source_fingerprint(load_module(str(source)).build))
+    compute = Compute(frame)
+    cached_stage(str(tmp_path / "cache"), "stage", key, compute)
+
+    # the same source hits, whatever its modification time
+    os.utime(source, (0, 0))
+    same_key = stage_key("inputs", source_fingerprint(load_module(str(source)).build))
+    cached_stage(str(tmp_path / "cache"), "stage", same_key, compute)
+    assert same_key == key and compute.calls == 1
+
+    source.write_text("def build():\n    return 2\n", encoding="utf-8")
+    new_key = stage_key("inputs", source_fingerprint(load_module(str(source)).build))
+    cached_stage(str(tmp_path / "cache"), "stage", new_key, compute)
+    assert new_key != key and compute.calls == 2
+
+
+def test_force_recomputes(tmp_path, frame):
+    cached_stage(str(tmp_path), "stage", "key", Compute(frame))
+    compute = Compute(frame.assign(du_est_final=0.0))
+    result = cached_stage(str(tmp_path), "stage", "key", compute, force=True)
+
+    assert compute.calls == 1
+    # the forced result replaces the cached one
+    pd.testing.assert_frame_equal(
+        cached_stage(str(tmp_path), "stage", "key", Compute(frame)), result
+    )
+
+
+def test_eviction_keeps_recently_used_stages(tmp_path, frame):
+    cache_dir = str(tmp_path)
+    for i, name in enumerate(["a", "b", "c"]):
+        cached_stage(cache_dir, name, "key", Compute(frame))
+        os.utime(os.path.join(cache_dir, f"{name}-key.parquet"), (i, i))
+    size = os.path.getsize(os.path.join(cache_dir, "a-key.parquet"))
+
+    # a hit marks "a" as the most recently used stage
+    compute = Compute(frame)
+    cached_stage(cache_dir, "a", "key", compute)
+    assert compute.calls == 0
+
+    def cached():
+        return sorted(
+            os.path.basename(path) for path in glob.glob(os.path.join(cache_dir, "*"))
+        )
+
+    # room for three stages: the least recently used one, "b", is evicted
+    cached_stage(cache_dir, "d", "key", Compute(frame), max_bytes=3 * size)
+    assert cached() == ["a-key.parquet", "c-key.parquet", "d-key.parquet"]
+    evict_stages(cache_dir, 2 * size)
+    assert cached() == ["a-key.parquet", "d-key.parquet"]
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyogrio
+import pytest
+
+from bench_aggregations import GEO_COLUMNS, aggregate_by_geo_id_legacy, aggregations
+from bench_assign_geographies import LAYERS, sjoin_reference
+from bench_join import build_analytic_dataset_legacy
+from synthetic import make_boundary_layer
+
+from lib import data
+from lib.data import (
+    GEOID_COLUMNS,
+    ROUNDED_MEAN,
+    aggregate_by_geo_id,
+    assign_geographies,
+    build_analytic_dataset,
+    get_boundary_layers,
+    mean_and_round,
+    optimize_dtypes,
+)
+from lib.variables import process_data
+
+
+def test_analytic_dataset_equal_merge_chain(inputs):
+    args = [
+        inputs["parcels"],
+        inputs["du_est"],
+        inputs["acs_table_t"],
+        inputs["acs_table_bg"],
+    ]
+    df = build_analytic_dataset(*args)
+    # the merge chain changes its inputs
+    expected = build_analytic_dataset_legacy(*[arg.copy() for arg in args])
+
+    # the planned join keeps geo ids as int64, on a fresh index
+    expected = expected.reset_index(drop=True)
+    for col in GEOID_COLUMNS:
+        expected[col] = expected[col].astype(np.int64)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(df), pd.DataFrame(expected), check_exact=True
+    )
+
+
+@pytest.mark.parametrize("geo_col", GEO_COLUMNS)
+def test_rounded_mean_equal_python_callable(analytic, geo_col):
+    # the Python callable predates the compact dtypes of the quartile codes
+    df = process_data(analytic.copy())
+    pd.testing.assert_frame_equal(
+        aggregate_by_geo_id(df, geo_col, aggregations(ROUNDED_MEAN)),
+        aggregate_by_geo_id_legacy(df, geo_col, aggregations(mean_and_round)),
+        check_exact=True,
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_assign_geographies_equal_sjoin(inputs, workers):
+    parcels = inputs["parcels"]
+    layer_mapping = {layer: geo_col for layer, (geo_col, _) in LAYERS.items()}
+    # fewer polygons than in Durham, so each holds a few parcels
+    boundaries = {
+        layer: make_boundary_layer(parcels, max(n_polygons // 10, 2), geo_col, seed=i)
+        for i, (layer, (geo_col, n_polygons)) in enumerate(LAYERS.items())
+    }
+    geographies = assign_geographies(
+        parcels, boundaries, layer_mapping, workers=workers
+    )
+
+    for layer, geo_col in layer_mapping.items():
+        np.testing.assert_array_equal(
+            geographies[geo_col].to_numpy(),
+            sjoin_reference(parcels, boundaries[layer], geo_col).to_numpy(),
+            err_msg=layer,
+        )
+
+
+def test_optimize_dtypes_keeps_fractional_counts():
+    df = pd.DataFrame(
+        {
+            "du_est_final": [1.5, 2.0, 0.4],
+            "students2324": [1.0, np.nan, 0.5],
+            "students2223": [1.0, np.nan, 3.0],
+            "students2122": [1.0, 2.0, 3.0],
+        }
+    )
+    optimized = optimize_dtypes(df)
+
+    # fractions are kept as they are, with or without missing values
+    pd.testing.assert_series_equal(optimized["du_est_final"], df["du_est_final"])
+    pd.testing.assert_series_equal(optimized["students2324"], df["students2324"])
+    # whole counts are downcast without changing a value
+    assert optimized["students2223"].dtype == "Int32"
+    assert optimized["students2122"].dtype == np.int32
+    pd.testing.assert_frame_equal(optimized.astype(np.float64), df, check_exact=True)
+
+
+def write_boundaries(gdb: str, parcels, n_polygons: int) -> None:
+    layer = make_boundary_layer(parcels, n_polygons, "geo_id")
+    layer["geo_id"] = layer["geo_id"].astype(np.int32)
+    pyogrio.write_dataframe(layer, gdb, layer="layer", driver="OpenFileGDB")
+
+
+def test_boundary_cache_rebuilt_for_new_gdb(tmp_path, monkeypatch, inputs):
+    parcels = inputs["parcels"]
+    gdb = str(tmp_path / "layers.gdb")
+    cache_dir = str(tmp_path / "cache")
+    write_boundaries(gdb, parcels, 10)
+
+    reads = []
+    read_vector = data.read_vector
+
+    def counted_read_vector(*args, **kwargs):
+        reads.append(args)
+        return read_vector(*args, **kwargs)
+
+    monkeypatch.setattr(data, "read_vector", counted_read_vector)
+
+    # a cache directory of an older version of the GDB, and one of another GDB
+    stale = os.path.join(cache_dir, "layers.gdb-0123456789abcdef")
+    other = os.path.join(cache_dir, "other.gdb-0123456789abcdef")
+    for path in [stale, other]:
+        os.makedirs(path)
+        make_boundary_layer(parcels, 3, "geo_id").to_parquet(
+            os.path.join(path, "layer.parquet")
+        )
+
+    first = get_boundary_layers(gdb, ["layer"], cache_dir=cache_dir)["layer"]
+    assert len(reads) == 1 and len(first) == 10
+    assert not os.path.exists(stale) and os.path.exists(other)
+    cached = get_boundary_layers(gdb, ["layer"], cache_dir=cache_dir)["layer"]
+    assert len(reads) == 1
+    pd.testing.assert_frame_equal(cached, first)
+
+    # a newly published GDB is read again, and its old copies dropped
+    (old_copy,) = [
+        name for name in os.listdir(cache_dir) if name != "other.gdb-0123456789abcdef"
+    ]
+    write_boundaries(gdb, parcels, 20)
+    rebuilt = get_boundary_layers(gdb, ["layer"], cache_dir=cache_dir)["layer"]
+    assert len(reads) == 2 and len(rebuilt) == 20
+    assert old_copy not in os.listdir(cache_dir)
@@ -0,0 +1,19 @@
+import pandas as pd
+import pytest
+
+from bench_distribution import AGG, RTOL, naive
+
+from main import CONFIG
+from lib.data import aggregate_by_geo_id
+
+
+@pytest.mark.parametrize("layer", list(CONFIG.layer_mapping))
+def test_distributional_aggregates_equal_groupby_apply(processed, layer):
+    geo_col = CONFIG.layer_mapping[layer]
+    pd.testing.assert_frame_equal(
+        aggregate_by_geo_id(processed, geo_col, AGG),
+        naive(processed, geo_col),
+        check_dtype=False,
+        check_index_type=False,
+        rtol=RTOL,
+    )
@@ -0,0 +1,16 @@
+import numpy as np
+import shapely
+
+from synthetic import make_coverage_layer
+
+from lib.geometry import count_vertices, optimize_geometry
+
+
+def test_optimized_geometry_is_same_coverage():
+    layer = make_coverage_layer(50, "geo_id_b2020")
+    optimized = optimize_geometry(layer, 20.0, 1.0)
+
+    assert count_vertices(optimized.geometry) < count_vertices(layer.geometry)
+    # the simplified boundaries still tile the area, without gaps or overlaps
+    assert shapely.coverage_is_valid(optimized.geometry.to_numpy())
+    assert np.isclose(optimized.area.sum(), layer.area.sum(), rtol=1e-3)
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import CONFIG, layer_aggregations
+from lib.data import aggregate_by_geo_id, optimize_dtypes
+from lib.incremental import save_snapshot, update_aggregates
+from lib.variables import process_data, unit_value_thresholds, QUARTILE_CODE_COLUMNS
+
+AGGREGATIONS = {layer: layer_aggregations(layer) for layer in CONFIG.layer_mapping}
+
+# relative difference allowed between float sums updated by subtraction and
+# addition, and added up from the rows
+RTOL = 1e-9
+
+
+def process(analytic: pd.DataFrame) -> pd.DataFrame:
+    return optimize_dtypes(
+        process_data(analytic.copy()), code_columns=QUARTILE_CODE_COLUMNS
+    )
+
+
+def move_geographies(analytic: pd.DataFrame, rng) -> pd.DataFrame:
+    """
+    Parcels moved to the blocks, planning units and schools of other parcels.
+    """
+    df = analytic.copy()
+    moved = rng.choice(len(df), 100, replace=False)
+    donors = rng.choice(len(df), 100, replace=False)
+    for col in ["geo_id_b2020", "geo_id_bg2020", "pu_2324_848", "sch_id_base_es"]:
+        df.iloc[moved, df.columns.get_loc(col)] = df[col].iloc[donors].to_numpy()
+    return df
+
+
+def change_parcels(analytic: pd.DataFrame, rng) -> pd.DataFrame:
+    """
+    Parcels with new values, and parcels deleted and added.
+    """
+    df = analytic.copy()
+    changed = rng.choice(len(df), 200, replace=False)
+    col = df.columns.get_loc("TOTAL_PROP_VALUE")
+    df.iloc[changed, col] = df["TOTAL_PROP_VALUE"].iloc[changed].to_numpy() * 3
+    df = df.drop(index=df.index[rng.choice(len(df), 150, replace=False)])
+    added = df.sample(120, random_state=0).assign(REID=[f"new{i}" for i in range(120)])
+    return pd.concat([df, added], ignore_index=True)
+
+
+def assert_equal_full_recompute(aggregates: dict, df: pd.DataFrame) -> None:
+    for layer, agg_df in aggregates.items():
+        pd.testing.assert_frame_equal(
+            agg_df,
+            aggregate_by_geo_id(df, CONFIG.layer_mapping[layer], AGGREGATIONS[layer]),
+            check_dtype=False,
+            rtol=RTOL,
+            obj=layer,
+        )
+
+
+@pytest.mark.parametrize("edit", [move_geographies, change_parcels])
+def test_update_equals_full_recompute(tmp_path, analytic, edit):
+    rng = np.random.default_rng(0)
+    before = process(analytic)
+    changed, snapshot = update_aggregates(
+        before, CONFIG.layer_mapping, AGGREGATIONS, str(tmp_path)
+    )
+    assert set(changed) == set(CONFIG.layer_mapping)
+    save_snapshot(str(tmp_path), snapshot)
+
+    after = process(edit(analytic, rng))
+    changed, snapshot = update_aggregates(
+        after, CONFIG.layer_mapping, AGGREGATIONS, str(tmp_path)
+    )
+    assert changed
+    assert_equal_full_recompute(snapshot["aggregates"], after)
+
+    # moves leave the quartile thresholds as they are, value changes move them
+    thresholds_moved = any(
+        not np.array_equal(old, new, equal_nan=True)
+        for old, new in zip(
+            unit_value_thresholds(before).values(),
+            unit_value_thresholds(after).values(),
+        )
+    )
+    assert thresholds_moved == (edit is change_parcels)
+
+
+def test_rebase_recomputes_group_states(tmp_path, analytic):
+    rng = np.random.default_rng(1)
+    df = process(analytic)
+    _, snapshot = update_aggregates(
+        df, CONFIG.layer_mapping, AGGREGATIONS, str(tmp_path), rebase_after=3
+    )
+    save_snapshot(str(tmp_path), snapshot)
+    for _ in range(2):
+        df = process(change_parcels(df, rng))
+        _, snapshot = update_aggregates(
+            df, CONFIG.layer_mapping, AGGREGATIONS, str(tmp_path), rebase_after=3
+        )
+        save_snapshot(str(tmp_path), snapshot)
+        assert_equal_full_recompute(snapshot["aggregates"], df)
+    assert snapshot["updates"] == 2
+
+    # the third update recomputes the states from the rows: the aggregates are
+    # exactly those of a full recompute
+    _, snapshot = update_aggregates(
+        df, CONFIG.layer_mapping, AGGREGATIONS, str(tmp_path), rebase_after=3
+    )
+    assert snapshot["updates"] == 0
+    for layer, agg_df in snapshot["aggregates"].items():
+        expected = aggregate_by_geo_id(
+            df, CONFIG.layer_mapping[layer], AGGREGATIONS[layer]
+        )
+        pd.testing.assert_frame_equal(agg_df, expected, check_exact=True)
+
+    # recomputing exact aggregates again changes no layer
+    save_snapshot(str(tmp_path), snapshot)
+    changed, _ = update_aggregates(
+        df, CONFIG.layer_mapping, AGGREGATIONS, str(tmp_path), rebase_after=1
+    )
+    assert changed == {}
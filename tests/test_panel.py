@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench_panel import per_year
+
+from main import CONFIG
+from lib.data import optimize_dtypes, student_columns
+from lib.variables import process_data, QUARTILE_CODE_COLUMNS
+from lib.panel import panel_aggregates, school_year
+
+
+@pytest.fixture(scope="module")
+def panel_dataset(analytic):
+    """
+    The processed dataset with the student counts of two earlier school years.
+    """
+    df = analytic.copy()
+    rng = np.random.default_rng(0)
+    for year in [18, 19]:
+        df[f"students{year:02d}{year + 1:02d}"] = rng.poisson(0.4 * df["du_est_final"])
+    return optimize_dtypes(process_data(df), code_columns=QUARTILE_CODE_COLUMNS)
+
+
+@pytest.mark.parametrize("layer", list(CONFIG.layer_mapping))
+def test_panel_equal_pass_per_year(panel_dataset, layer):
+    geo_col = CONFIG.layer_mapping[layer]
+    columns = student_columns(panel_dataset.columns)
+    panel = panel_aggregates(panel_dataset, geo_col, CONFIG.PANEL_AGGREGATIONS)
+
+    names = [geo_col, "students_sum", "students_mean"]
+    for col, expected in zip(columns, per_year(panel_dataset, geo_col, columns)):
+        year = panel[panel["year"] == school_year(col)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            year[names], expected.set_axis(names, axis=1), check_dtype=False
+        )
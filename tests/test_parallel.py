@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+import pyogrio
+
+from synthetic import make_boundary_layer
+
+import main
+from main import CONFIG, run_layers
+
+LAYERS = ["t2020", "ES_base_2223", "regions_2025_26"]
+
+# formats with a file per layer, compared byte for byte
+OUTPUT_FORMATS = ["csv", "geoparquet"]
+
+
+@pytest.fixture
+def boundaries_gdb(tmp_path, processed):
+    """
+    DPS all layers with LAYERS only, a polygon per geo id of the parcels.
+    """
+    path = str(tmp_path / "dps_all_layers.gdb")
+    for i, layer in enumerate(LAYERS):
+        geo_col = CONFIG.layer_mapping[layer]
+        geo_ids = np.sort(processed[geo_col].dropna().unique())
+        gdf = make_boundary_layer(processed, len(geo_ids), geo_col, seed=i)
+        # float ids, as GDB fields cannot hold 64-bit integers
+        gdf[geo_col] = geo_ids[: len(gdf)].astype(np.float64)
+        pyogrio.write_dataframe(gdf, path, layer=layer, driver="OpenFileGDB")
+    return path
+
+
+def run(tmp_path, monkeypatch, boundaries_gdb, processed, workers: int) -> dict:
+    """
+    Run the layers with workers, returning {relative path: bytes} of the
+    outputs.
+    """
+    output_dir = tmp_path / f"outputs-{workers}"
+    monkeypatch.setattr(CONFIG, "PATH_DPS_LAYERS", boundaries_gdb)
+    monkeypatch.setattr(CONFIG, "OUTPUT_DIR", str(output_dir))
+    monkeypatch.setattr(CONFIG, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(CONFIG, "OUTPUT_FORMATS", OUTPUT_FORMATS)
+    for path in main.output_paths(LAYERS[0], shared=False).values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    run_layers(LAYERS, processed, workers=workers)
+
+    outputs = {}
+    for root, _, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                outputs[os.path.relpath(path, output_dir)] = f.read()
+    return outputs
+
+
+def test_workers_write_identical_outputs(
+    tmp_path, monkeypatch, boundaries_gdb, processed
+):
+    serial = run(tmp_path, monkeypatch, boundaries_gdb, processed, workers=1)
+    parallel = run(tmp_path, monkeypatch, boundaries_gdb, processed, workers=2)
+
+    assert len(serial) == len(LAYERS) * len(OUTPUT_FORMATS)
+    assert serial.keys() == parallel.keys()
+    for path, content in serial.items():
+        assert parallel[path] == content, path
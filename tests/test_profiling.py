@@ -0,0 +1,59 @@
+import importlib
+import json
+import sys
+
+import pytest
+
+from lib import profiling
+
+
+@pytest.fixture
+def without_resource(monkeypatch):
+    """
+    lib.profiling as imported where the resource module and /proc are
+    missing (Windows).
+    """
+    monkeypatch.setitem(sys.modules, "resource", None)
+    monkeypatch.setattr(sys, "platform", "win32")
+    yield importlib.reload(profiling)
+    monkeypatch.undo()
+    importlib.reload(profiling)
+
+
+def read_records(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_stage_records_peak_memory(tmp_path, monkeypatch):
+    monkeypatch.delenv("DPS_PROFILE", raising=False)
+    path = tmp_path / "stages.jsonl"
+    profiling.configure_profiling(str(path))
+    try:
+        with profiling.stage("outer"):
+            with profiling.stage("inner", layer="t2020"):
+                pass
+    finally:
+        profiling.configure_profiling(None)
+
+    records = read_records(path)
+    assert [record["stage"] for record in records] == ["inner", "outer"]
+    assert records[0]["layer"] == "t2020"
+    assert all(record["peak_rss_delta_mb"] >= 0 for record in records)
+
+
+def test_stage_without_peak_memory(tmp_path, monkeypatch, without_resource):
+    monkeypatch.delenv("DPS_PROFILE", raising=False)
+    assert without_resource.resource is None
+    path = tmp_path / "stages.jsonl"
+    without_resource.configure_profiling(str(path))
+    try:
+        with without_resource.stage("outer"):
+            with without_resource.stage("inner"):
+                pass
+    finally:
+        without_resource.configure_profiling(None)
+
+    records = read_records(path)
+    assert [record["stage"] for record in records] == ["inner", "outer"]
+    assert all("peak_rss_delta_mb" not in record for record in records)
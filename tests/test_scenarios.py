@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from bench_scenarios import RTOL, SCHOOL_COL, UNIT_COL
+
+from main import CONFIG
+from lib.data import aggregate_by_geo_id
+from lib.scenarios import current_assignment, evaluate_scenarios, unit_statistics
+
+N_SCENARIOS = 20
+
+
+def test_scenarios_equal_grouping(processed):
+    agg = CONFIG.aggregations
+    state = unit_statistics(processed, UNIT_COL, agg)
+    current = current_assignment(processed, UNIT_COL, SCHOOL_COL)
+    rng = np.random.default_rng(0)
+    assignments = np.tile(current.to_numpy(), (N_SCENARIOS, 1))
+    changed = rng.random(assignments.shape) < 0.2
+    assignments[changed] = rng.choice(current.unique(), np.count_nonzero(changed))
+
+    result = evaluate_scenarios(state, assignments, agg, school_col=SCHOOL_COL)
+
+    units = processed[UNIT_COL].to_numpy()
+    for scenario in range(N_SCENARIOS):
+        schools = pd.Series(assignments[scenario], index=current.index)
+        assigned = processed.assign(**{SCHOOL_COL: schools.reindex(units).to_numpy()})
+        pd.testing.assert_frame_equal(
+            result[result["scenario"] == scenario]
+            .drop(columns="scenario")
+            .reset_index(drop=True),
+            aggregate_by_geo_id(assigned, SCHOOL_COL, agg),
+            check_dtype=False,
+            rtol=RTOL,
+        )
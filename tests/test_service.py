@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import socket
+
+import pytest
+
+from main import CONFIG, layer_aggregations
+from lib.data import aggregate_by_geo_id
+from lib.service import MANIFEST, geo_key, publish_snapshot, read_manifest, serve
+
+LAYERS = ["t2020", "ES_base_2223"]
+
+# seconds between two checks of the manifest by the service under test
+POLL_SECONDS = 0.05
+
+
+def test_publish_keeps_latest_snapshots(tmp_path, processed):
+    frame = processed[["REID", "geo_id_t2020"]].head(10)
+    snapshot_dir = str(tmp_path)
+    # a snapshot published earlier, named as if the clock had been ahead
+    stale = os.path.join(snapshot_dir, "parcels-29991231T235959-1-1.parquet")
+    frame.to_parquet(stale)
+    os.utime(stale, (0, 0))
+
+    first = publish_snapshot(frame, snapshot_dir, keep=2)
+    second = publish_snapshot(frame, snapshot_dir, keep=2)
+
+    assert second["sequence"] == first["sequence"] + 1
+    assert second["id"] != first["id"]
+    assert read_manifest(snapshot_dir) == second
+    assert sorted(
+        name for name in os.listdir(snapshot_dir) if name.endswith(".parquet")
+    ) == sorted([first["path"], second["path"]])
+
+    # the snapshot of the manifest is kept whatever the other snapshots
+    third = publish_snapshot(frame, snapshot_dir, keep=1)
+    assert sorted(os.listdir(snapshot_dir)) == sorted([MANIFEST, third["path"]])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def request(port: int, raw: bytes) -> list:
+    """
+    Send raw bytes on a new connection and read the responses until the
+    service closes it, as [(status, headers, body)].
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    responses = []
+    try:
+        while True:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            status_line, *header_lines = head.decode("latin-1").split("\r\n")
+            headers = dict(line.lower().split(": ", 1) for line in header_lines if line)
+            body = await reader.readexactly(int(headers["content-length"]))
+            responses.append((int(status_line.split(" ")[1]), headers, body))
+            if headers.get("connection") == "close":
+                break
+    except asyncio.IncompleteReadError:
+        pass
+    writer.close()
+    return responses
+
+
+async def get(port: int, target: str) -> tuple:
+    responses = await request(
+        port, f"GET {target} HTTP/1.1\r\nConnection: close\r\n\r\n".encode()
+    )
+    return responses[0]
+
+
+async def wait_for_snapshot(port: int, snapshot_id: str) -> dict:
+    for _ in range(400):
+        try:
+            status, _, body = await get(port, "/status")
+        except ConnectionRefusedError:
+            status = None
+        if status == 200 and json.loads(body)["snapshot"]["id"] == snapshot_id:
+            return json.loads(body)
+        await asyncio.sleep(POLL_SECONDS)
+    raise AssertionError(f"snapshot {snapshot_id} was not loaded")
+
+
+def test_service_over_loopback(tmp_path, processed):
+    snapshot_dir = str(tmp_path)
+    port = free_port()
+    aggregations = {layer: layer_aggregations(layer) for layer in LAYERS}
+    first = publish_snapshot(processed, snapshot_dir)
+
+    async def scenario():
+        service = asyncio.create_task(
+            serve(
+                snapshot_dir,
+                CONFIG.layer_mapping,
+                aggregations,
+                port=port,
+                parcel_columns=["REID", "unit_val"],
+                poll_seconds=POLL_SECONDS,
+            )
+        )
+        try:
+            await wait_for_snapshot(port, first["id"])
+
+            # aggregates of a tract, as aggregate_by_geo_id gives them
+            geo_col = CONFIG.layer_mapping["t2020"]
+            expected = aggregate_by_geo_id(
+                processed, geo_col, aggregations["t2020"]
+            ).iloc[0]
+            geo_id = geo_key(expected[geo_col])
+            status, _, body = await get(port, f"/layers/t2020/{geo_id}")
+            assert status == 200
+            assert json.loads(body) == pytest.approx(
+                json.loads(expected.to_json(double_precision=15)), rel=1e-12
+            )
+            status, _, body = await get(port, f"/layers/t2020/{geo_id}/parcels")
+            assert status == 200
+            assert (
+                len(json.loads(body)) == (processed[geo_col] == expected[geo_col]).sum()
+            )
+            assert (await get(port, "/layers/t2020/0"))[0] == 404
+            assert (await get(port, "/nothing"))[0] == 404
+
+            # requests kept alive on one connection, and a body skipped by
+            # its content-length
+            responses = await request(
+                port,
+                b"GET /layers HTTP/1.1\r\n\r\n"
+                b"GET /layers HTTP/1.1\r\ncontent-length: 4\r\n\r\nbody"
+                b"POST /layers HTTP/1.1\r\nConnection: close\r\n\r\n",
+            )
+            assert [status for status, _, _ in responses] == [200, 200, 405]
+            assert json.loads(responses[0][2]) == LAYERS
+
+            # HEAD gets the headers of GET without the body
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"HEAD /layers HTTP/1.0\r\n\r\n")
+            head = await asyncio.wait_for(reader.read(), 10)
+            writer.close()
+            assert head.startswith(b"HTTP/1.1 200 OK") and head.endswith(
+                f"Content-Length: {len(responses[0][2])}\r\n"
+                "Connection: close\r\n\r\n".encode()
+            )
+
+            # malformed requests get 400 and the connection is closed
+            for raw in [
+                b"GET /status HTTP/1.1\r\ncontent-length: abc\r\n\r\n",
+                b"GET /status HTTP/1.1\r\ncontent-length: -5\r\n\r\n",
+                b"GET\r\n\r\n",
+            ]:
+                responses = await request(port, raw)
+                assert [status for status, _, _ in responses] == [400]
+                assert responses[0][1]["connection"] == "close"
+
+            # a newly published snapshot is swapped in
+            second = publish_snapshot(processed.head(100), snapshot_dir)
+            status_body = await wait_for_snapshot(port, second["id"])
+            assert status_body["parcels"] == 100
+        finally:
+            service.cancel()
+            await asyncio.gather(service, return_exceptions=True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,56 @@
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+import pytest
+
+from synthetic import make_layer
+
+from lib.data import convert_datetime_to_str
+from lib.sinks import SINKS, is_shared, sink_path, write_layer
+
+
+def read_back(output_format: str, path: str, gdf: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    Read a layer written in a format, in the row and column order of gdf.
+    """
+    if output_format == "csv":
+        strings = {col: str for col in gdf.columns if gdf[col].dtype == "str"}
+        df = pd.read_csv(path, dtype=strings)
+        written = gpd.GeoDataFrame(
+            df.drop(columns="geometry"),
+            geometry=gpd.GeoSeries.from_wkt(df["geometry"]),
+            crs=gdf.crs,
+        )
+    elif output_format == "geoparquet":
+        written = gpd.read_parquet(path)
+    else:
+        assert pyogrio.list_layers(path)[:, 0].tolist() == ["layer"]
+        written = gpd.read_file(path, layer="layer", fid_as_index=True)
+        # the OBJECTID of a GDB layer is its feature id
+        if "OBJECTID" not in written:
+            written["OBJECTID"] = written.index
+
+    # the spatial index of FlatGeobuf orders features along a curve
+    return written.sort_values("OBJECTID", ignore_index=True)[list(gdf.columns)]
+
+
+@pytest.mark.parametrize("output_format", list(SINKS))
+def test_sink_round_trip(tmp_path, output_format):
+    # dates as strings, as main.py writes them to the GDB
+    gdf = convert_datetime_to_str(make_layer(200))
+    path = sink_path(str(tmp_path), output_format, "layer", str(tmp_path / "out.gdb"))
+    if not is_shared(output_format):
+        (tmp_path / SINKS[output_format]["dir"]).mkdir()
+    write_layer(gdf, "layer", {output_format: path})
+
+    written = read_back(output_format, path, gdf)
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(written.drop(columns="geometry")),
+        pd.DataFrame(gdf.drop(columns="geometry")),
+        check_dtype=False,
+    )
+    assert written.crs == gdf.crs
+    # the GDB keeps the rings of polygons clockwise, and its coordinates on a
+    # grid of its XY resolution
+    tolerance = 1e-3 if output_format == "gdb" else 0
+    assert written.normalize().geom_equals_exact(gdf.normalize(), tolerance).all()
@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+MAIN = os.path.join("src", "main.py")
+
+# cumulative import time allowed for a cold start of the CLI, in seconds
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", 0.5))
+
+# modules that must only be imported once the pipeline actually runs
+HEAVY_MODULES = ["pandas", "geopandas", "fiona", "pyogrio", "rpy2", "lib"]
+
+
+def import_times(*args: str) -> dict:
+    """
+    Function to run main.py under -X importtime and return the cumulative
+    import time in seconds of every module it imported.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", MAIN, *args],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # nested imports are indented; only top level ones add up
+        times[name.strip()] = (int(cumulative) / 1e6, not name.startswith("  "))
+    return times
+
+
+@pytest.mark.parametrize("args", [["--help"], ["--list-layers"]])
+def test_startup_within_budget(args):
+    times = import_times(*args)
+    total = sum(seconds for seconds, top_level in times.values() if top_level)
+    assert total < STARTUP_BUDGET, f"cold start imports took {total:.3f}s"
+
+
+@pytest.mark.parametrize("args", [["--help"], ["--list-layers"]])
+def test_startup_skips_heavy_imports(args):
+    times = import_times(*args)
+    imported = [
+        name
+        for name in times
+        if any(name == mod or name.startswith(mod + ".") for mod in HEAVY_MODULES)
+    ]
+    assert imported == []
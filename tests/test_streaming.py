@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import CONFIG, layer_aggregations
+from lib.data import (
+    DU_EST_COLUMNS,
+    PARCEL_COLUMNS,
+    aggregate_by_geo_id,
+    build_analytic_dataset,
+    get_du_est,
+    get_parcels,
+)
+from lib.streaming import exact_quantiles, stream_aggregates
+from lib.variables import process_data
+
+AGGREGATIONS = {layer: layer_aggregations(layer) for layer in CONFIG.layer_mapping}
+
+# rows per chunk, so that the last chunk of the parcels is a partial one
+CHUNK_SIZE = 1_300
+
+# float sums are added partition by partition
+RTOL = 1e-9
+
+
+def test_stream_aggregates_equal_in_memory(tmp_path, inputs):
+    assert len(inputs["parcels"]) % CHUNK_SIZE
+    parcels_path = str(tmp_path / "parcels.parquet")
+    du_est_path = str(tmp_path / "du_est.csv")
+    inputs["parcels"].to_parquet(parcels_path)
+    inputs["du_est"].to_csv(du_est_path, index=False)
+    census = (inputs["acs_table_t"], inputs["acs_table_bg"])
+
+    df = process_data(
+        build_analytic_dataset(
+            get_parcels(parcels_path, columns=PARCEL_COLUMNS),
+            get_du_est(du_est_path, columns=DU_EST_COLUMNS),
+            *census,
+        )
+    )
+    streamed = stream_aggregates(
+        parcels_path,
+        du_est_path,
+        *census,
+        CONFIG.layer_mapping,
+        AGGREGATIONS,
+        str(tmp_path / "work"),
+        PARCEL_COLUMNS,
+        DU_EST_COLUMNS,
+        chunk_size=CHUNK_SIZE,
+    )
+
+    assert set(streamed) == set(CONFIG.layer_mapping)
+    for layer, geo_col in CONFIG.layer_mapping.items():
+        pd.testing.assert_frame_equal(
+            streamed[layer],
+            aggregate_by_geo_id(df, geo_col, AGGREGATIONS[layer]),
+            check_dtype=False,
+            rtol=RTOL,
+            obj=layer,
+        )
+
+
+@pytest.mark.parametrize("max_values", [2**20, 64])
+def test_exact_quantiles_with_ties(max_values):
+    rng = np.random.default_rng(0)
+    # few distinct values, many of them repeated, negatives, zeros and NaN
+    values = rng.choice([-2.5, -0.0, 0.0, 1.0, 1.0 + 2**-52, 3.0, np.nan], 10_007)
+    values[:4_000] = 1.0
+    rng.shuffle(values)
+    probs = np.array([0, 0.25, 0.3, 0.5, 0.75, 0.999, 1])
+
+    def read_chunks():
+        return np.array_split(values, 13)
+
+    expected = pd.Series(values).quantile(probs).to_numpy()
+    # max_values below the size of the ties forces the histogram refinement
+    np.testing.assert_array_equal(
+        exact_quantiles(read_chunks, probs, max_values=max_values, n_bins=16),
+        expected,
+    )
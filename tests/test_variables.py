@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench_process_data import add_geography_averages_legacy
+
+from lib.data import build_analytic_dataset
+from lib.variables import (
+    add_geography_averages,
+    assign_quantile_category,
+    process_data,
+)
+
+
+def test_geography_averages_equal_merge_chain(inputs):
+    df = process_data(
+        build_analytic_dataset(
+            inputs["parcels"],
+            inputs["du_est"],
+            inputs["acs_table_t"],
+            inputs["acs_table_bg"],
+        )
+    )
+    # process_data up to the geography averages
+    df = df.loc[:, :"unit_val_cat_multi"]
+
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(add_geography_averages(df)),
+        pd.DataFrame(add_geography_averages_legacy(df)),
+        check_exact=True,
+    )
+
+
+def assign_quartile_legacy(values: pd.Series) -> pd.Series:
+    """
+    Function reproducing the quartile binning of process_data before it was
+    vectorized: a Python comparison chain per value.
+    """
+    quartiles = values.quantile([0, 0.25, 0.5, 0.75, 1])
+
+    def assign_quartile(unit_val):
+        if unit_val >= quartiles.iloc[3]:
+            return 4
+        elif unit_val >= quartiles.iloc[2]:
+            return 3
+        elif unit_val >= quartiles.iloc[1]:
+            return 2
+        else:
+            return 1
+
+    return values.apply(assign_quartile)
+
+
+@pytest.mark.parametrize("designation", [None, "single", "multi", "other"])
+def test_quantile_categories_equal_comparison_chain(designation):
+    rng = np.random.default_rng(0)
+    n = 2_000
+    df = pd.DataFrame(
+        {
+            # heavy ties, and missing values
+            "unit_val": rng.choice([1e5, 2e5, 2e5, 3e5, np.nan], n)
+            + np.where(rng.random(n) < 0.5, 0, rng.uniform(0, 1e5, n)),
+            # no parcel is designated "other"
+            "designation": rng.choice(["single", "multi"], n),
+        }
+    )
+    assign_quantile_category(
+        df,
+        "unit_val",
+        "category",
+        by=None if designation is None else "designation",
+        partition=designation,
+    )
+
+    in_partition = (
+        np.ones(n, dtype=bool)
+        if designation is None
+        else (df["designation"] == designation).to_numpy()
+    )
+    expected = assign_quartile_legacy(df.loc[in_partition, "unit_val"])
+    pd.testing.assert_series_equal(
+        df["category"],
+        expected.reindex(df.index).rename("category"),
+        check_dtype=False,
+    )
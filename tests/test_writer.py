@@ -0,0 +1,44 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyogrio
+import pytest
+
+from bench_gdb_writer import write_gdb_layer_legacy
+from synthetic import make_layer
+
+from lib.data import convert_datetime_to_str
+from lib.writer import write_gdb_layer
+
+
+@pytest.mark.parametrize("use_pyogrio", [True, False])
+def test_gdb_layer_equal_per_row_export(tmp_path, use_pyogrio):
+    gdf = convert_datetime_to_str(make_layer(500))
+    write_gdb_layer_legacy(gdf, str(tmp_path / "legacy.gdb"), "layer")
+    write_gdb_layer(gdf, str(tmp_path / "layer.gdb"), "layer", use_pyogrio=use_pyogrio)
+
+    reference = gpd.read_file(tmp_path / "legacy.gdb", layer="layer")
+    written = gpd.read_file(tmp_path / "layer.gdb", layer="layer")
+    pd.testing.assert_frame_equal(
+        pd.DataFrame(written.drop(columns="geometry")),
+        pd.DataFrame(reference.drop(columns="geometry")),
+    )
+    assert written.geometry.geom_equals_exact(reference.geometry, 0).all()
+
+
+def test_gdb_field_types_equal_fiona(tmp_path):
+    gdf = convert_datetime_to_str(make_layer(50))
+    gdf["count"] = pd.array([1, None] * 25, dtype="Int64")
+    gdf["large_id"] = np.int64(2**40) + np.arange(50)
+
+    field_types = {}
+    for use_pyogrio in [True, False]:
+        path = str(tmp_path / f"{use_pyogrio}.gdb")
+        write_gdb_layer(gdf, path, "layer", use_pyogrio=use_pyogrio)
+        info = pyogrio.read_info(path, layer="layer")
+        field_types[use_pyogrio] = dict(zip(info["fields"], info["dtypes"]))
+
+    assert field_types[True] == field_types[False]
+    # integers are written as 32-bit fields where they fit
+    assert field_types[True]["count"] == "int32"
+    assert field_types[True]["large_id"] == "float64"